@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.html_extract import RecordExtractor, Selector, css_class, parse_html
+
+AMAZON_URL = 'https://www.amazon.it'
+
+# Selectors of a deal card, compiled once
+DEAL_CARDS = RecordExtractor(
+    f"//div[{css_class('a-section', 'octopus-dlp-asin-section')}]",
+    required=('href', 'name', 'price_whole'),
+    href=Selector(f".//a[{css_class('a-link-normal')}]", 'href'),
+    img_link=Selector(f".//img[{css_class('octopus-dlp-asin-image')}]", 'src'),
+    name=Selector(f".//a[{css_class('a-size-base', 'a-color-base', 'a-link-normal', 'a-text-normal')}]"),
+    price_whole=Selector(f".//span[{css_class('a-price-whole')}]"),
+    price_fraction=Selector(f".//span[{css_class('a-price-fraction')}]"),
+    old_price=Selector(f".//span[{css_class('a-text-strike')}]"),
+    percentage=Selector(f".//div[{css_class('oct-deal-badge-label')}]"),
+)
+
+
+def parse_deals(content):
+    """[{"link", "img_link", "name", "price", "old_price", "percentage"}] of a deal page; cards without a link, name or price are skipped"""
+    deals = []
+    for card in DEAL_CARDS.extract(parse_html(content)):
+        deals.append({
+            'link': AMAZON_URL + card['href'],
+            'img_link': card['img_link'] or '',
+            'name': card['name'],
+            'price': card['price_whole'] + (card['price_fraction'] or ''),
+            'old_price': card['old_price'] or '',
+            'percentage': card['percentage'] or '',
+        })
+    return deals
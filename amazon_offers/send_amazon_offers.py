@@ -1,13 +1,17 @@
+import os
+import sys
 import requests
-from bs4 import BeautifulSoup
 from telegram import *
 from telegram.ext import *
 from telegram.constants import ParseMode
 
 import asyncio
-import time
 #import pyshorteners
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.send_queue import AsyncSendQueue, log_send_failure
+from deal_parser import parse_deals
+
 TELEGRAM_TOKEN = 'your-telegram-bot-token'
 CHAT_ID = 'your-chat-id'
 REF_CODE = "your-referral-code-here"
@@ -15,6 +19,9 @@ REF_CODE = "your-referral-code-here"
 # Define a dictionary to keep track of sent items
 sent_items = set()
 
+# Rate-limited outbound queue, replaces the fixed sleep between messages
+send_queue = AsyncSendQueue()
+
 """
 def shorten_amazon_link_with_referral(link, referral_code):
     # Add referral code to the link
@@ -33,35 +40,34 @@ async def scrape_amazon_offers(update: Update, context: CallbackContext) -> None
 
     while True:
         url = 'https://www.amazon.it/deal/98a64104?pf_rd_r=3NZQ5JN1YFVSEKT6MWBW&pf_rd_t=Events&pf_rd_i=deals&pf_rd_p=08c3b6f5-c277-48d7-92b2-370f1198a648&pf_rd_s=slot-17&ref=dlx_deals_gd_dcl_img_2_98a64104_dt_sl17_48'
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        items = soup.find_all('div', {'class': 'a-section octopus-dlp-asin-section'})
-
-        for item in items:
-            link = 'https://www.amazon.it' + item.find('a', {'class': 'a-link-normal'})['href']
-            img_link = item.find('img', {'class': 'octopus-dlp-asin-image'})['src']
-            name = item.find('a', {'class': 'a-size-base a-color-base a-link-normal a-text-normal'}).text.strip()
-            price = item.find('span', {'class': 'a-price-whole'}).text.strip() + item.find('span', {'class': 'a-price-fraction'}).text.strip()
-            old_price = item.find('span', {'class':'a-text-strike'}).text.strip()
-            percentage = item.find('div', {'class': 'oct-deal-badge-label'}).text.strip()
-            #asin = item.find('td', {'class' : 'prodDetAttrValue'}).text.strip()
-            #print("ASIN: ", asin)
+        response = await asyncio.to_thread(requests.get, url)  # Don't block the event loop
+        deals = await asyncio.to_thread(parse_deals, response.content)
 
+        for deal in deals:
+            link = deal['link']
             if link not in sent_items:
-                message = f"<a href='{img_link}'>📌</a> <b>{name}</b>\n\n💰 {price}€ invece di {old_price}\n\n🔥{percentage}\n\n➡️ <a href='{link}'>{link}</a>"
+                message = f"<a href='{deal['img_link']}'>📌</a> <b>{deal['name']}</b>\n\n💰 {deal['price']}€ invece di {deal['old_price']}\n\n🔥{deal['percentage']}\n\n➡️ <a href='{link}'>{link}</a>"
                 sent_items.add(link)
-                await context.bot.send_message(chat_id=CHAT_ID, text=message, parse_mode=ParseMode.HTML)
-                time.sleep(3)    
-        time.sleep(10)
+                send_queue.submit(context.bot.send_message, chat_id=CHAT_ID, text=message, parse_mode=ParseMode.HTML).add_done_callback(
+                    log_send_failure(f"sending the offer {link}"))
+        await asyncio.sleep(10)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(f'Hello {update.effective_user.first_name}')
 
 
+async def start_send_queue(app: Application) -> None:
+    await send_queue.start()
+
+
+async def stop_send_queue(app: Application) -> None:
+    await send_queue.stop()
+
+
 def main():
 
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = ApplicationBuilder().token(TELEGRAM_TOKEN).post_init(start_send_queue).post_shutdown(stop_send_queue).build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("test", scrape_amazon_offers))
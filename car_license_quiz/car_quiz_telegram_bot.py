@@ -1,14 +1,23 @@
-# pip install python-telegram-bot==13.15
+# pip install "python-telegram-bot[job-queue]==20.7"
+import asyncio
 import logging
-import json
 import os
 import random 
+import sys
 import time
-import datetime
-import math
-import re
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, ParseMode
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.error import BadRequest
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
+from question_bank import QuestionBank
+from quiz_storage import SQLiteQuizStorage, create_storage, migrate_journal_state, parse_chat_id
+from quiz_scheduler import ALL_HOURS, QuizScheduler, format_hours, parse_hours
+from file_id_cache import FileIdCache
+from spaced_repetition import LEITNER_INTERVALS, ReviewScheduler
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.keyboards import inline_keyboard
+from common.send_queue import BULK, INTERACTIVE, SCHEDULED, AsyncSendQueue, log_send_failure
 
 # Configure logging
 logging.basicConfig(
@@ -24,16 +33,28 @@ logger = logging.getLogger(__name__)
 # Configuration
 prefix = ""
 data_path = os.path.join(prefix, 'quizPatenteB2023.json')
+snapshot_path = os.path.join(prefix, 'quizPatenteB2023.qsnap')  # Built with quiz_snapshot.py, optional
 quiz_state_file = os.path.join(prefix, 'unanswered_quizzes.json')
+quiz_journal_file = os.path.join(prefix, 'unanswered_quizzes.journal')
+quiz_db_file = os.path.join(prefix, 'quiz.db')
+file_id_cache_file = os.path.join(prefix, 'file_ids.json')
+file_id_warmup_chat_id = None  # Set to a private chat ID to pre-upload every sign image at startup
+storage_backend = 'sqlite'  # 'sqlite' (state, answers and statistics) or 'journal' (state only)
+max_active_quizzes = 20  # Per chat
+category_weights = {}  # Extra weight of some categories for new questions, e.g. {'segnali-pericolo': 2}
+quiz_spread_seconds = 900  # Scheduled quizzes are spread over the first 15 minutes of the hour
+max_scheduled_sends_per_second = 20  # Stay below Telegram's global limit of 30 messages per second
 bot_token = "#TODO"  # Replace with your actual bot token
 chat_id = "#TODO"    # Replace with your actual chat ID
 
 class QuizData:
-    def __init__(self, question, answer, image, timestamp=None):
+    def __init__(self, question, answer, image, timestamp=None, chat_id=None, question_id=None):
         self.question = question
         self.answer = answer
         self.image = image
         self.timestamp = timestamp or time.time()
+        self.chat_id = chat_id
+        self.question_id = question_id
     
     def to_dict(self):
         """Convert QuizData object to dictionary for JSON serialization"""
@@ -41,7 +62,9 @@ class QuizData:
             'question': self.question,
             'answer': self.answer,
             'image': self.image,
-            'timestamp': self.timestamp
+            'timestamp': self.timestamp,
+            'chat_id': self.chat_id,
+            'question_id': self.question_id
         }
     
     @classmethod
@@ -51,175 +74,197 @@ class QuizData:
             question=data['question'],
             answer=data['answer'],
             image=data['image'],
-            timestamp=data.get('timestamp')
+            timestamp=data.get('timestamp'),
+            chat_id=data.get('chat_id'),
+            question_id=data.get('question_id')
         )
 
-# Global dictionary to store quiz data instances and their corresponding message IDs
+# Global dictionary to store quiz data instances, keyed by (chat ID, message ID)
 quiz_data_dict = {}
 
-def save_quiz_state():
-    """Save the current quiz state to a file"""
-    try:
-        # Create a serializable representation of the quiz data
-        serializable_quiz_data = {}
-        for message_id, quiz_data in quiz_data_dict.items():
-            serializable_quiz_data[str(message_id)] = quiz_data.to_dict()
-        
-        # Create a backup of the previous state file if it exists
-        if os.path.exists(quiz_state_file):
-            backup_file = f"{quiz_state_file}.bak"
-            try:
-                os.replace(quiz_state_file, backup_file)
-            except Exception as e:
-                logger.warning(f"Could not create backup file: {e}")
-        
-        # Write the new state
-        with open(quiz_state_file, 'w') as file:
-            json.dump(serializable_quiz_data, file)
-        logger.info(f"Quiz state saved to {quiz_state_file}")
-    except Exception as e:
-        logger.error(f"Error saving quiz state: {e}")
+# Question database, parsed once at startup and reloaded only when the file changes
+question_bank = QuestionBank(data_path, snapshot_path)
+
+# Spaced-repetition schedule of every chat, picks the next question to send
+review_scheduler = ReviewScheduler(question_bank, category_weights)
+
+# Persistent storage for active quizzes, answers and statistics
+quiz_storage = create_storage(storage_backend, quiz_db_file if storage_backend == 'sqlite' else quiz_state_file,
+                              quiz_journal_file, default_chat_id=parse_chat_id(chat_id))
 
 def load_quiz_state():
-    """Load the quiz state from a file"""
+    """Load the unanswered quizzes from storage"""
     global quiz_data_dict
     try:
-        if os.path.exists(quiz_state_file):
-            with open(quiz_state_file, 'r') as file:
-                serialized_data = json.load(file)
-            
-            # Convert the loaded data back to QuizData objects
-            temp_quiz_data = {}
-            for message_id, quiz_data in serialized_data.items():
-                temp_quiz_data[int(message_id)] = QuizData.from_dict(quiz_data)
-            
-            quiz_data_dict = temp_quiz_data
-            logger.info(f"Quiz state loaded from {quiz_state_file} with {len(quiz_data_dict)} unanswered quizzes")
-        else:
-            logger.info("No quiz state file found, starting fresh")
-            quiz_data_dict = {}
+        # Import state saved by the JSON/journal backend before switching to SQLite
+        if isinstance(quiz_storage, SQLiteQuizStorage) and os.path.exists(quiz_state_file):
+            migrate_journal_state(quiz_storage, quiz_state_file, quiz_journal_file, parse_chat_id(chat_id))
+        
+        quiz_data_dict = {}
+        for (quiz_chat_id, message_id), quiz_data in quiz_storage.load_active().items():
+            quiz = QuizData.from_dict(quiz_data)
+            quiz.chat_id = quiz_chat_id
+            quiz_data_dict[(quiz_chat_id, message_id)] = quiz
+        logger.info(f"Quiz state loaded with {len(quiz_data_dict)} unanswered quizzes")
     except Exception as e:
         logger.error(f"Error loading quiz state: {e}")
         quiz_data_dict = {}  # Reset if there's an error
 
+# Rate-limited outbound queue for every quiz message and answer edit, started with the application
+send_queue = AsyncSendQueue()
+
+# Answer buttons of every quiz message, built once and serialized once
+ANSWER_KEYBOARD = inline_keyboard([[("Vero", 'true'), ("Falso", 'false')]])
+
+# Quiz sends and restorations running in the background, cancelled when the bot stops
+background_tasks = set()
+
+# Telegram file_ids of the sign images that have already been uploaded
+file_id_cache = FileIdCache(file_id_cache_file, prefix)
+
+# One heap-driven dispatcher for the hourly quizzes of every subscribed chat
+quiz_scheduler = QuizScheduler(spread_seconds=quiz_spread_seconds, max_sends_per_second=max_scheduled_sends_per_second)
+
+async def resolve_chat_id(bot, value):
+    """Numeric id of a configured chat, which may be given as '@channel'"""
+    chat_id = parse_chat_id(value)
+    if isinstance(chat_id, int):
+        return chat_id
+    return (await bot.get_chat(chat_id)).id
+
+async def load_subscriptions(bot, not_before):
+    """Subscribe the configured chat and restore the saved subscriptions"""
+    subscriptions = quiz_storage.load_subscriptions()
+    try:
+        # Stored by its numeric id, as Telegram reports it in updates
+        configured_chat_id = await resolve_chat_id(bot, chat_id)
+    except Exception as e:
+        logger.error(f"Cannot resolve the configured chat {chat_id}, it is not subscribed: {e}")
+        configured_chat_id = None
+    if configured_chat_id is not None and configured_chat_id not in subscriptions:
+        quiz_storage.save_subscription(configured_chat_id, ALL_HOURS)
+        subscriptions[configured_chat_id] = ALL_HOURS
+    for subscribed_chat_id, hours in subscriptions.items():
+        quiz_scheduler.subscribe(subscribed_chat_id, hours, not_before=not_before)
+    logger.info(f"Loaded {len(subscriptions)} quiz subscriptions")
+
+async def flush_quiz_storage(context: ContextTypes.DEFAULT_TYPE):
+    """Commit buffered storage writes"""
+    try:
+        quiz_storage.flush()
+    except Exception as e:
+        logger.error(f"Error flushing quiz storage: {e}")
+
 def load_questions():
-    """Load questions from the JSON file"""
+    """Load questions from the JSON file into the question bank"""
     try:
-        with open(data_path, 'r') as file:
-            data = json.load(file)
-        
-        questions = []
-        for category, category_questions in data.items():
-            for section, section_questions in category_questions.items():
-                for question_dict in section_questions:
-                    questions.append({
-                        'question': question_dict['q'],
-                        'answer': question_dict['a'],
-                        'image': question_dict.get('img', None)
-                    })
-        logger.info(f"Loaded {len(questions)} questions")
-        return questions
+        question_bank.load()
     except Exception as e:
         logger.error(f"Error loading questions: {e}")
-        return []
+    return question_bank
 
-def send_quiz(context: CallbackContext):
-    """Send a quiz question to the chat with retry logic"""
+def load_reviews():
+    """Load the spaced-repetition schedules from storage"""
     try:
-        # Check if we already have too many active quizzes
-        max_active_quizzes = 20
-        if len(quiz_data_dict) >= max_active_quizzes:
-            logger.warning(f"Too many active quizzes ({len(quiz_data_dict)}), skipping new quiz")
+        review_scheduler.load(quiz_storage.load_reviews())
+    except Exception as e:
+        logger.error(f"Error loading reviews: {e}")
+
+def run_in_background(coroutine):
+    """Run a coroutine without waiting for it, it is cancelled when the bot stops"""
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def send_quiz_message(bot, target_chat_id, quiz_data, tag, priority):
+    """Send a quiz message through the send queue and return it.
+
+    The photo is sent by cached file_id when possible, uploaded again if the
+    file_id is rejected, and replaced by a text-only message if it cannot be sent.
+    """
+    def send_photo(photo):
+        return send_queue.submit(
+            bot.send_photo,
+            chat_id=target_chat_id, 
+            photo=photo, 
+            caption=f"<b>{quiz_data.question}</b>\n\n{tag}", 
+            reply_markup=ANSWER_KEYBOARD, 
+            parse_mode=ParseMode.HTML,
+            read_timeout=15,
+            write_timeout=15,
+            priority=priority
+        )
+    
+    image_missing = False
+    upload = bool(quiz_data.image)
+    if quiz_data.image:
+        file_id = file_id_cache.get(quiz_data.image)
+        if file_id:
+            try:
+                return await send_photo(file_id)
+            except BadRequest as e:
+                # The cached file_id was rejected, upload the image again
+                logger.warning(f"Error sending cached photo {quiz_data.image}, uploading it: {e}")
+                file_id_cache.invalidate(quiz_data.image)
+            except Exception as e:
+                # Blocked chat, network errors, retries used up: the file_id is fine, keep it
+                logger.warning(f"Error sending cached photo {quiz_data.image}, sending text only: {e}")
+                image_missing = True
+                upload = False
+    
+    if upload:
+        try:
+            # Read the image once, so that the queue can retry the upload
+            with open(os.path.join(prefix, quiz_data.image), 'rb') as photo:
+                photo_bytes = photo.read()
+        except OSError as img_error:
+            logger.warning(f"Error reading quiz image {quiz_data.image}: {img_error}")
+            image_missing = True
+        else:
+            try:
+                message = await send_photo(photo_bytes)
+                file_id_cache.put(quiz_data.image, message.photo[-1].file_id)
+                return message
+            except Exception as e:
+                logger.warning(f"Error sending photo, sending text only: {e}")
+                image_missing = True
+    
+    if image_missing:
+        text = f"<b>{quiz_data.question}</b>\n\n(Image not available)\n\n{tag}"
+    else:
+        text = f"<b>{quiz_data.question}</b>\n\n{tag}"
+    return await send_queue.submit(
+        bot.send_message,
+        chat_id=target_chat_id, 
+        text=text, 
+        reply_markup=ANSWER_KEYBOARD, 
+        parse_mode=ParseMode.HTML,
+        read_timeout=15,
+        write_timeout=15,
+        priority=priority
+    )
+
+async def send_quiz(context: ContextTypes.DEFAULT_TYPE):
+    """Send a quiz question to the chat given in the job data"""
+    await send_quiz_to_chat(context, context.job.data)
+
+async def send_quiz_to_chat(context: ContextTypes.DEFAULT_TYPE, target_chat_id, priority=SCHEDULED):
+    """Send a quiz question to the chat, the send queue takes care of rate limits and retries"""
+    try:
+        # Check if we already have too many active quizzes in this chat
+        active_quizzes = quiz_storage.count_active(parse_chat_id(target_chat_id))
+        if active_quizzes >= max_active_quizzes:
+            logger.warning(f"Too many active quizzes in chat {target_chat_id} ({active_quizzes}), skipping new quiz")
             return
             
-        questions = load_questions()
-        if not questions:
+        question_bank.reload_if_changed()
+        question = review_scheduler.next_question(parse_chat_id(target_chat_id))
+        if question is None:
             logger.error("No questions available to send")
             return
         
-        question = random.choice(questions)
-        quiz_data = QuizData(question['question'], question['answer'], question['image'])
-      
-        keyboard = [
-            [InlineKeyboardButton("Vero", callback_data='true'),
-             InlineKeyboardButton("Falso", callback_data='false')],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        target_chat_id = context.job.context  # Get the chat ID from the job context
-        
-        max_attempts = 3
-        for attempt in range(1, max_attempts + 1):
-            try:
-                # Send the message based on whether there's an image
-                if question['image']:
-                    try:
-                        image_path = os.path.join(prefix, question['image'])
-                        with open(image_path, 'rb') as photo:
-                            message = context.bot.send_photo(
-                                chat_id=target_chat_id, 
-                                photo=photo, 
-                                caption=f"<b>{question['question']}</b>\n\n#car_question", 
-                                reply_markup=reply_markup, 
-                                parse_mode=ParseMode.HTML,
-                                timeout=15  # Increased timeout
-                            )
-                    except Exception as img_error:
-                        logger.warning(f"Error sending photo (attempt {attempt}/{max_attempts}): {img_error}")
-                        if attempt == max_attempts:
-                            # Final attempt, try text-only as fallback
-                            message = context.bot.send_message(
-                                chat_id=target_chat_id, 
-                                text=f"<b>{question['question']}</b>\n\n(Image not available)\n\n#car_question", 
-                                reply_markup=reply_markup, 
-                                parse_mode=ParseMode.HTML,
-                                timeout=15  # Increased timeout
-                            )
-                        else:
-                            # Try again with image
-                            time.sleep(3)  # Wait before retry
-                            continue
-                else:
-                    message = context.bot.send_message(
-                        chat_id=target_chat_id, 
-                        text=f"<b>{question['question']}</b>\n\n#car_question", 
-                        reply_markup=reply_markup, 
-                        parse_mode=ParseMode.HTML,
-                        timeout=15  # Increased timeout
-                    )
-                
-                # If we got here, the message was sent successfully
-                # Store the quiz data and save the state
-                quiz_data_dict[message.message_id] = quiz_data
-                save_quiz_state()
-                logger.info(f"Quiz sent with ID: {message.message_id}")
-                return  # Success, exit the function
-                
-            except Exception as e:
-                error_str = str(e).lower()
-                
-                # Handle rate limits specially
-                if "flood" in error_str or "too many requests" in error_str:
-                    retry_seconds = 30  # Default
-                    match = re.search(r'retry in (\d+\.\d+|\d+)', error_str)
-                    if match:
-                        retry_seconds = float(match.group(1)) + 5  # Add buffer
-                    
-                    logger.warning(f"Rate limit hit, will retry after {retry_seconds}s")
-                    if attempt < max_attempts:
-                        # Schedule retry instead of immediate retry
-                        context.job_queue.run_once(
-                            send_quiz,
-                            retry_seconds,
-                            context=target_chat_id
-                        )
-                        return
-                elif attempt < max_attempts:
-                    # For other errors, try again after short delay
-                    logger.warning(f"Error sending quiz (attempt {attempt}/{max_attempts}): {e}")
-                    time.sleep(attempt * 2)  # Increasing delay between attempts
-                else:
-                    logger.error(f"Failed to send quiz after {max_attempts} attempts: {e}")
-                    
+        quiz_data = QuizData(question.question, question.answer, question.image, question_id=question.key)
     except Exception as e:
         logger.error(f"Unexpected error in send_quiz: {e}")
         
@@ -228,21 +273,35 @@ def send_quiz(context: CallbackContext):
             context.job_queue.run_once(
                 send_quiz,
                 random.randint(60, 120),  # Random delay between 1-2 minutes
-                context=context.job.context
+                data=target_chat_id
             )
         except:
             pass  # If this fails too, just give up
+        return
+    
+    try:
+        message = await send_quiz_message(context.bot, target_chat_id, quiz_data, "#car_question", priority)
+    except Exception as e:
+        logger.error(f"Failed to send quiz: {e}")
+        return
+    
+    # Store the quiz once its message has been delivered
+    quiz_data.chat_id = message.chat_id
+    quiz_data_dict[(message.chat_id, message.message_id)] = quiz_data
+    quiz_storage.add_quiz(message.chat_id, message.message_id, quiz_data.to_dict())
+    logger.info(f"Quiz sent with ID: {message.message_id}")
 
-def button(update: Update, context: CallbackContext) -> None:
+async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button press from inline keyboard"""
     try:
         query = update.callback_query
-        query.answer()
+        await query.answer()
         
         message_id = query.message.message_id  # Get the message ID of the original message
+        quiz_key = (query.message.chat_id, message_id)
         
         # Check if the quiz data exists for this message
-        if message_id not in quiz_data_dict:
+        if quiz_key not in quiz_data_dict:
             logger.warning(f"Quiz data not found for message ID {message_id}")
             
             # Check if the message has an image (caption) or text
@@ -251,13 +310,13 @@ def button(update: Update, context: CallbackContext) -> None:
             try:
                 if has_caption:
                     # Message has an image, update the caption
-                    query.edit_message_caption(
+                    await query.edit_message_caption(
                         caption="Questo quiz non è più disponibile.",
                         parse_mode=ParseMode.HTML
                     )
                 else:
                     # Message is text-only, update the text
-                    query.edit_message_text(
+                    await query.edit_message_text(
                         text="Questo quiz non è più disponibile."
                     )
             except Exception as edit_error:
@@ -267,167 +326,132 @@ def button(update: Update, context: CallbackContext) -> None:
             
             return
         
-        quiz_data = quiz_data_dict.pop(message_id)  # Retrieve and remove the corresponding QuizData instance
-        answer_text = "Vero" if query.data == "true" else "Falso"
+        quiz_data = quiz_data_dict.pop(quiz_key, None)  # Retrieve and remove the corresponding QuizData instance
+        if quiz_data is None:
+            return  # Answered concurrently by another user
+        given_answer = query.data == "true"
+        answer_text = "Vero" if given_answer else "Falso"
         solution_text = "Vero" if quiz_data.answer else "Falso"
         
-        # Update the message with the answer
-        try:
-            if quiz_data.image:
-                query.edit_message_caption(
-                    caption=f"<b>{quiz_data.question}</b>\n\nHai risposto: {answer_text}\n\nLa soluzione è: {solution_text}", 
-                    parse_mode=ParseMode.HTML
-                )
-            else:
-                query.edit_message_text(
-                    text=f"<b>{quiz_data.question}</b>\n\nHai risposto: {answer_text}\n\nLa soluzione è: {solution_text}", 
-                    parse_mode=ParseMode.HTML
-                )
-        except Exception as e:
-            logger.error(f"Error updating message: {e}")
+        # Update the message with the answer, ahead of any scheduled quiz
+        # The handler does not wait for it, so a slow edit never holds up other updates
+        answer_message = f"<b>{quiz_data.question}</b>\n\nHai risposto: {answer_text}\n\nLa soluzione è: {solution_text}"
+        if quiz_data.image:
+            future = send_queue.submit(
+                context.bot.edit_message_caption,
+                chat_id=query.message.chat_id,
+                message_id=message_id,
+                caption=answer_message, 
+                parse_mode=ParseMode.HTML,
+                priority=INTERACTIVE
+            )
+        else:
+            future = send_queue.submit(
+                context.bot.edit_message_text,
+                chat_id=query.message.chat_id,
+                message_id=message_id,
+                text=answer_message, 
+                parse_mode=ParseMode.HTML,
+                priority=INTERACTIVE
+            )
+        future.add_done_callback(log_send_failure("updating message"))
             
-        # Save the updated state (quiz removed)
-        save_quiz_state()
+        # Persist the answer and remove the quiz from the active ones
+        quiz_storage.remove_quiz(query.message.chat_id, message_id)
+        correct = given_answer == bool(quiz_data.answer)
+        quiz_storage.record_answer(query.message.chat_id, message_id, query.from_user.id, quiz_data.question_id,
+                                   given_answer, correct)
+        
+        # Move the question to its next Leitner box in this chat
+        if quiz_data.question_id is not None:
+            box, due = review_scheduler.record_answer(query.message.chat_id, quiz_data.question_id, correct)
+            quiz_storage.save_review(query.message.chat_id, quiz_data.question_id, box, due)
         logger.info(f"Quiz answered: {message_id}")
     except Exception as e:
         logger.error(f"Error in button handler: {e}")
 
-def schedule_quiz_restoration(context: CallbackContext):
-    """Schedule restoration of quizzes with delay to avoid rate limits"""
+class QuizRestoration:
+    """Re-sends every unanswered quiz after a restart.
+
+    All quizzes are queued at once at BULK priority, so the send queue
+    delivers them as fast as Telegram's limits allow. The in-memory
+    dictionary is updated as each message arrives, while the message ID
+    remapping is committed to storage in a single batch at the end, also
+    when the restoration is cancelled by a shutdown.
+    """
+
+    def __init__(self, quiz_items):
+        self.quiz_items = quiz_items
+        self.total = len(quiz_items)
+        self.finished = 0
+        self.failed = 0
+        self.remaps = []  # (chat ID, old message ID, new message ID)
+        self.started = time.monotonic()
+        self.progress_step = max(1, self.total // 10)
+
+    async def run(self, bot):
+        logger.info(f"Restoring {self.total} quizzes")
+        try:
+            await asyncio.gather(*(self.restore_quiz(bot, quiz_key, quiz_data)
+                                   for quiz_key, quiz_data in self.quiz_items))
+        finally:
+            self.commit()
+
+    async def restore_quiz(self, bot, quiz_key, quiz_data):
+        """Send a quiz again and move it to its new message once it has been delivered"""
+        quiz_chat_id, message_id = quiz_key
+        try:
+            message = await send_quiz_message(bot, quiz_chat_id, quiz_data, "#car_question (Restored)", BULK)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error restoring quiz {message_id}: {e}")
+        else:
+            # Delete the old quiz from the dictionary, unless it was answered in the meantime
+            if quiz_data_dict.pop(quiz_key, None) is not None:
+                # Add the new quiz with new message ID
+                quiz_data_dict[(quiz_chat_id, message.message_id)] = quiz_data
+                self.remaps.append((quiz_chat_id, message_id, message.message_id))
+        
+        self.finished += 1
+        if self.finished % self.progress_step == 0 or self.finished == self.total:
+            logger.info(f"Quiz restoration progress: {self.finished}/{self.total} "
+                        f"({time.monotonic() - self.started:.1f}s)")
+
+    def commit(self):
+        """Persist every new message ID in one batch"""
+        try:
+            remaps = []
+            for quiz_chat_id, message_id, new_message_id in self.remaps:
+                if (quiz_chat_id, new_message_id) in quiz_data_dict:
+                    remaps.append((quiz_chat_id, message_id, new_message_id))
+                else:
+                    # Answered after it was restored, the answer was recorded under the new message ID
+                    quiz_storage.remove_quiz(quiz_chat_id, message_id)
+            quiz_storage.remap_quizzes(remaps)
+            quiz_storage.flush()
+            logger.info(f"Restored {len(self.remaps)} of {self.total} quizzes in "
+                        f"{time.monotonic() - self.started:.1f}s ({self.failed} failed)")
+        except Exception as e:
+            logger.error(f"Error saving restored quizzes: {e}")
+
+async def schedule_quiz_restoration(context: ContextTypes.DEFAULT_TYPE):
+    """Restore every unanswered quiz through the send queue"""
     try:
         # Clone the dict to avoid modifying during iteration
-        message_ids = list(quiz_data_dict.keys())
+        quiz_items = list(quiz_data_dict.items())
         
-        if not message_ids:
+        if not quiz_items:
             logger.info("No quizzes to restore")
             return
-            
-        logger.info(f"Scheduling restoration of {len(message_ids)} quizzes with delays")
         
-        # Schedule quizzes with a delay between each one
-        for i, message_id in enumerate(message_ids):
-            # Add increasing delay for each quiz (5 seconds between each quiz)
-            delay = 5 + (i * 5)  # Start with 5 seconds, then 10, 15, etc.
-            context.job_queue.run_once(
-                restore_single_quiz,
-                delay,
-                context={'message_id': message_id, 'attempt': 1}
-            )
-            
-        logger.info(f"Restoration of {len(message_ids)} quizzes has been scheduled")
+        run_in_background(QuizRestoration(quiz_items).run(context.bot))
     except Exception as e:
         logger.error(f"Error scheduling quiz restoration: {e}")
 
-def restore_single_quiz(context: CallbackContext):
-    """Restore a single quiz with retry logic for rate limits"""
-    try:
-        job_context = context.job.context
-        message_id = job_context['message_id']
-        attempt = job_context['attempt']
-        max_attempts = 5
-        
-        # Check if quiz still exists (might have been answered during delays)
-        if message_id not in quiz_data_dict:
-            logger.info(f"Quiz {message_id} no longer needs restoration (already answered)")
-            return
-            
-        quiz_data = quiz_data_dict[message_id]
-        bot = context.bot
-        
-        try:
-            # Create new quiz with the same data
-            keyboard = [
-                [InlineKeyboardButton("Vero", callback_data='true'),
-                 InlineKeyboardButton("Falso", callback_data='false')],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            if quiz_data.image:
-                try:
-                    image_path = os.path.join(prefix, quiz_data.image)
-                    with open(image_path, 'rb') as photo:
-                        message = bot.send_photo(
-                            chat_id=chat_id, 
-                            photo=photo, 
-                            caption=f"<b>{quiz_data.question}</b>\n\n#car_question (Restored)", 
-                            reply_markup=reply_markup, 
-                            parse_mode=ParseMode.HTML,
-                            timeout=10  # Increased timeout
-                        )
-                except Exception as img_error:
-                    logger.warning(f"Error sending restored photo: {img_error}")
-                    message = bot.send_message(
-                        chat_id=chat_id, 
-                        text=f"<b>{quiz_data.question}</b>\n\n(Image not available)\n\n#car_question (Restored)", 
-                        reply_markup=reply_markup, 
-                        parse_mode=ParseMode.HTML,
-                        timeout=10  # Increased timeout
-                    )
-            else:
-                message = bot.send_message(
-                    chat_id=chat_id, 
-                    text=f"<b>{quiz_data.question}</b>\n\n#car_question (Restored)", 
-                    reply_markup=reply_markup, 
-                    parse_mode=ParseMode.HTML,
-                    timeout=10  # Increased timeout
-                )
-            
-            # Success! Update the quiz_data_dict
-            # Delete the old quiz from the dictionary
-            del quiz_data_dict[message_id]
-            # Add the new quiz with new message ID
-            quiz_data_dict[message.message_id] = quiz_data
-            
-            # Save state after each successful restoration
-            save_quiz_state()
-            logger.info(f"Successfully restored quiz {message_id} -> {message.message_id}")
-            
-        except Exception as e:
-            error_str = str(e).lower()
-            
-            # Check if it's a rate limit error
-            if "flood" in error_str or "too many requests" in error_str:
-                # Extract retry time if available
-                retry_seconds = 30  # Default retry time
-                match = re.search(r'retry in (\d+\.\d+|\d+)', error_str)
-                if match:
-                    retry_seconds = float(match.group(1))
-                    # Add a small buffer
-                    retry_seconds = retry_seconds + 5
-                
-                if attempt < max_attempts:
-                    logger.warning(f"Rate limit hit for quiz {message_id}, retry in {retry_seconds}s (attempt {attempt}/{max_attempts})")
-                    # Schedule retry with exponential backoff
-                    context.job_queue.run_once(
-                        restore_single_quiz,
-                        retry_seconds,
-                        context={'message_id': message_id, 'attempt': attempt + 1}
-                    )
-                else:
-                    logger.error(f"Failed to restore quiz {message_id} after {max_attempts} attempts")
-            
-            # Handle connection timeouts with a retry
-            elif "timeout" in error_str or "timed out" in error_str:
-                if attempt < max_attempts:
-                    retry_seconds = 10 * attempt  # Increasing delay for timeouts
-                    logger.warning(f"Connection timeout for quiz {message_id}, retry in {retry_seconds}s (attempt {attempt}/{max_attempts})")
-                    context.job_queue.run_once(
-                        restore_single_quiz,
-                        retry_seconds,
-                        context={'message_id': message_id, 'attempt': attempt + 1}
-                    )
-                else:
-                    logger.error(f"Failed to restore quiz {message_id} after {max_attempts} attempts due to timeouts")
-            else:
-                logger.error(f"Error restoring quiz {message_id}: {e}")
-                
-    except Exception as e:
-        logger.error(f"Unexpected error in restore_single_quiz: {e}")
-
-def start_command(update: Update, context: CallbackContext) -> None:
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued"""
     try:
-        update.message.reply_text(
+        await update.message.reply_text(
             "Benvenuto al quiz della Patente B! Riceverai quiz con cadenza oraria.\n"
             "Usa /quiz per ricevere un quiz ora.\n"
             "Usa /help per maggiori informazioni."
@@ -435,63 +459,159 @@ def start_command(update: Update, context: CallbackContext) -> None:
     except Exception as e:
         logger.error(f"Error in start command: {e}")
 
-def help_command(update: Update, context: CallbackContext) -> None:
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued"""
     try:
-        update.message.reply_text(
+        await update.message.reply_text(
             "Comandi disponibili:\n"
             "/start - Inizia ad usare il bot\n"
             "/quiz - Richiedi un quiz immediatamente\n"
+            "/stats - Mostra le tue statistiche\n"
+            "/subscribe [ore] - Ricevi i quiz in questa chat (es. /subscribe 8-22)\n"
+            "/unsubscribe - Smetti di ricevere i quiz in questa chat\n"
             "/help - Mostra questo messaggio di aiuto\n\n"
             "I quiz vengono inviati automaticamente ogni ora."
         )
     except Exception as e:
         logger.error(f"Error in help command: {e}")
 
-def quiz_command(update: Update, context: CallbackContext) -> None:
+async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a quiz immediately when the command /quiz is issued"""
     try:
         # Limit how often users can request manual quizzes (prevent spam)
         user_id = update.effective_user.id
         user_chat_id = update.effective_chat.id
         
-        # Check if this is an authorized chat
-        if str(user_chat_id) != str(chat_id):
-            update.message.reply_text("Questo bot è configurato per funzionare solo in chat specifiche.")
+        # Check if this chat is subscribed
+        if user_chat_id not in quiz_scheduler:
+            await update.message.reply_text("Questa chat non è iscritta ai quiz. Usa /subscribe per iscriverti.")
             logger.warning(f"Unauthorized quiz request from chat {user_chat_id} (user {user_id})")
             return
             
-        # For simplicity, we just pass the job context directly to send_quiz
+        # Manual quizzes go ahead of the scheduled ones in the send queue
         logger.info(f"Manual quiz requested by user {user_id}")
-        context.job_queue.run_once(send_quiz, 1, context=user_chat_id)
-        update.message.reply_text("Quiz in arrivo!")
+        run_in_background(send_quiz_to_chat(context, user_chat_id, priority=INTERACTIVE))
+        await update.message.reply_text("Quiz in arrivo!")
     except Exception as e:
         logger.error(f"Error in quiz command: {e}")
-        update.message.reply_text("Si è verificato un errore nell'invio del quiz.")
+        await update.message.reply_text("Si è verificato un errore nell'invio del quiz.")
 
-def error_handler(update, context):
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Subscribe the chat to scheduled quizzes when the command /subscribe is issued"""
+    try:
+        try:
+            hours = parse_hours(' '.join(context.args)) if context.args else ALL_HOURS
+        except ValueError:
+            await update.message.reply_text("Formato non valido. Esempio: /subscribe 8-22 oppure /subscribe 7,12,18-20")
+            return
+        user_chat_id = update.effective_chat.id
+        quiz_storage.save_subscription(user_chat_id, hours)
+        quiz_scheduler.subscribe(user_chat_id, hours)
+        logger.info(f"Chat {user_chat_id} subscribed for hours {format_hours(hours)}")
+        await update.message.reply_text(f"Iscrizione attiva! Riceverai un quiz alle ore {format_hours(hours)}.")
+    except Exception as e:
+        logger.error(f"Error in subscribe command: {e}")
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop scheduled quizzes for the chat when the command /unsubscribe is issued"""
+    try:
+        user_chat_id = update.effective_chat.id
+        quiz_storage.remove_subscription(user_chat_id)
+        if quiz_scheduler.unsubscribe(user_chat_id):
+            logger.info(f"Chat {user_chat_id} unsubscribed")
+            await update.message.reply_text("Non riceverai più quiz in questa chat.")
+        else:
+            await update.message.reply_text("Questa chat non è iscritta ai quiz.")
+    except Exception as e:
+        logger.error(f"Error in unsubscribe command: {e}")
+
+def format_stats(label, stats):
+    """Format an (answered, correct) pair for the /stats reply"""
+    answered, correct = stats
+    if not answered:
+        return f"{label}: nessuna risposta"
+    return f"{label}: {correct}/{answered} risposte corrette ({correct * 100 // answered}%)"
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show answer statistics when the command /stats is issued"""
+    try:
+        user_stats = quiz_storage.user_stats(update.effective_user.id)
+        if user_stats is None:
+            await update.message.reply_text("Le statistiche non sono disponibili.")
+            return
+        chat_stats = quiz_storage.chat_stats(update.effective_chat.id)
+        box_counts = review_scheduler.box_counts(update.effective_chat.id)
+        await update.message.reply_text(
+            format_stats("Le tue risposte", user_stats) + "\n" +
+            format_stats("Risposte in questa chat", chat_stats) + "\n" +
+            f"Domande viste in questa chat: {sum(box_counts.values())}, "
+            f"memorizzate: {box_counts.get(len(LEITNER_INTERVALS), 0)}"
+        )
+    except Exception as e:
+        logger.error(f"Error in stats command: {e}")
+
+async def error_handler(update, context):
     """Log the error and send a message to the developer"""
     logger.error(f"Update {update} caused error: {context.error}")
     try:
         # Send error message to developer (optional)
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=chat_id,
             text=f"An error occurred: {context.error}"
         )
     except:
         pass
 
-def schedule_hourly_quiz(context: CallbackContext):
-    """Schedule quizzes at exact hours (00 minutes)"""
+async def warm_up_file_ids(context: ContextTypes.DEFAULT_TYPE):
+    """Upload every sign image that has no cached file_id to the warm-up chat"""
     try:
-        # Log the scheduling
-        next_time = context.job.next_t.strftime('%Y-%m-%d %H:%M:%S')
-        logger.info(f"Next quiz scheduled for {next_time}")
+        images = [image for image in question_bank.images if image not in file_id_cache]
+        logger.info(f"Pre-uploading {len(images)} quiz images to chat {file_id_warmup_chat_id}")
         
-        # Send the quiz
-        send_quiz(context)
+        async def upload(image):
+            try:
+                with open(os.path.join(prefix, image), 'rb') as photo:
+                    photo_bytes = photo.read()
+                message = await send_queue.submit(
+                    context.bot.send_photo,
+                    chat_id=file_id_warmup_chat_id,
+                    photo=photo_bytes,
+                    disable_notification=True,
+                    priority=BULK
+                )
+            except Exception as e:
+                logger.warning(f"Error pre-uploading {image}: {e}")
+                return
+            file_id_cache.put(image, message.photo[-1].file_id)
+            send_queue.submit(context.bot.delete_message, chat_id=message.chat_id, message_id=message.message_id,
+                              priority=BULK).add_done_callback(log_send_failure("deleting warm-up photo"))
+        
+        for image in images:
+            run_in_background(upload(image))
     except Exception as e:
-        logger.error(f"Error in schedule_hourly_quiz: {e}")
+        logger.error(f"Error warming up file ids: {e}")
+
+async def dispatch_scheduled_quizzes(context: ContextTypes.DEFAULT_TYPE):
+    """Start sending the quizzes of the chats whose hourly quiz is due"""
+    try:
+        for due_chat_id in quiz_scheduler.tick():
+            run_in_background(send_quiz_to_chat(context, due_chat_id))
+    except Exception as e:
+        logger.error(f"Error dispatching scheduled quizzes: {e}")
+
+async def start_send_queue(application: Application) -> None:
+    await send_queue.start()
+    # Schedule quizzes for every subscribed chat, starting from the next hour
+    # Wait at least 3 minutes so that restorations can complete first
+    await load_subscriptions(application.bot, not_before=time.time() + 180)
+
+async def stop_background_tasks(application: Application) -> None:
+    """Cancel pending sends and restorations, then stop the send queue"""
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await send_queue.stop()
+    quiz_storage.close()
 
 def main() -> None:
     """Start the bot"""
@@ -499,62 +619,59 @@ def main() -> None:
         # Load saved quiz state
         load_quiz_state()
         
-        # Create the Updater and pass it your bot's token
-        # For python-telegram-bot 13.15, we use the proper format for request_kwargs
-        updater = Updater(token=bot_token, use_context=True, request_kwargs={
-            'read_timeout': 30,
-            'connect_timeout': 30
-        })
+        # Load the question database once, sends reuse the in-memory index
+        load_questions()
+        
+        # Rebuild every chat's review schedule, it needs the questions loaded
+        load_reviews()
         
-        dispatcher = updater.dispatcher
+        # Create the Application and pass it your bot's token
+        # Updates are handled concurrently, so a slow Telegram call never holds up the other handlers
+        application = (
+            ApplicationBuilder()
+            .token(bot_token)
+            .read_timeout(30)
+            .connect_timeout(30)
+            .connection_pool_size(16)  # Room for the send queue workers next to the handlers' own calls
+            .concurrent_updates(True)
+            .post_init(start_send_queue)
+            .post_stop(stop_background_tasks)
+            .build()
+        )
         
         # Add command handlers
-        dispatcher.add_handler(CommandHandler("start", start_command))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("quiz", quiz_command))
+        application.add_handler(CommandHandler("start", start_command))
+        application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("quiz", quiz_command))
+        application.add_handler(CommandHandler("stats", stats_command))
+        application.add_handler(CommandHandler("subscribe", subscribe_command))
+        application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
         
         # Add callback handler for button responses
-        dispatcher.add_handler(CallbackQueryHandler(button))
+        application.add_handler(CallbackQueryHandler(button))
         
         # Add error handler
-        dispatcher.add_error_handler(error_handler)
+        application.add_error_handler(error_handler)
         
         # Add a job queue to schedule the send_quiz function
-        job_queue = updater.job_queue
-        
-        # Schedule quiz restoration with proper rate limiting
-        job_queue.run_once(schedule_quiz_restoration, 5)  # Wait 5 seconds after startup to schedule restoration
+        job_queue = application.job_queue
         
-        # Schedule quizzes at exact hours (19:00, 20:00, etc.)
-        # Calculate minutes and seconds until the next hour
-        now = datetime.datetime.now()
-        minutes_to_next_hour = 60 - now.minute
-        seconds_to_next_hour = minutes_to_next_hour * 60 - now.second
+        # Restore unanswered quizzes, the send queue applies the rate limits
+        job_queue.run_once(schedule_quiz_restoration, 5)  # Wait 5 seconds after startup to start restoration
         
-        # Schedule the first quiz to happen at the next hour
-        first_quiz_delay = seconds_to_next_hour
-        if first_quiz_delay < 180:  # If less than 3 minutes to next hour
-            # Add an hour to give time for restorations to complete
-            first_quiz_delay += 3600
-            
-        logger.info(f"First quiz will be sent in {math.ceil(first_quiz_delay/60)} minutes")
-        job_queue.run_once(send_quiz, first_quiz_delay, context=chat_id)
+        # Optionally pre-upload the sign images, so that every quiz photo is sent by file_id
+        if file_id_warmup_chat_id is not None:
+            job_queue.run_once(warm_up_file_ids, 10)
         
-        # Then schedule ongoing quizzes at the top of every hour
-        for hour in range(24):  # Schedule for each hour of the day (0-23)
-            job_queue.run_daily(
-                schedule_hourly_quiz, 
-                time=datetime.time(hour=hour, minute=0),
-                days=(0, 1, 2, 3, 4, 5, 6),
-                context=chat_id
-            )
+        # Commit batched storage writes regularly
+        job_queue.run_repeating(flush_quiz_storage, interval=5, first=5)
         
-        # Start the Bot
-        updater.start_polling(drop_pending_updates=True)  # Ignore updates that occurred while the bot was offline
-        logger.info("Bot started")
+        # Subscriptions are loaded once the bot is initialized (start_send_queue), the configured chat may need a lookup
+        job_queue.run_repeating(dispatch_scheduled_quizzes, interval=quiz_scheduler.tick_seconds, first=1)
         
         # Run the bot until you press Ctrl-C
-        updater.idle()
+        logger.info("Bot started")
+        application.run_polling(drop_pending_updates=True)  # Ignore updates that occurred while the bot was offline
     except Exception as e:
         logger.critical(f"Critical error in main function: {e}")
 
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Persistent map from quiz image paths to Telegram file_ids.
+
+    Once an image has been uploaded, Telegram returns a file_id that can be
+    sent again without re-uploading the bytes. Each entry remembers the
+    SHA-1 of the uploaded file; the file is only re-hashed when its size or
+    mtime change, and a different hash invalidates the cached file_id.
+    """
+
+    def __init__(self, path, base_dir=''):
+        self.path = path
+        self.base_dir = base_dir
+        self._entries = {}  # image -> {'file_id', 'sha1', 'size', 'mtime_ns'}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as file:
+                self._entries = json.load(file)
+            logger.info(f"Loaded {len(self._entries)} cached file ids from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading file id cache, starting empty: {e}")
+            self._entries = {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self._entries, file)
+        os.replace(tmp_path, self.path)
+
+    def _fingerprint(self, image):
+        stat = os.stat(os.path.join(self.base_dir, image))
+        return stat.st_size, stat.st_mtime_ns
+
+    def _sha1(self, image):
+        digest = hashlib.sha1()
+        with open(os.path.join(self.base_dir, image), 'rb') as file:
+            for chunk in iter(lambda: file.read(65536), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __contains__(self, image):
+        return image in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, image):
+        """Return the cached file_id for an image, or None if it has to be uploaded"""
+        entry = self._entries.get(image)
+        if entry is None:
+            return None
+        try:
+            size, mtime_ns = self._fingerprint(image)
+            if (size, mtime_ns) != (entry['size'], entry['mtime_ns']):
+                if self._sha1(image) != entry['sha1']:
+                    logger.info(f"Image {image} changed, dropping its cached file id")
+                    self.invalidate(image)
+                    return None
+                # Touched but identical, remember the new fingerprint
+                with self._lock:
+                    entry['size'], entry['mtime_ns'] = size, mtime_ns
+                    self._save()
+        except OSError as e:
+            logger.warning(f"Cannot check image {image}: {e}")
+        return entry['file_id']
+
+    def put(self, image, file_id):
+        """Remember the file_id Telegram assigned to an uploaded image"""
+        try:
+            size, mtime_ns = self._fingerprint(image)
+            sha1 = self._sha1(image)
+        except OSError as e:
+            logger.warning(f"Cannot fingerprint image {image}, not caching its file id: {e}")
+            return
+        with self._lock:
+            self._entries[image] = {'file_id': file_id, 'sha1': sha1, 'size': size, 'mtime_ns': mtime_ns}
+            self._save()
+
+    def invalidate(self, image):
+        with self._lock:
+            if self._entries.pop(image, None) is not None:
+                self._save()
@@ -0,0 +1,292 @@
+import hashlib
+import logging
+import json
+import os
+import random
+import threading
+from array import array
+from quiz_snapshot import QuizSnapshot, SnapshotError
+
+logger = logging.getLogger(__name__)
+
+NO_IMAGE = 0  # Image id used for questions without a picture
+
+
+def question_key(text, image):
+    """Stable id of a question, from its text and image; unlike its position it survives edits of the file"""
+    digest = hashlib.blake2b(f"{text}\0{image or ''}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1  # Fits a signed 64-bit SQLite integer
+
+
+class Question:
+    """A single quiz question, materialized on demand from the bank columns.
+
+    `id` is the position in the loaded file, `key` the stable id to store.
+    """
+    __slots__ = ('id', 'key', 'question', 'answer', 'image', 'category', 'section')
+
+    def __init__(self, id, question, answer, image, category, section):
+        self.id = id
+        self.key = question_key(question, image)
+        self.question = question
+        self.answer = answer
+        self.image = image
+        self.category = category
+        self.section = section
+
+    def __repr__(self):
+        return f"Question(id={self.id}, category={self.category!r}, section={self.section!r})"
+
+
+class _BankData:
+    """Immutable column store for one loaded version of the question file.
+
+    Questions are stored in file order, so every category and every section
+    is a contiguous range of question ids. The bank swaps whole instances of
+    this class on reload, so readers never see a half-built index.
+    """
+    __slots__ = ('texts', 'answers', 'image_ids', 'section_ids', 'image_names',
+                 'categories', 'category_bounds', 'sections', 'section_category',
+                 'section_bounds', 'section_lookup', 'category_lookup', 'image_lookup', 'by_image',
+                 'mtime_ns')
+
+    def __init__(self):
+        self.texts = []                      # question id -> question text
+        self.answers = bytearray()           # question id -> 1 (Vero) / 0 (Falso)
+        self.image_ids = array('H')          # question id -> image id (NO_IMAGE if none)
+        self.section_ids = array('H')        # question id -> section id
+        self.image_names = [None]            # image id -> relative image path
+        self.categories = []                 # category id -> name
+        self.category_bounds = array('I')    # category id -> first question id (+ sentinel)
+        self.sections = []                   # section id -> name
+        self.section_category = array('H')   # section id -> category id
+        self.section_bounds = array('I')     # section id -> first question id (+ sentinel)
+        self.section_lookup = {}             # (category, section) -> section id
+        self.category_lookup = {}            # category name -> category id
+        self.image_lookup = {}               # image path -> image id
+        self.by_image = {}                   # image id -> array of question ids
+        self.mtime_ns = None
+
+
+def _build(raw, mtime_ns=None):
+    """Flatten the nested category/section/question JSON into columns"""
+    data = _BankData()
+    image_lookup = data.image_lookup
+    for category, category_sections in raw.items():
+        category_id = len(data.categories)
+        data.categories.append(category)
+        data.category_lookup[category] = category_id
+        data.category_bounds.append(len(data.texts))
+        for section, section_questions in category_sections.items():
+            section_id = len(data.sections)
+            data.sections.append(section)
+            data.section_category.append(category_id)
+            data.section_lookup[(category, section)] = section_id
+            data.section_bounds.append(len(data.texts))
+            for question_dict in section_questions:
+                question_id = len(data.texts)
+                image = question_dict.get('img') or None
+                image_id = NO_IMAGE
+                if image:
+                    image_id = image_lookup.get(image)
+                    if image_id is None:
+                        image_id = len(data.image_names)
+                        image_lookup[image] = image_id
+                        data.image_names.append(image)
+                        data.by_image[image_id] = array('I')
+                    data.by_image[image_id].append(question_id)
+                data.texts.append(question_dict['q'])
+                data.answers.append(1 if question_dict['a'] else 0)
+                data.image_ids.append(image_id)
+                data.section_ids.append(section_id)
+    data.category_bounds.append(len(data.texts))
+    data.section_bounds.append(len(data.texts))
+    data.mtime_ns = mtime_ns
+    return data
+
+
+class QuestionBank:
+    """In-memory, indexed view of the quiz question file.
+
+    The JSON file is parsed once; afterwards questions are served from compact
+    columns and only materialized as `Question` records when picked. Random
+    and filtered sampling (by category, section or image) are O(1) because
+    categories and sections map to contiguous id ranges.
+
+    If `snapshot_path` points to a compiled snapshot (see quiz_snapshot.py)
+    built from the current version of the JSON file, the columns are
+    memory-mapped from it instead of parsing the JSON.
+    """
+
+    def __init__(self, path, snapshot_path=None, rng=None):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self._rng = rng or random.Random()
+        self._data = _BankData()
+        self._key_index = (None, {})  # (bank data, {question key: question id}), built on first use
+        self._loaded_stamp = None
+        self._reload_lock = threading.Lock()
+
+    def _source_mtime_ns(self):
+        """Modification time of the question file, falling back to the snapshot alone"""
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                return None
+            raise
+
+    def _version(self):
+        """(mtime of the question file or None, mtime of the file served, watched by reload_if_changed)"""
+        mtime_ns = self._source_mtime_ns()
+        if mtime_ns is not None:
+            return mtime_ns, mtime_ns
+        return None, os.stat(self.snapshot_path).st_mtime_ns
+
+    def _load_snapshot(self, mtime_ns):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            snapshot = QuizSnapshot(self.snapshot_path)
+        except (OSError, SnapshotError) as e:
+            logger.warning(f"Cannot open question snapshot {self.snapshot_path}: {e}")
+            return None
+        if mtime_ns is not None and snapshot.source_mtime_ns != mtime_ns:
+            logger.warning(f"Question snapshot {self.snapshot_path} is stale, "
+                           f"recompile it with quiz_snapshot.py; parsing {self.path} instead")
+            return None
+        return snapshot
+
+    def load(self):
+        """(Re)load the question file and swap in the new index"""
+        mtime_ns, stamp = self._version()
+        data = self._load_snapshot(mtime_ns)
+        source = self.snapshot_path
+        if data is None:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                raw = json.load(file)
+            data = _build(raw, mtime_ns)
+            source = self.path
+        self._data = data
+        self._loaded_stamp = stamp
+        logger.info(f"Loaded {len(data.texts)} questions in {len(data.categories)} categories "
+                    f"and {len(data.sections)} sections from {source}")
+        return self
+
+    def reload_if_changed(self):
+        """Reload the question file (or the snapshot, without one) only if its mtime changed since the last load.
+
+        Returns True if a reload happened. A failed reload keeps serving the
+        previously loaded questions.
+        """
+        try:
+            _, stamp = self._version()
+        except OSError as e:
+            logger.error(f"Cannot stat question file {self.path}: {e}")
+            return False
+        if stamp == self._loaded_stamp:
+            return False
+        with self._reload_lock:
+            if stamp == self._loaded_stamp:
+                return False
+            try:
+                self.load()
+                return True
+            except Exception as e:
+                logger.error(f"Error reloading questions, keeping previous version: {e}")
+                return False
+
+    def __len__(self):
+        return len(self._data.texts)
+
+    @property
+    def categories(self):
+        return list(self._data.categories)
+
+    def sections(self, category):
+        """Names of the sections in a category"""
+        data = self._data
+        category_id = data.category_lookup[category]
+        return [data.sections[section_id] for section_id in range(len(data.sections))
+                if data.section_category[section_id] == category_id]
+
+    def category_sizes(self):
+        """{category: number of questions}, in file order"""
+        data = self._data
+        bounds = data.category_bounds
+        return {category: bounds[category_id + 1] - bounds[category_id]
+                for category_id, category in enumerate(data.categories)}
+
+    @property
+    def mtime_ns(self):
+        """Modification time of the loaded question file, changes on every reload"""
+        return self._data.mtime_ns
+
+    @property
+    def images(self):
+        """Distinct image paths referenced by the questions"""
+        return self._data.image_names[1:]
+
+    def get(self, question_id, data=None):
+        """Materialize the question with the given id"""
+        data = data or self._data
+        section_id = data.section_ids[question_id]
+        return Question(
+            id=question_id,
+            question=data.texts[question_id],
+            answer=bool(data.answers[question_id]),
+            image=data.image_names[data.image_ids[question_id]],
+            category=data.categories[data.section_category[section_id]],
+            section=data.sections[section_id],
+        )
+
+    def _keys(self):
+        data = self._data
+        indexed, keys = self._key_index
+        if indexed is not data:
+            keys = {question_key(text, data.image_names[image_id]): question_id
+                    for question_id, (text, image_id) in enumerate(zip(data.texts, data.image_ids))}
+            self._key_index = (data, keys)
+        return keys
+
+    def has_key(self, key):
+        return key in self._keys()
+
+    def find(self, key):
+        """The question with the given stable key, or None if it is no longer in the file"""
+        question_id = self._keys().get(key)
+        return self.get(question_id) if question_id is not None else None
+
+    def random_question(self, category=None, section=None, image=None):
+        """Pick a random question, optionally restricted to a category, a section or an image.
+
+        A section is identified together with its category. Returns None if
+        the bank is empty or the filter matches nothing.
+        """
+        data = self._data
+        if image is not None:
+            candidates = data.by_image.get(data.image_lookup.get(image))
+            if not candidates:
+                return None
+            return self.get(self._rng.choice(candidates), data)
+
+        start, end = 0, len(data.texts)
+        if section is not None:
+            section_id = data.section_lookup.get((category, section))
+            if section_id is None:
+                return None
+            start, end = data.section_bounds[section_id], data.section_bounds[section_id + 1]
+        elif category is not None:
+            category_id = data.category_lookup.get(category)
+            if category_id is None:
+                return None
+            start, end = data.category_bounds[category_id], data.category_bounds[category_id + 1]
+
+        if start >= end:
+            return None
+        return self.get(self._rng.randrange(start, end), data)
+
+    def questions_for_image(self, image):
+        """Ids of every question that uses the given image"""
+        data = self._data
+        return list(data.by_image.get(data.image_lookup.get(image), ()))
@@ -0,0 +1,154 @@
+import io
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QuizJournal:
+    """Write-ahead log for the unanswered quiz state.
+
+    Every state change is appended as one JSON line (`sent`, `answered` or
+    `restored`), so the cost of a write does not depend on how many quizzes
+    are active. Every `compact_every` records the full state is written to
+    the checkpoint file and the journal is truncated.
+
+    Quiz keys are opaque strings chosen by the caller. Records carry an
+    increasing sequence number and the checkpoint stores the
+    last sequence number it includes, so replay after a crash at any point of
+    a compaction applies each record at most once. Replay itself is
+    idempotent: answering or restoring an unknown quiz is ignored.
+    """
+
+    def __init__(self, state_path, journal_path=None, snapshot=None, compact_every=200, sync=False):
+        self.state_path = state_path
+        self.journal_path = journal_path or f"{os.path.splitext(state_path)[0]}.journal"
+        self.snapshot = snapshot  # Callable returning {key: quiz dict} for compaction
+        self.compact_every = compact_every
+        self.sync = sync  # fsync every record; flushing alone already survives process crashes
+        self._seq = 0
+        self._records_since_compaction = 0
+        self._file = None
+        self._lock = threading.RLock()
+
+    def replay(self):
+        """Rebuild the quiz state from the checkpoint and the journal.
+
+        Returns a dict {key: quiz dict}. A torn last record (the
+        process died mid-write) is discarded and cut from the journal, also
+        when it lacks only its newline, so the next record starts on a
+        line of its own.
+        """
+        with self._lock:
+            state, checkpoint_seq = self._read_checkpoint()
+            self._seq = checkpoint_seq
+            applied = 0
+            good_size = 0
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb') as file:
+                    for line in file:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            record = None
+                        # A record is only complete with its newline, even if it already parses
+                        if record is None or not line.endswith(b'\n'):
+                            logger.warning(f"Discarding torn record at offset {good_size} of {self.journal_path}")
+                            break
+                        good_size += len(line)
+                        if record['seq'] <= checkpoint_seq:
+                            continue
+                        self._apply(state, record)
+                        self._seq = record['seq']
+                        applied += 1
+                if good_size != os.path.getsize(self.journal_path):
+                    with open(self.journal_path, 'r+b') as file:
+                        file.truncate(good_size)
+            self._records_since_compaction = applied
+            logger.info(f"Replayed {applied} journal records on top of checkpoint (seq {checkpoint_seq})")
+            return state
+
+    def _read_checkpoint(self):
+        if not os.path.exists(self.state_path):
+            return {}, 0
+        with open(self.state_path, 'r') as file:
+            data = json.load(file)
+        if 'quizzes' not in data:
+            # Plain {message_id: quiz} file written before the journal existed
+            return data, 0
+        return data['quizzes'], data['seq']
+
+    @staticmethod
+    def _apply(state, record):
+        op = record['op']
+        if op == 'sent':
+            state[str(record['id'])] = record['quiz']
+        elif op == 'answered':
+            state.pop(str(record['id']), None)
+        elif op == 'restored':
+            quiz = state.pop(str(record['id']), None)
+            if quiz is not None:
+                state[str(record['new_id'])] = quiz
+        else:
+            logger.warning(f"Unknown journal record {op}, skipping")
+
+    def sent(self, key, quiz):
+        self._append({'op': 'sent', 'id': key, 'quiz': quiz})
+
+    def answered(self, key):
+        self._append({'op': 'answered', 'id': key})
+
+    def restored(self, key, new_key):
+        self._append({'op': 'restored', 'id': key, 'new_id': new_key})
+
+    def _append(self, record):
+        with self._lock:
+            self._seq += 1
+            record['seq'] = self._seq
+            if self._file is None:
+                self._file = self._open_for_append()
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self._records_since_compaction += 1
+            if self.snapshot is not None and self._records_since_compaction >= self.compact_every:
+                self.compact(self.snapshot())
+
+    def _open_for_append(self):
+        file = open(self.journal_path, 'a+b')
+        if file.tell() > 0:
+            # Never append to a line left unterminated by a crash (e.g. when replay() was not called)
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                file.write(b'\n')
+        return io.TextIOWrapper(file, encoding='utf-8')
+
+    def compact(self, state):
+        """Write `state` as the new checkpoint and truncate the journal.
+
+        The checkpoint is written to a temporary file and renamed over the
+        old one, so there is always a complete checkpoint on disk.
+        """
+        with self._lock:
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump({'seq': self._seq,
+                           'quizzes': {str(key): quiz for key, quiz in state.items()}}, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.state_path)
+
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.journal_path, 'w', encoding='utf-8')
+            self._records_since_compaction = 0
+            logger.info(f"Compacted quiz journal into {self.state_path} ({len(state)} quizzes, seq {self._seq})")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
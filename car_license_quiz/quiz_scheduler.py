@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+ALL_HOURS = (1 << 24) - 1  # Bit h set = send a quiz during hour h (local time)
+
+
+def parse_hours(text):
+    """Parse an hour specification such as "8-22" or "7,12,18-20" into a bitmask"""
+    mask = 0
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = end = int(part)
+        if not (0 <= start <= 23 and 0 <= end <= 23) or start > end:
+            raise ValueError(f"Invalid hour range: {part}")
+        for hour in range(start, end + 1):
+            mask |= 1 << hour
+    if not mask:
+        raise ValueError("No hours given")
+    return mask
+
+
+def format_hours(mask):
+    """Inverse of parse_hours, collapsing consecutive hours into ranges"""
+    ranges = []
+    hour = 0
+    while hour < 24:
+        if mask >> hour & 1:
+            start = hour
+            while hour + 1 < 24 and mask >> (hour + 1) & 1:
+                hour += 1
+            ranges.append(f"{start}-{hour}" if hour > start else str(start))
+        hour += 1
+    return ','.join(ranges)
+
+
+class QuizScheduler:
+    """Heap-driven dispatcher for hourly quizzes to many subscribed chats.
+
+    Each chat is a single entry in a heap ordered by its next due time,
+    instead of 24 daily jobs per chat. To avoid a burst at the top of every
+    hour each chat gets a stable offset inside the first `spread_seconds` of
+    the hour. tick() is called by one repeating job and returns a batch of
+    at most `max_sends_per_second * tick_seconds` due chats; the rest stay in
+    the heap for the following ticks.
+    """
+
+    def __init__(self, spread_seconds=900, max_sends_per_second=20, tick_seconds=1.0, clock=time.time):
+        self.spread_seconds = spread_seconds
+        self.max_per_tick = max(1, int(max_sends_per_second * tick_seconds))
+        self.tick_seconds = tick_seconds
+        self.clock = clock
+        self._hours = {}  # chat_id -> hour mask
+        self._heap = []  # (due timestamp, chat_id, generation)
+        self._generation = {}  # chat_id -> generation of its live heap entry
+        self._generations = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hours)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._hours
+
+    def hours(self, chat_id):
+        return self._hours.get(chat_id)
+
+    def offset(self, chat_id):
+        """Stable delay of a chat's quiz after the top of the hour"""
+        if self.spread_seconds <= 0:
+            return 0
+        return zlib.crc32(str(chat_id).encode()) % self.spread_seconds
+
+    def next_due(self, chat_id, after):
+        """First send time strictly after `after` for a chat's hour mask"""
+        mask = self._hours[chat_id]
+        offset = self.offset(chat_id)
+        local = time.localtime(after)
+        hour_start = time.mktime(local[:4] + (0, 0) + local[6:8] + (-1,))
+        for step in range(49):  # Absolute hours, so DST changes are walked over correctly
+            candidate_start = hour_start + step * 3600
+            hour = time.localtime(candidate_start).tm_hour
+            if mask >> hour & 1 and candidate_start + offset > after:
+                return candidate_start + offset
+        raise ValueError(f"Chat {chat_id} has no hours scheduled")
+
+    def subscribe(self, chat_id, hours=ALL_HOURS, not_before=None):
+        """Add or update a chat's schedule; the next quiz is due after `not_before`"""
+        with self._lock:
+            self._hours[chat_id] = hours
+            generation = next(self._generations)
+            self._generation[chat_id] = generation
+            due = self.next_due(chat_id, self.clock() if not_before is None else not_before)
+            heapq.heappush(self._heap, (due, chat_id, generation))
+            return due
+
+    def unsubscribe(self, chat_id):
+        with self._lock:
+            if self._hours.pop(chat_id, None) is None:
+                return False
+            # The heap entry is discarded lazily when it reaches the top
+            self._generation.pop(chat_id, None)
+            return True
+
+    def tick(self, now=None):
+        """Return the next batch of chats whose quiz is due and reschedule them"""
+        now = self.clock() if now is None else now
+        batch = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.max_per_tick:
+                due, chat_id, generation = heapq.heappop(self._heap)
+                if self._generation.get(chat_id) != generation:
+                    continue  # Stale entry of an unsubscribed or rescheduled chat
+                batch.append(chat_id)
+                # Chats that fell behind skip the missed hours instead of catching up
+                heapq.heappush(self._heap, (self.next_due(chat_id, max(due, now)), chat_id, generation))
+            backlog = bool(self._heap) and self._heap[0][0] <= now
+        if backlog:
+            logger.info(f"Dispatching {len(batch)} scheduled quizzes, more are due")
+        return batch
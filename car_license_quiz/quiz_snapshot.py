@@ -0,0 +1,251 @@
+"""Compiled binary snapshot of the quiz question database.
+
+The snapshot is produced offline from quizPatenteB2023.json:
+
+    python quiz_snapshot.py quizPatenteB2023.json quizPatenteB2023.qsnap
+
+and memory-mapped read-only by the bot. Every table is a fixed-width column,
+so questions are read lazily straight from the mapping without copying and
+several bot processes share the same page cache.
+
+Layout (little endian, every table aligned to 8 bytes):
+
+    header          magic, version, counts, source mtime, table offsets
+    string offsets  uint32 x (strings + 1), offsets into the string heap
+    answers         packed bitmap, bit i set if question i is true
+    image column    uint16 x questions, image id (0 = no image)
+    section column  uint16 x questions, section id
+    category bounds uint32 x (categories + 1), first question id of each category
+    section bounds  uint32 x (sections + 1), first question id of each section
+    section parent  uint16 x sections, category id of each section
+    image bounds    uint32 x (images + 2), ranges into the image postings
+    image postings  uint32 x questions with an image, grouped by image id
+    string heap     UTF-8 question texts, then category, section and image names
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'QZSNAP'
+VERSION = 1
+
+# magic, version, questions, categories, sections, images, postings, source mtime,
+# then the file offset of each table in the order listed in the module docstring
+HEADER = struct.Struct('<6sHIIIIIQ10Q')
+
+_TABLES = ('string_offsets', 'answers', 'image_column', 'section_column', 'category_bounds',
+           'section_bounds', 'section_category', 'image_bounds', 'image_postings', 'string_heap')
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, truncated or of an unknown version"""
+
+
+def _align(buffer):
+    buffer.extend(b'\0' * (-len(buffer) % 8))
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def compile_snapshot(json_path, snapshot_path):
+    """Compile the nested question JSON into a binary snapshot file"""
+    source_mtime_ns = os.stat(json_path).st_mtime_ns
+    with open(json_path, 'r', encoding='utf-8') as file:
+        raw = json.load(file)
+
+    texts, answers = [], []
+    image_column, section_column = array('H'), array('H')
+    category_names, section_names, image_names = [], [], []
+    category_bounds, section_bounds, section_category = array('I'), array('I'), array('H')
+    image_lookup, postings_by_image = {}, {}
+
+    for category, category_sections in raw.items():
+        category_bounds.append(len(texts))
+        for section, section_questions in category_sections.items():
+            section_category.append(len(category_names))
+            section_bounds.append(len(texts))
+            for question_dict in section_questions:
+                image = question_dict.get('img') or None
+                image_id = 0
+                if image:
+                    image_id = image_lookup.get(image)
+                    if image_id is None:
+                        image_id = len(image_names) + 1
+                        image_lookup[image] = image_id
+                        image_names.append(image)
+                        postings_by_image[image_id] = array('I')
+                    postings_by_image[image_id].append(len(texts))
+                texts.append(question_dict['q'])
+                answers.append(bool(question_dict['a']))
+                image_column.append(image_id)
+                section_column.append(len(section_names))
+            section_names.append(section)
+        category_names.append(category)
+    category_bounds.append(len(texts))
+    section_bounds.append(len(texts))
+
+    image_bounds, image_postings = array('I', [0]), array('I')
+    for image_id in range(1, len(image_names) + 1):
+        image_bounds.append(len(image_postings))
+        image_postings.extend(postings_by_image[image_id])
+    image_bounds.append(len(image_postings))
+
+    heap, string_offsets = bytearray(), array('I')
+    for string in texts + category_names + section_names + image_names:
+        string_offsets.append(len(heap))
+        heap.extend(string.encode('utf-8'))
+    string_offsets.append(len(heap))
+
+    bitmap = bytearray((len(answers) + 7) // 8)
+    for question_id, answer in enumerate(answers):
+        if answer:
+            bitmap[question_id >> 3] |= 1 << (question_id & 7)
+
+    tables = {
+        'string_offsets': _little_endian(string_offsets),
+        'answers': bytes(bitmap),
+        'image_column': _little_endian(image_column),
+        'section_column': _little_endian(section_column),
+        'category_bounds': _little_endian(category_bounds),
+        'section_bounds': _little_endian(section_bounds),
+        'section_category': _little_endian(section_category),
+        'image_bounds': _little_endian(image_bounds),
+        'image_postings': _little_endian(image_postings),
+        'string_heap': bytes(heap),
+    }
+    body = bytearray(HEADER.size)
+    _align(body)
+    offsets = []
+    for name in _TABLES:
+        offsets.append(len(body))
+        body.extend(tables[name])
+        _align(body)
+    body[:HEADER.size] = HEADER.pack(MAGIC, VERSION, len(texts), len(category_names), len(section_names),
+                                     len(image_names), len(image_postings), source_mtime_ns, *offsets)
+
+    # Write next to the target and rename, so running bots never map a partial file
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, snapshot_path)
+    return len(texts)
+
+
+class _StringColumn:
+    """Sequence view that decodes strings from the heap on access"""
+    __slots__ = ('_heap', '_offsets', '_base', '_count')
+
+    def __init__(self, heap, offsets, base, count):
+        self._heap = heap
+        self._offsets = offsets
+        self._base = base
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        string_id = self._base + index
+        return str(self._heap[self._offsets[string_id]:self._offsets[string_id + 1]], 'utf-8')
+
+    def __iter__(self):
+        return (self[index] for index in range(self._count))
+
+
+class _BitColumn:
+    """Sequence view over the packed answer bitmap"""
+    __slots__ = ('_bitmap', '_count')
+
+    def __init__(self, bitmap, count):
+        self._bitmap = bitmap
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return (self._bitmap[index >> 3] >> (index & 7)) & 1
+
+
+class QuizSnapshot:
+    """Read-only, memory-mapped view of a compiled snapshot.
+
+    Exposes the same columns as the in-memory question bank, so QuestionBank
+    can serve questions from either source.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            try:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                raise SnapshotError(f"Empty snapshot file {path}") from e
+        if len(self._mmap) < HEADER.size:
+            raise SnapshotError(f"Truncated snapshot file {path}")
+
+        (magic, version, questions, categories, sections, images, postings,
+         self.source_mtime_ns, *offsets) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot format in {path}")
+        if sys.byteorder != 'little':
+            raise SnapshotError("Memory-mapped snapshots require a little endian host")
+        offsets = dict(zip(_TABLES, offsets))
+        strings = questions + categories + sections + images
+
+        view = memoryview(self._mmap)
+
+        def column(name, typecode, count):
+            start = offsets[name]
+            size = struct.calcsize(typecode) * count
+            if start + size > len(view):
+                raise SnapshotError(f"Truncated table {name} in {path}")
+            return view[start:start + size].cast(typecode)
+
+        string_offsets = column('string_offsets', 'I', strings + 1)
+        heap = view[offsets['string_heap']:offsets['string_heap'] + string_offsets[strings]]
+
+        self.texts = _StringColumn(heap, string_offsets, 0, questions)
+        self.answers = _BitColumn(column('answers', 'B', (questions + 7) // 8), questions)
+        self.image_ids = column('image_column', 'H', questions)
+        self.section_ids = column('section_column', 'H', questions)
+        self.categories = list(_StringColumn(heap, string_offsets, questions, categories))
+        self.sections = list(_StringColumn(heap, string_offsets, questions + categories, sections))
+        self.image_names = [None] + list(_StringColumn(heap, string_offsets,
+                                                       questions + categories + sections, images))
+        self.category_bounds = column('category_bounds', 'I', categories + 1)
+        self.section_bounds = column('section_bounds', 'I', sections + 1)
+        self.section_category = column('section_category', 'H', sections)
+
+        image_bounds = column('image_bounds', 'I', images + 2)
+        image_postings = column('image_postings', 'I', postings)
+        self.by_image = {image_id: image_postings[image_bounds[image_id]:image_bounds[image_id + 1]]
+                         for image_id in range(1, images + 1)}
+
+        # Name lookups are tiny (a few hundred entries), so they are built eagerly
+        self.category_lookup = {name: category_id for category_id, name in enumerate(self.categories)}
+        self.section_lookup = {(self.categories[self.section_category[section_id]], name): section_id
+                               for section_id, name in enumerate(self.sections)}
+        self.image_lookup = {name: image_id for image_id, name in enumerate(self.image_names) if name}
+        self.mtime_ns = self.source_mtime_ns
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else 'quizPatenteB2023.json'
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + '.qsnap'
+    count = compile_snapshot(source, target)
+    print(f"Compiled {count} questions from {source} into {target} ({os.path.getsize(target)} bytes)")
@@ -0,0 +1,384 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+
+from quiz_journal import QuizJournal
+
+logger = logging.getLogger(__name__)
+
+
+def parse_chat_id(value):
+    """Telegram reports chat ids as integers, the configuration may hold a string such as '@channel'"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class QuizStorage(ABC):
+    """Persistence interface for active quizzes, answers and statistics.
+
+    Active quizzes are identified by (chat_id, message_id), since Telegram
+    message ids are only unique within a chat. Quizzes are passed around as
+    the dictionaries produced by QuizData.to_dict(). A question_id is the
+    question's stable key (Question.key), not its position in the file, so
+    answers, statistics and reviews survive edits of the question file.
+    """
+
+    @abstractmethod
+    def load_active(self):
+        """Return {(chat_id, message_id): quiz dict} for every unanswered quiz"""
+
+    @abstractmethod
+    def add_quiz(self, chat_id, message_id, quiz):
+        """Save a quiz sent as message_id in chat_id"""
+
+    @abstractmethod
+    def remove_quiz(self, chat_id, message_id):
+        """Forget a quiz once it is answered"""
+
+    @abstractmethod
+    def remap_quiz(self, chat_id, message_id, new_message_id):
+        """Move a quiz to a new message, e.g. after it was re-sent on restart"""
+
+    def remap_quizzes(self, remaps):
+        """Apply many (chat_id, message_id, new_message_id) remaps at once"""
+        for chat_id, message_id, new_message_id in remaps:
+            self.remap_quiz(chat_id, message_id, new_message_id)
+
+    @abstractmethod
+    def count_active(self, chat_id):
+        """Number of unanswered quizzes in a chat"""
+
+    def record_answer(self, chat_id, message_id, user_id, question_id, given, correct):
+        """Log a user's answer; backends without history may ignore it"""
+
+    def user_stats(self, user_id):
+        """Return (answered, correct) for a user, or None if the backend keeps no history"""
+        return None
+
+    def chat_stats(self, chat_id):
+        """Return (answered, correct) for a chat, or None if the backend keeps no history"""
+        return None
+
+    def question_stats(self, question_id):
+        """Return (answered, correct) for a question, or None if the backend keeps no history"""
+        return None
+
+    def load_reviews(self):
+        """Return (chat_id, question_id, box, due) rows of the spaced-repetition schedule"""
+        return []
+
+    def save_review(self, chat_id, question_id, box, due):
+        """Persist a question's Leitner box in a chat; backends without history may ignore it"""
+
+    @abstractmethod
+    def load_subscriptions(self):
+        """Return {chat_id: hour mask} for every chat subscribed to scheduled quizzes"""
+
+    @abstractmethod
+    def save_subscription(self, chat_id, hours):
+        """Subscribe a chat, or change its hour mask"""
+
+    @abstractmethod
+    def remove_subscription(self, chat_id):
+        """Unsubscribe a chat"""
+
+    def flush(self):
+        """Persist buffered writes"""
+
+    def close(self):
+        self.flush()
+
+
+class JournalQuizStorage(QuizStorage):
+    """Active quizzes only, kept in memory and persisted through a QuizJournal"""
+
+    def __init__(self, state_path, journal_path=None, default_chat_id=None, subscriptions_path=None):
+        self.default_chat_id = default_chat_id  # Chat of quizzes saved before chat ids were stored
+        self.subscriptions_path = subscriptions_path or os.path.join(os.path.dirname(state_path),
+                                                                     'subscriptions.json')
+        self._subscriptions = None
+        self._active = {}
+        self._per_chat = Counter()
+        self._lock = threading.RLock()
+        self.journal = QuizJournal(state_path, journal_path, snapshot=lambda: dict(self._active))
+
+    def _parse_key(self, key):
+        chat_id, _, message_id = key.rpartition(':')
+        return (parse_chat_id(chat_id) if chat_id else self.default_chat_id), int(message_id)
+
+    def load_active(self):
+        with self._lock:
+            self._active = self.journal.replay()
+            # Fold the replayed records into a fresh checkpoint
+            self.journal.compact(self._active)
+            self._per_chat = Counter(self._parse_key(key)[0] for key in self._active)
+            return {self._parse_key(key): quiz for key, quiz in self._active.items()}
+
+    def add_quiz(self, chat_id, message_id, quiz):
+        with self._lock:
+            self._active[f"{chat_id}:{message_id}"] = quiz
+            self._per_chat[chat_id] += 1
+            self.journal.sent(f"{chat_id}:{message_id}", quiz)
+
+    def remove_quiz(self, chat_id, message_id):
+        with self._lock:
+            if self._active.pop(f"{chat_id}:{message_id}", None) is not None:
+                self._per_chat[chat_id] -= 1
+            self.journal.answered(f"{chat_id}:{message_id}")
+
+    def remap_quiz(self, chat_id, message_id, new_message_id):
+        with self._lock:
+            quiz = self._active.pop(f"{chat_id}:{message_id}", None)
+            if quiz is not None:
+                self._active[f"{chat_id}:{new_message_id}"] = quiz
+            self.journal.restored(f"{chat_id}:{message_id}", f"{chat_id}:{new_message_id}")
+
+    def count_active(self, chat_id):
+        return self._per_chat[chat_id]
+
+    def load_subscriptions(self):
+        with self._lock:
+            if self._subscriptions is None:
+                self._subscriptions = {}
+                if os.path.exists(self.subscriptions_path):
+                    with open(self.subscriptions_path, 'r') as file:
+                        self._subscriptions = {parse_chat_id(chat_id): hours
+                                               for chat_id, hours in json.load(file).items()}
+            return dict(self._subscriptions)
+
+    def _write_subscriptions(self):
+        # Subscriptions change rarely, a full atomic rewrite is fine
+        tmp_path = f"{self.subscriptions_path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({str(chat_id): hours for chat_id, hours in self._subscriptions.items()}, file)
+        os.replace(tmp_path, self.subscriptions_path)
+
+    def save_subscription(self, chat_id, hours):
+        with self._lock:
+            self.load_subscriptions()
+            self._subscriptions[chat_id] = hours
+            self._write_subscriptions()
+
+    def remove_subscription(self, chat_id):
+        with self._lock:
+            self.load_subscriptions()
+            self._subscriptions.pop(chat_id, None)
+            self._write_subscriptions()
+
+    def close(self):
+        self.journal.close()
+
+
+class SQLiteQuizStorage(QuizStorage):
+    """SQLite storage in WAL mode with batched commits.
+
+    Writes go into an open transaction that is committed once `batch_size`
+    writes are pending or the oldest pending write is `commit_interval`
+    seconds old (callers should also call flush() periodically). The SQL
+    strings are constants, so sqlite3's statement cache prepares each of
+    them only once per connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS active_quizzes (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            question_id INTEGER,
+            question TEXT NOT NULL,
+            answer INTEGER NOT NULL,
+            image TEXT,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        );
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            question_id INTEGER,
+            given INTEGER NOT NULL,
+            correct INTEGER NOT NULL,
+            answered_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_answers_user ON answers (user_id, answered_at);
+        CREATE INDEX IF NOT EXISTS idx_answers_chat ON answers (chat_id, answered_at);
+        CREATE INDEX IF NOT EXISTS idx_answers_question ON answers (question_id);
+        CREATE TABLE IF NOT EXISTS question_stats (
+            question_id INTEGER PRIMARY KEY,
+            answered INTEGER NOT NULL,
+            correct INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reviews (
+            chat_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            box INTEGER NOT NULL,
+            due REAL NOT NULL,
+            PRIMARY KEY (chat_id, question_id)
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            hours INTEGER NOT NULL,
+            subscribed_at REAL NOT NULL
+        );
+    """
+
+    INSERT_QUIZ = ("INSERT OR REPLACE INTO active_quizzes "
+                   "(chat_id, message_id, question_id, question, answer, image, sent_at) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    DELETE_QUIZ = "DELETE FROM active_quizzes WHERE chat_id = ? AND message_id = ?"
+    REMAP_QUIZ = "UPDATE active_quizzes SET message_id = ? WHERE chat_id = ? AND message_id = ?"
+    COUNT_ACTIVE = "SELECT COUNT(*) FROM active_quizzes WHERE chat_id = ?"
+    INSERT_ANSWER = ("INSERT INTO answers (chat_id, message_id, user_id, question_id, given, correct, answered_at) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)")
+    UPDATE_QUESTION_STATS = ("INSERT INTO question_stats (question_id, answered, correct) VALUES (?, 1, ?) "
+                             "ON CONFLICT (question_id) DO UPDATE SET "
+                             "answered = answered + 1, correct = correct + excluded.correct")
+    USER_STATS = "SELECT COUNT(*), COALESCE(SUM(correct), 0) FROM answers WHERE user_id = ?"
+    CHAT_STATS = "SELECT COUNT(*), COALESCE(SUM(correct), 0) FROM answers WHERE chat_id = ?"
+    QUESTION_STATS = "SELECT answered, correct FROM question_stats WHERE question_id = ?"
+    SAVE_REVIEW = ("INSERT INTO reviews (chat_id, question_id, box, due) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT (chat_id, question_id) DO UPDATE SET box = excluded.box, due = excluded.due")
+    SAVE_SUBSCRIPTION = ("INSERT INTO subscriptions (chat_id, hours, subscribed_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT (chat_id) DO UPDATE SET hours = excluded.hours")
+    REMOVE_SUBSCRIPTION = "DELETE FROM subscriptions WHERE chat_id = ?"
+
+    def __init__(self, path, batch_size=50, commit_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self._pending = 0
+        self._first_pending_at = None
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def _write(self, sql, params):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._pending += 1
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            if (self._pending >= self.batch_size
+                    or time.monotonic() - self._first_pending_at >= self.commit_interval):
+                self._commit()
+            return cursor
+
+    def _commit(self):
+        self._conn.commit()
+        self._pending = 0
+        self._first_pending_at = None
+
+    def load_active(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id, message_id, question_id, question, answer, image, sent_at FROM active_quizzes"
+            ).fetchall()
+        return {(chat_id, message_id): {'question': question, 'answer': bool(answer), 'image': image,
+                                        'timestamp': sent_at, 'chat_id': chat_id, 'question_id': question_id}
+                for chat_id, message_id, question_id, question, answer, image, sent_at in rows}
+
+    def add_quiz(self, chat_id, message_id, quiz):
+        self._write(self.INSERT_QUIZ, (chat_id, message_id, quiz.get('question_id'), quiz['question'],
+                                       int(quiz['answer']), quiz['image'], quiz['timestamp']))
+
+    def remove_quiz(self, chat_id, message_id):
+        self._write(self.DELETE_QUIZ, (chat_id, message_id))
+
+    def remap_quiz(self, chat_id, message_id, new_message_id):
+        self._write(self.REMAP_QUIZ, (new_message_id, chat_id, message_id))
+
+    def remap_quizzes(self, remaps):
+        # One executemany in one transaction, whatever the number of quizzes
+        with self._lock:
+            self._conn.executemany(self.REMAP_QUIZ, [(new_message_id, chat_id, message_id)
+                                                     for chat_id, message_id, new_message_id in remaps])
+            self._commit()
+
+    def count_active(self, chat_id):
+        with self._lock:
+            return self._conn.execute(self.COUNT_ACTIVE, (chat_id,)).fetchone()[0]
+
+    def record_answer(self, chat_id, message_id, user_id, question_id, given, correct):
+        with self._lock:
+            self._write(self.INSERT_ANSWER, (chat_id, message_id, user_id, question_id,
+                                             int(given), int(correct), time.time()))
+            if question_id is not None:
+                self._write(self.UPDATE_QUESTION_STATS, (question_id, int(correct)))
+
+    def user_stats(self, user_id):
+        with self._lock:
+            return tuple(self._conn.execute(self.USER_STATS, (user_id,)).fetchone())
+
+    def chat_stats(self, chat_id):
+        with self._lock:
+            return tuple(self._conn.execute(self.CHAT_STATS, (chat_id,)).fetchone())
+
+    def question_stats(self, question_id):
+        with self._lock:
+            row = self._conn.execute(self.QUESTION_STATS, (question_id,)).fetchone()
+        return tuple(row) if row else (0, 0)
+
+    def load_reviews(self):
+        with self._lock:
+            return self._conn.execute("SELECT chat_id, question_id, box, due FROM reviews").fetchall()
+
+    def save_review(self, chat_id, question_id, box, due):
+        self._write(self.SAVE_REVIEW, (chat_id, question_id, box, due))
+
+    def load_subscriptions(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT chat_id, hours FROM subscriptions").fetchall())
+
+    def save_subscription(self, chat_id, hours):
+        with self._lock:
+            self._write(self.SAVE_SUBSCRIPTION, (chat_id, hours, time.time()))
+            self._commit()
+
+    def remove_subscription(self, chat_id):
+        with self._lock:
+            self._write(self.REMOVE_SUBSCRIPTION, (chat_id,))
+            self._commit()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._commit()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+def create_storage(backend, path, journal_path=None, default_chat_id=None):
+    """Build the storage backend named in the bot configuration ('sqlite' or 'journal')"""
+    if backend == 'sqlite':
+        return SQLiteQuizStorage(path)
+    if backend == 'journal':
+        return JournalQuizStorage(path, journal_path, default_chat_id=default_chat_id)
+    raise ValueError(f"Unknown quiz storage backend: {backend}")
+
+
+def migrate_journal_state(storage, state_path, journal_path=None, default_chat_id=None):
+    """Copy quizzes from a journal/JSON state file into `storage` and retire the file"""
+    legacy = JournalQuizStorage(state_path, journal_path, default_chat_id=default_chat_id)
+    quizzes = legacy.load_active()
+    legacy.close()
+    for (chat_id, message_id), quiz in quizzes.items():
+        storage.add_quiz(chat_id, message_id, quiz)
+    storage.flush()
+    for path in (legacy.journal.state_path, legacy.journal.journal_path):
+        if os.path.exists(path):
+            os.replace(path, f"{path}.migrated")
+    logger.info(f"Migrated {len(quizzes)} quizzes from {state_path}")
+    return len(quizzes)
@@ -0,0 +1,175 @@
+import bisect
+import heapq
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds until a question in Leitner box 1, 2, ... is due again. New questions
+# start in box 1; a right answer moves them up a box, a wrong one back to box 1.
+LEITNER_INTERVALS = (3600, 86400, 3 * 86400, 7 * 86400, 21 * 86400)
+UNANSWERED_RETRY = 86400  # A question that was sent but not answered comes back after a day
+
+
+class _Learner:
+    """Review state of one chat: the Leitner box of every question seen so far"""
+    __slots__ = ('boxes', 'heap')
+
+    def __init__(self):
+        self.boxes = {}  # question key -> [box, due timestamp]
+        self.heap = []   # (due timestamp, question key), stale entries are skipped lazily
+
+
+class ReviewScheduler:
+    """Spaced-repetition question selection with one Leitner schedule per chat.
+
+    Quizzes are sent to chats, so the learner is the chat. Each chat keeps a
+    heap of the questions it has already seen, ordered by due time; picking
+    the next question pops the heap in O(log n). When nothing is due a new
+    question is drawn from the bank, choosing the category by weighted
+    bisection over cumulative weights. Only seen questions are stored, so
+    thousands of chats never cost a scan of the whole bank each.
+
+    By default every question is equally likely, as with plain random
+    sampling; `category_weights` multiplies the share of single categories.
+
+    Questions are identified by their stable key (Question.key), so the
+    saved schedules stay attached to the same questions when the bank is
+    reloaded with questions added, removed or reordered.
+    """
+
+    def __init__(self, question_bank, category_weights=None, new_question_attempts=8, rng=None, clock=time.time):
+        self.question_bank = question_bank
+        self.category_weights = category_weights or {}
+        self.new_question_attempts = new_question_attempts
+        self._rng = rng or random.Random()
+        self.clock = clock
+        self._learners = {}  # chat_id -> _Learner
+        self._category_table = None  # (bank mtime, categories, cumulative weights)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._learners)
+
+    def load(self, reviews):
+        """Restore the schedules from (chat_id, question key, box, due) rows"""
+        learners = {}
+        rows = 0
+        for chat_id, question_id, box, due in reviews:
+            if not self.question_bank.has_key(question_id):
+                continue  # The question was removed or edited since the review was saved
+            learner = learners.get(chat_id)
+            if learner is None:
+                learner = learners[chat_id] = _Learner()
+            learner.boxes[question_id] = [box, due]
+            learner.heap.append((due, question_id))
+            rows += 1
+        for learner in learners.values():
+            heapq.heapify(learner.heap)
+        with self._lock:
+            self._learners = learners
+        logger.info(f"Loaded {rows} reviews for {len(learners)} chats")
+
+    def _categories(self):
+        """Category names and cumulative weights, rebuilt when the question file changes"""
+        table = self._category_table
+        if table is None or table[0] != self.question_bank.mtime_ns:
+            categories = []
+            cumulative = []
+            total = 0
+            for category, size in self.question_bank.category_sizes().items():
+                weight = size * self.category_weights.get(category, 1)
+                if weight <= 0:
+                    continue
+                total += weight
+                categories.append(category)
+                cumulative.append(total)
+            table = self._category_table = (self.question_bank.mtime_ns, categories, cumulative)
+        return table[1], table[2]
+
+    def _new_question(self, learner):
+        """A question the chat has never seen, from a weighted random category"""
+        categories, cumulative = self._categories()
+        if not categories:
+            return None
+        for _ in range(self.new_question_attempts):
+            index = bisect.bisect_right(cumulative, self._rng.random() * cumulative[-1])
+            question = self.question_bank.random_question(category=categories[min(index, len(categories) - 1)])
+            if question is not None and question.key not in learner.boxes:
+                return question
+        return None  # Almost every question was seen already, fall back to the earliest review
+
+    def _pop_review(self, learner, due_before=None):
+        """Pop the earliest live review, if it is due before `due_before`"""
+        heap = learner.heap
+        while heap:
+            due, question_id = heap[0]
+            state = learner.boxes.get(question_id)
+            if state is None or state[1] != due:
+                heapq.heappop(heap)  # Rescheduled since this entry was pushed
+                continue
+            if due_before is not None and due > due_before:
+                return None
+            heapq.heappop(heap)
+            return question_id
+        return None
+
+    def next_question(self, chat_id):
+        """Pick the chat's next question: a due review, else a new question, else the earliest review"""
+        now = self.clock()
+        with self._lock:
+            learner = self._learners.get(chat_id)
+            if learner is None:
+                learner = self._learners[chat_id] = _Learner()
+            question_id, question = self._pop_live_review(learner, due_before=now)
+            if question is None:
+                question = self._new_question(learner)
+                if question is not None:
+                    return question
+                question_id, question = self._pop_live_review(learner)
+                if question is None:
+                    return self.question_bank.random_question()
+            # Bring it back later even if nobody answers, answering reschedules it properly
+            state = learner.boxes[question_id]
+            state[1] = now + UNANSWERED_RETRY
+            heapq.heappush(learner.heap, (state[1], question_id))
+        return question
+
+    def _pop_live_review(self, learner, due_before=None):
+        """(key, question) of the earliest review still in the bank, forgetting those a reload removed"""
+        while True:
+            question_id = self._pop_review(learner, due_before)
+            if question_id is None:
+                return None, None
+            question = self.question_bank.find(question_id)
+            if question is not None:
+                return question_id, question
+            del learner.boxes[question_id]
+
+    def record_answer(self, chat_id, question_id, correct):
+        """Move a question to its next Leitner box; returns the new (box, due) to persist"""
+        now = self.clock()
+        with self._lock:
+            learner = self._learners.get(chat_id)
+            if learner is None:
+                learner = self._learners[chat_id] = _Learner()
+            state = learner.boxes.get(question_id)
+            box = state[0] if state else 1
+            box = min(box + 1, len(LEITNER_INTERVALS)) if correct else 1
+            due = now + LEITNER_INTERVALS[box - 1]
+            learner.boxes[question_id] = [box, due]
+            heapq.heappush(learner.heap, (due, question_id))
+        return box, due
+
+    def box_counts(self, chat_id):
+        """{box: number of questions} for a chat"""
+        with self._lock:
+            learner = self._learners.get(chat_id)
+            if learner is None:
+                return {}
+            counts = {}
+            for box, due in learner.boxes.values():
+                counts[box] = counts.get(box, 0) + 1
+            return counts
@@ -0,0 +1,127 @@
+"""Benchmark of the scrapers' HTML parsing: BeautifulSoup against the lxml extractors.
+
+Parses the same pages with the BeautifulSoup code the scrapers used before
+and with common.html_extract, checks both give the same recipes and deals
+and prints the time per page. Recipe listings are read from a directory
+saved by random_meals_generator/fixture_server.py (save command) or are
+generated from a recipes.json file; Amazon deal pages are saved .html
+files, a synthetic page is used when none is given.
+
+    python extract_benchmark.py [--recipe-pages saved_pages | --recipes recipes.json] [--deal-pages deal1.html ...]
+                                [--repeat 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(os.path.join(ROOT, 'random_meals_generator'))
+sys.path.append(os.path.join(ROOT, 'amazon_offers'))
+from deal_parser import AMAZON_URL, parse_deals
+from fixture_server import pages_from_directory, pages_from_recipes
+from recipe_scraper import PAGE_LINK_CATEGORIES, parse_category_page
+
+
+def bs4_category_page(text, category):
+    """The recipe scraper's BeautifulSoup parsing"""
+    soup = BeautifulSoup(text, "html.parser")
+    total_pages = None
+    if category in PAGE_LINK_CATEGORIES:
+        page_links = soup.find_all('a', {'class': 'page'})
+        if page_links:
+            total_pages = int(page_links[-1].text)
+    else:
+        span = soup.find('span', {'class': 'disabled total-pages'})
+        if span is not None:
+            total_pages = int(span.text.strip())
+    recipes = []
+    for recipe in soup.find_all("article"):
+        link_tag = recipe.find("h2").find("a")
+        recipes.append({"name": link_tag.text.strip(), "recipe_url": link_tag["href"]})
+    return recipes, total_pages
+
+
+def bs4_deals(content):
+    """The Amazon bot's BeautifulSoup parsing"""
+    soup = BeautifulSoup(content, 'html.parser')
+    deals = []
+    for item in soup.find_all('div', {'class': 'a-section octopus-dlp-asin-section'}):
+        deals.append({
+            'link': AMAZON_URL + item.find('a', {'class': 'a-link-normal'})['href'],
+            'img_link': item.find('img', {'class': 'octopus-dlp-asin-image'})['src'],
+            'name': item.find('a', {'class': 'a-size-base a-color-base a-link-normal a-text-normal'}).text.strip(),
+            'price': item.find('span', {'class': 'a-price-whole'}).text.strip()
+                     + item.find('span', {'class': 'a-price-fraction'}).text.strip(),
+            'old_price': item.find('span', {'class': 'a-text-strike'}).text.strip(),
+            'percentage': item.find('div', {'class': 'oct-deal-badge-label'}).text.strip(),
+        })
+    return deals
+
+
+def synthetic_deal_page(cards=60):
+    """A deal page with the markup of the Amazon deal cards"""
+    items = "\n".join(
+        f'<div class="a-section octopus-dlp-asin-section"><div class="a-section octopus-dlp-image-section">'
+        f'<a class="a-link-normal" href="/dp/B0{i:08d}?ref=dlx"><img class="octopus-dlp-asin-image" '
+        f'src="https://m.media-amazon.com/images/I/{i}.jpg" alt=""></a></div>'
+        f'<div class="a-section octopus-dlp-asin-info-section"><div class="oct-deal-badge-element">'
+        f'<div class="oct-deal-badge-label">-{10 + i % 60}%</div></div>'
+        f'<div class="a-section octopus-dlp-price"><span class="a-price"><span class="a-price-whole">{i + 9},</span>'
+        f'<span class="a-price-fraction">99</span></span> <span class="a-size-small a-color-secondary">'
+        f'Prezzo consigliato: <span class="a-text-strike">{i + 19},99 €</span></span></div>'
+        f'<a class="a-size-base a-color-base a-link-normal a-text-normal" href="/dp/B0{i:08d}">'
+        f'  Prodotto in offerta numero {i} con una descrizione lunga</a></div></div>'
+        for i in range(cards))
+    return (f'<html><head><meta charset="utf-8"><title>Offerte</title></head><body>'
+            f'<div id="octopus-dlp-asin-stream"><ul>{items}</ul></div></body></html>').encode('utf-8')
+
+
+def measure(name, pages, reference, extractor, repeat):
+    """Check both parsers agree on `pages` [(args)] and print the best time per page of each"""
+    for args in pages:
+        assert reference(*args) == extractor(*args), f'{name}: the parsers disagree on a page'
+    timings = []
+    for parse in (reference, extractor):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for args in pages:
+                parse(*args)
+            best = min(best, time.perf_counter() - started)
+        timings.append(best / len(pages))
+    size = sum(len(args[0]) for args in pages) / len(pages)
+    print(f'{name}: {len(pages)} pages of {size / 1024:.0f} KB, BeautifulSoup {timings[0] * 1e3:.2f} ms/page, '
+          f'lxml {timings[1] * 1e3:.2f} ms/page ({timings[0] / timings[1]:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--recipe-pages', help='directory of saved listing pages')
+    source.add_argument('--recipes', default=os.path.join(ROOT, 'random_meals_generator', 'recipes.json'),
+                        help='recipes.json to generate the listing pages from')
+    parser.add_argument('--per-page', type=int, default=15)
+    parser.add_argument('--deal-pages', nargs='*', default=[], help='saved Amazon deal pages')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.recipe_pages:
+        pages = pages_from_directory(args.recipe_pages)
+    else:
+        pages = pages_from_recipes(args.recipes, args.per_page)
+    measure('recipe listings', [(text, category) for (category, _), text in sorted(pages.items())],
+            bs4_category_page, parse_category_page, args.repeat)
+
+    deal_pages = []
+    for path in args.deal_pages:
+        with open(path, 'rb') as f:
+            deal_pages.append((f.read(),))
+    measure('Amazon deals' if deal_pages else 'Amazon deals (synthetic page)', deal_pages or [(synthetic_deal_page(),)],
+            bs4_deals, parse_deals, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from lxml import etree, html
+
+
+def css_class(*names):
+    """XPath predicate true for elements having every one of the CSS classes `names`"""
+    return ' and '.join(f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')" for name in names)
+
+
+def parse_html(content):
+    """lxml tree of a page, from text or from bytes (the encoding is then read from the page)"""
+    return html.document_fromstring(content)
+
+
+class Selector:
+    """A compiled XPath giving the stripped text, or an attribute, of the nodes it matches"""
+    __slots__ = ('path', 'attribute', '_xpath')
+
+    def __init__(self, path, attribute=None):
+        self.path = path
+        self.attribute = attribute
+        self._xpath = etree.XPath(path)
+
+    def _value(self, node):
+        if self.attribute is not None:
+            return node.get(self.attribute)
+        return node.text_content().strip()
+
+    def first(self, node):
+        """Value of the first match under `node`, or None"""
+        matches = self._xpath(node)
+        return self._value(matches[0]) if matches else None
+
+    def last(self, node):
+        matches = self._xpath(node)
+        return self._value(matches[-1]) if matches else None
+
+    def all(self, node):
+        return [self._value(match) for match in self._xpath(node)]
+
+
+class RecordExtractor:
+    """Pulls one dict per repeated block of a page (a product card, a recipe tile...).
+
+    `records` is the XPath of the blocks and each keyword argument a
+    Selector relative to a block. The page is parsed once by lxml and every
+    XPath is compiled once when the extractor is built, instead of walking
+    a BeautifulSoup tree with a find() per field. A field missing from a
+    block is None; blocks missing one of the `required` fields are skipped.
+    """
+
+    def __init__(self, records, required=(), **fields):
+        self.records = etree.XPath(records)
+        self.required = tuple(required)
+        self.fields = fields
+
+    def extract(self, root):
+        """[{field: value}] of the blocks under an lxml tree (see parse_html)"""
+        results = []
+        for node in self.records(root):
+            record = {name: selector.first(node) for name, selector in self.fields.items()}
+            if all(record[name] is not None for name in self.required):
+                results.append(record)
+        return results
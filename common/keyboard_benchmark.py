@@ -0,0 +1,59 @@
+"""Micro-benchmark of the per-update cost of inline keyboards.
+
+Compares building the keyboard in the handler, as the bots used to, with
+reusing a StaticInlineKeyboardMarkup built at import. Each iteration does
+what a handler and python-telegram-bot do for one reply: get the markup and
+serialize it for the request (to_json() on version 13, to_dict() then
+json.dumps on version 20).
+
+    python keyboard_benchmark.py [--iterations 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import __version__ as ptb_version
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.keyboards import grid, inline_keyboard
+
+# The keyboards of the crypto alert, car quiz and recipes bots
+LAYOUTS = {
+    'crypto main menu': [[("Track", '1_track'), ("Contact", '2_contact')], [("Help", '3_help')]],
+    'car quiz answer': [[("Vero", 'true'), ("Falso", 'false')]],
+    'recipes categories': grid((f'Category {i}', f'category-{i}') for i in range(9)),
+}
+
+
+def serialize(markup):
+    if ptb_version.startswith('13.'):
+        return markup.to_json()
+    return json.dumps(markup.to_dict())
+
+
+def rebuild(rows):
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data) for text, data in row]
+                                   for row in rows])
+    return serialize(markup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inline keyboard micro-benchmark')
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f'python-telegram-bot {ptb_version}, {args.iterations} updates per keyboard')
+    for name, rows in LAYOUTS.items():
+        markup = inline_keyboard(rows)
+        assert json.loads(serialize(markup)) == json.loads(rebuild(rows))
+        rebuilt = timeit.timeit(lambda: rebuild(rows), number=args.iterations) / args.iterations
+        static = timeit.timeit(lambda: serialize(markup), number=args.iterations) / args.iterations
+        print(f'{name}: rebuilt {rebuilt * 1e6:.2f} us/update, static {static * 1e6:.2f} us/update '
+              f'({rebuilt / static:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
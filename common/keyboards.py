@@ -0,0 +1,47 @@
+import json
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+class StaticInlineKeyboardMarkup(InlineKeyboardMarkup):
+    """An inline keyboard built once at import and shared by every update.
+
+    Serialized the first time it is sent, then the same JSON is reused:
+    python-telegram-bot 13 asks for to_json() and 20 for to_dict() on every
+    request. The keyboard must not be modified after it is built, and the
+    dict returned by to_dict() must not be modified either.
+    """
+    __slots__ = ('_serialized_dict', '_serialized_json')
+
+    def to_dict(self, *args, **kwargs):
+        if args or kwargs:
+            return super().to_dict(*args, **kwargs)
+        try:
+            return self._serialized_dict
+        except AttributeError:
+            data = super().to_dict()
+            # object.__setattr__ because python-telegram-bot 20 freezes its objects after __init__
+            object.__setattr__(self, '_serialized_dict', data)
+            return data
+
+    def to_json(self, *args, **kwargs):
+        if args or kwargs:
+            return super().to_json(*args, **kwargs)
+        try:
+            return self._serialized_json
+        except AttributeError:
+            text = json.dumps(self.to_dict())
+            object.__setattr__(self, '_serialized_json', text)
+            return text
+
+
+def inline_keyboard(rows):
+    """StaticInlineKeyboardMarkup from rows of (text, callback_data) pairs"""
+    return StaticInlineKeyboardMarkup(
+        [[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in rows])
+
+
+def grid(buttons, columns=2):
+    """Split (text, callback_data) pairs into rows of `columns` buttons"""
+    buttons = list(buttons)
+    return [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
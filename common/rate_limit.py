@@ -0,0 +1,127 @@
+import time
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored.
+
+    The bucket never blocks; try_acquire() either takes the tokens or says how
+    long to wait, so it can be driven from threads and asyncio alike.
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until', 'clock')
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, tokens=1, now=None):
+        """Seconds until `tokens` can be acquired, without taking them"""
+        now = self.clock() if now is None else now
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) / self.rate)
+        return wait
+
+    def try_acquire(self, tokens=1, now=None):
+        """Take `tokens` if available and return 0, else return the seconds to wait"""
+        now = self.clock() if now is None else now
+        wait = self.wait_time(tokens, now)
+        if wait <= 0:
+            self.tokens -= tokens
+        return wait
+
+    def pause(self, seconds, now=None):
+        """Refuse tokens for `seconds`, e.g. after the server asked us to back off"""
+        now = self.clock() if now is None else now
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = max(self.updated, now)
+
+    def acquire(self, tokens=1):
+        """Block the calling thread until `tokens` are taken"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """Wait on the event loop until `tokens` are taken"""
+        import asyncio
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def is_idle(self, now=None):
+        """True if the bucket is full, i.e. it carries no state worth keeping"""
+        now = self.clock() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class TelegramRateLimiter:
+    """Global and per-chat token buckets matching Telegram's bot limits.
+
+    Telegram allows about 30 messages per second overall, one message per
+    second in a single chat and 20 messages per minute in a group. Group and
+    channel chat ids are negative. Tokens are only taken when every bucket
+    involved has one, so a busy chat never drains the global budget.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, group_per_minute=20, clock=time.monotonic):
+        self.clock = clock
+        self.chat_rate = chat_rate
+        self.group_per_minute = group_per_minute
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self._chat_buckets = {}  # chat_id -> tuple of buckets
+        self._cleanup_at = clock() + 60
+
+    def _buckets(self, chat_id):
+        buckets = self._chat_buckets.get(chat_id)
+        if buckets is None:
+            buckets = (TokenBucket(self.chat_rate, 1, self.clock),)
+            if isinstance(chat_id, int) and chat_id < 0:
+                buckets += (TokenBucket(self.group_per_minute / 60, self.group_per_minute, self.clock),)
+            self._chat_buckets[chat_id] = buckets
+        return buckets
+
+    def global_wait(self, now=None):
+        return self.global_bucket.wait_time(1, now)
+
+    def reserve(self, chat_id=None, now=None):
+        """Take a token for a message to `chat_id`; return 0 or the seconds to wait"""
+        now = self.clock() if now is None else now
+        if now >= self._cleanup_at:
+            self._cleanup(now)
+        buckets = (self.global_bucket,) if chat_id is None else (self.global_bucket,) + self._buckets(chat_id)
+        wait = max(bucket.wait_time(1, now) for bucket in buckets)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket.try_acquire(1, now)
+        return 0.0
+
+    def pause(self, seconds, chat_id=None):
+        """Honour a RetryAfter for one chat, or for every send if chat_id is None"""
+        if chat_id is None:
+            self.global_bucket.pause(seconds)
+        else:
+            for bucket in self._buckets(chat_id):
+                bucket.pause(seconds)
+
+    def _cleanup(self, now):
+        # Forget chats whose buckets are back to full, they behave like new ones
+        self._chat_buckets = {chat_id: buckets for chat_id, buckets in self._chat_buckets.items()
+                              if not all(bucket.is_idle(now) for bucket in buckets)}
+        self._cleanup_at = now + 60
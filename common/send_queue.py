@@ -0,0 +1,267 @@
+"""Outbound Telegram message queue shared by the bots.
+
+Every Bot API call that sends something (send_message, send_photo,
+edit_message_text, ...) is submitted together with its keyword arguments
+and a priority lane. Worker threads (SendQueue) or tasks (AsyncSendQueue)
+execute the calls as fast as the global and per-chat token buckets allow,
+serving interactive replies before scheduled broadcasts. RetryAfter errors
+pause the affected chat and requeue the call; timeouts and network errors
+are retried with exponential backoff.
+"""
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from common.rate_limit import TelegramRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower values are served first
+INTERACTIVE = 0  # Replies to something a user just did
+SCHEDULED = 1    # Periodic broadcasts
+BULK = 2         # Background work such as restoring old messages
+
+
+def retry_after_seconds(error):
+    """RetryAfter.retry_after is an int in older python-telegram-bot versions and a timedelta in newer ones"""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def log_send_failure(description):
+    """Done-callback for queued sends whose result is not needed, logs the error once the retries are used up"""
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Error {description}: {future.exception()}")
+    return callback
+
+
+class _Request:
+    __slots__ = ('priority', 'seq', 'method', 'kwargs', 'chat_id', 'attempts', 'future', 'submitted_at')
+
+    def __init__(self, priority, seq, method, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.kwargs = kwargs
+        self.chat_id = kwargs.get('chat_id')
+        self.attempts = 0
+        self.future = future
+        self.submitted_at = time.monotonic()
+
+
+class _Scheduler:
+    """Priority lanes plus a delay heap, gated by the rate limiter. Not thread safe."""
+
+    def __init__(self, limiter, clock=time.monotonic):
+        self.limiter = limiter
+        self.clock = clock
+        self._ready = []    # (priority, seq, request)
+        self._delayed = []  # (ready_at, seq, request)
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._ready) + len(self._delayed)
+
+    def next_seq(self):
+        return next(self._seq)
+
+    def push(self, request, delay=0.0):
+        if delay > 0:
+            heapq.heappush(self._delayed, (self.clock() + delay, request.seq, request))
+        else:
+            heapq.heappush(self._ready, (request.priority, request.seq, request))
+
+    def drain(self):
+        """Remove and return every queued request"""
+        requests = [entry[2] for entry in self._ready + self._delayed]
+        self._ready, self._delayed = [], []
+        return requests
+
+    def pop(self):
+        """Return (request, 0) for the next request allowed to go out, or (None, seconds to wait)"""
+        now = self.clock()
+        while self._delayed and self._delayed[0][0] <= now:
+            request = heapq.heappop(self._delayed)[2]
+            heapq.heappush(self._ready, (request.priority, request.seq, request))
+
+        while self._ready:
+            global_wait = self.limiter.global_wait(now)
+            if global_wait > 0:
+                return None, global_wait
+            request = heapq.heappop(self._ready)[2]
+            wait = self.limiter.reserve(request.chat_id, now)
+            if wait <= 0:
+                return request, 0.0
+            # This chat is over its limit, park the request and let other chats go first
+            heapq.heappush(self._delayed, (now + wait, request.seq, request))
+
+        if self._delayed:
+            return None, max(0.0, self._delayed[0][0] - now)
+        return None, None
+
+
+class _BaseSendQueue:
+    def __init__(self, limiter=None, max_attempts=5, backoff_base=1.0, backoff_max=30.0):
+        self.limiter = limiter or TelegramRateLimiter()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._scheduler = _Scheduler(self.limiter)
+
+    def _retry_delay(self, request, error):
+        """Seconds to wait before retrying `request`, or None if it must fail"""
+        request.attempts += 1
+        if request.attempts >= self.max_attempts:
+            return None
+        if isinstance(error, RetryAfter):
+            seconds = retry_after_seconds(error)
+            self.limiter.pause(seconds, request.chat_id)
+            logger.warning(f"Flood control for chat {request.chat_id}, retrying in {seconds}s")
+            return seconds
+        if isinstance(error, BadRequest):
+            return None  # A subclass of NetworkError, but retrying the same request cannot help
+        if isinstance(error, (TimedOut, NetworkError)):
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (request.attempts - 1))
+            logger.warning(f"{error.__class__.__name__} sending to chat {request.chat_id} "
+                           f"(attempt {request.attempts}/{self.max_attempts}), retrying in {delay}s")
+            return delay
+        return None
+
+
+class SendQueue(_BaseSendQueue):
+    """Thread-based send queue for python-telegram-bot 13 style synchronous bots"""
+
+    def __init__(self, workers=4, **kwargs):
+        super().__init__(**kwargs)
+        self._condition = threading.Condition()
+        self._running = True
+        self._threads = [threading.Thread(target=self._worker, name=f"send-queue-{i}", daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, method, priority=SCHEDULED, **kwargs):
+        """Queue `method(**kwargs)`; returns a concurrent.futures.Future with its result"""
+        future = concurrent.futures.Future()
+        with self._condition:
+            request = _Request(priority, self._scheduler.next_seq(), method, kwargs, future)
+            self._scheduler.push(request)
+            self._condition.notify()
+        return future
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._running:
+                        return
+                    request, wait = self._scheduler.pop()
+                    if request is not None:
+                        break
+                    self._condition.wait(wait)
+            if request.future.cancelled():
+                continue  # Cancelled by the caller while queued
+            try:
+                result = request.method(**request.kwargs)
+            except Exception as e:
+                delay = self._retry_delay(request, e)
+                if delay is None:
+                    _resolve(request.future, exception=e)
+                else:
+                    with self._condition:
+                        self._scheduler.push(request, delay)
+                        self._condition.notify()
+                continue
+            _resolve(request.future, result=result)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._scheduler)
+
+    def stop(self, timeout=5):
+        with self._condition:
+            self._running = False
+            requests = self._scheduler.drain()
+            self._condition.notify_all()
+        for request in requests:
+            request.future.cancel()  # Nothing will send them anymore
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def _resolve(future, result=None, exception=None):
+    """Complete a future unless the caller cancelled it in the meantime"""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except (concurrent.futures.InvalidStateError, asyncio.InvalidStateError):
+        pass
+
+
+class AsyncSendQueue(_BaseSendQueue):
+    """asyncio send queue for python-telegram-bot 20 style bots; call start() from the running loop"""
+
+    def __init__(self, workers=4, **kwargs):
+        super().__init__(**kwargs)
+        self.workers = workers
+        self._wakeup = None
+        self._tasks = []
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, method, priority=SCHEDULED, **kwargs):
+        """Queue the coroutine method `method(**kwargs)`; returns an asyncio.Future with its result"""
+        future = asyncio.get_running_loop().create_future()
+        self._scheduler.push(_Request(priority, self._scheduler.next_seq(), method, kwargs, future))
+        self._wakeup.set()
+        return future
+
+    async def _worker(self):
+        while True:
+            request, wait = self._scheduler.pop()
+            if request is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if request.future.done():
+                continue  # Cancelled by the caller while queued
+            try:
+                result = await request.method(**request.kwargs)
+            except asyncio.CancelledError:
+                request.future.cancel()
+                raise
+            except Exception as e:
+                delay = self._retry_delay(request, e)
+                if delay is None:
+                    _resolve(request.future, exception=e)
+                else:
+                    self._scheduler.push(request, delay)
+                    self._wakeup.set()
+                continue
+            _resolve(request.future, result=result)
+
+    def __len__(self):
+        return len(self._scheduler)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Release callers still awaiting requests that will never be sent
+        for request in self._scheduler.drain():
+            request.future.cancel()
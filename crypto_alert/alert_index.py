@@ -0,0 +1,99 @@
+import bisect
+from array import array
+
+
+class _SortedSide:
+	"""Alerts sorted by key in parallel arrays; the triggered alerts are always a tail"""
+	__slots__ = ('keys', 'alerts')
+
+	def __init__(self):
+		self.keys = array('d')
+		self.alerts = []
+
+	def __len__(self):
+		return len(self.alerts)
+
+	def add(self, key, alert):
+		index = bisect.bisect_right(self.keys, key)
+		self.keys.insert(index, key)
+		self.alerts.insert(index, alert)
+
+	def extend(self, items):
+		"""Merge many (key, alert) items with a single sort"""
+		merged = sorted(list(zip(self.keys, self.alerts)) + list(items), key=lambda item: item[0])
+		self.keys = array('d', (key for key, alert in merged))
+		self.alerts = [alert for key, alert in merged]
+
+	def remove(self, key, alert_id):
+		index = bisect.bisect_left(self.keys, key)
+		while index < len(self.keys) and self.keys[index] == key:
+			if self.alerts[index].id == alert_id:
+				del self.keys[index]
+				del self.alerts[index]
+				return True
+			index += 1
+		return False
+
+	def pop_from(self, key):
+		"""Remove and return every alert whose key is >= `key`"""
+		index = bisect.bisect_left(self.keys, key)
+		if index == len(self.keys):
+			return []
+		triggered = self.alerts[index:]
+		del self.keys[index:]
+		del self.alerts[index:]
+		return triggered
+
+
+class ThresholdIndex:
+	"""The alerts of one currency pair, indexed by threshold.
+
+	'<' alerts fire once the price drops to their threshold or lower, '>'
+	alerts once it rises to their threshold or higher. Each side is kept
+	sorted so that the alerts a price triggers are a contiguous tail: '<'
+	alerts are keyed by their price, '>' alerts by the negated price. A price
+	update finds them with one bisection and removes them with one slice
+	deletion, O(log n + k) for k triggered alerts.
+	"""
+	__slots__ = ('below', 'above')
+
+	def __init__(self):
+		self.below = _SortedSide()  # '<' alerts, key = price
+		self.above = _SortedSide()  # '>' alerts, key = -price
+
+	def __len__(self):
+		return len(self.below) + len(self.above)
+
+	def _side(self, alert):
+		if alert.sign == '<':
+			return self.below, alert.price
+		return self.above, -alert.price
+
+	def add(self, alert):
+		side, key = self._side(alert)
+		side.add(key, alert)
+
+	def extend(self, alerts):
+		"""Add many alerts at once, sorting each side only once"""
+		below, above = [], []
+		for alert in alerts:
+			if alert.sign == '<':
+				below.append((alert.price, alert))
+			else:
+				above.append((-alert.price, alert))
+		if below:
+			self.below.extend(below)
+		if above:
+			self.above.extend(above)
+
+	def remove(self, alert):
+		side, key = self._side(alert)
+		return side.remove(key, alert.id)
+
+	def pop_triggered(self, price):
+		"""Remove and return every alert triggered by `price`"""
+		return self.below.pop_from(price) + self.above.pop_from(-price)
+
+	def pop_triggered_range(self, low, high):
+		"""Remove and return ('<' alerts triggered by `low`, '>' alerts triggered by `high`)"""
+		return self.below.pop_from(low), self.above.pop_from(-high)
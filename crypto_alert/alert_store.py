@@ -0,0 +1,161 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from price_hub import Alert
+
+logger = logging.getLogger(__name__)
+
+
+class AlertStore:
+	"""SQLite store (WAL mode) for the active alerts and the history of closed ones.
+
+	New, triggered and removed alerts are buffered and written in one
+	transaction with executemany once `batch_size` writes are pending or the
+	oldest one is `commit_interval` seconds old; callers should also call
+	flush() periodically. load_active() reads every active alert in one
+	query, ready for PriceHub.load_alerts(). Checkpoints are named
+	timestamps, e.g. of the last price tick, kept across restarts.
+	"""
+
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS alerts (
+			id INTEGER PRIMARY KEY,
+			chat_id INTEGER NOT NULL,
+			crypto TEXT NOT NULL,
+			currency TEXT NOT NULL,
+			sign TEXT NOT NULL,
+			price REAL NOT NULL,
+			created_at REAL NOT NULL
+		);
+		CREATE TABLE IF NOT EXISTS alert_history (
+			id INTEGER PRIMARY KEY,
+			chat_id INTEGER NOT NULL,
+			crypto TEXT NOT NULL,
+			currency TEXT NOT NULL,
+			sign TEXT NOT NULL,
+			price REAL NOT NULL,
+			created_at REAL NOT NULL,
+			status TEXT NOT NULL,
+			trigger_price REAL,
+			closed_at REAL NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS idx_alert_history_chat ON alert_history (chat_id, closed_at);
+		CREATE TABLE IF NOT EXISTS checkpoints (
+			name TEXT PRIMARY KEY,
+			at REAL NOT NULL
+		);
+	"""
+
+	# An alert can trigger before its insert is written, it must not come back as active then
+	INSERT_ALERT = ("INSERT OR REPLACE INTO alerts (id, chat_id, crypto, currency, sign, price, created_at) "
+	                "SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM alert_history WHERE id = ?)")
+	INSERT_HISTORY = ("INSERT OR REPLACE INTO alert_history "
+	                  "(id, chat_id, crypto, currency, sign, price, created_at, status, trigger_price, closed_at) "
+	                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+	DELETE_ALERT = "DELETE FROM alerts WHERE id = ?"
+	SELECT_ACTIVE = "SELECT id, chat_id, crypto, currency, sign, price, created_at FROM alerts"
+	SAVE_CHECKPOINT = "INSERT OR REPLACE INTO checkpoints (name, at) VALUES (?, ?)"
+	SELECT_CHECKPOINT = "SELECT at FROM checkpoints WHERE name = ?"
+	MAX_ID = "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM alerts UNION ALL SELECT MAX(id) FROM alert_history)"
+
+	TRIGGERED = 'triggered'
+	REMOVED = 'removed'
+
+	def __init__(self, path, batch_size=500, commit_interval=1.0):
+		self.path = path
+		self.batch_size = batch_size
+		self.commit_interval = commit_interval
+		self._inserts = []
+		self._closes = []
+		self._checkpoints = {}
+		self._first_pending_at = None
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute("PRAGMA synchronous=NORMAL")
+		self._conn.executescript(self.SCHEMA)
+		self._conn.commit()
+
+	def load_active(self):
+		"""Every active alert, as Alert objects"""
+		with self._lock:
+			rows = self._conn.execute(self.SELECT_ACTIVE).fetchall()
+		logger.info(f'Loaded {len(rows)} active alerts from {self.path}')
+		return [Alert(*row) for row in rows]
+
+	def max_id(self):
+		"""Highest alert id ever stored, new ids must be above it"""
+		with self._lock:
+			return self._conn.execute(self.MAX_ID).fetchone()[0] or 0
+
+	def last_checkpoint(self, name):
+		"""Timestamp saved under `name`, or None"""
+		with self._lock:
+			if name in self._checkpoints:
+				return self._checkpoints[name]
+			row = self._conn.execute(self.SELECT_CHECKPOINT, (name,)).fetchone()
+		return row[0] if row else None
+
+	def checkpoint(self, name, at):
+		"""Save a timestamp under `name` with the next flush"""
+		with self._lock:
+			self._checkpoints[name] = at
+
+	def _queued(self):
+		if self._first_pending_at is None:
+			self._first_pending_at = time.monotonic()
+		if (len(self._inserts) + len(self._closes) >= self.batch_size
+				or time.monotonic() - self._first_pending_at >= self.commit_interval):
+			self._flush()
+
+	def add(self, alert):
+		with self._lock:
+			self._inserts.append((alert.id, alert.chat_id, alert.crypto, alert.currency,
+			                      alert.sign, alert.price, alert.created_at, alert.id))
+			self._queued()
+
+	def close_alerts(self, alerts, status, trigger_prices=None):
+		"""Move alerts to the history, with the price that triggered each of them if any"""
+		now = time.time()
+		with self._lock:
+			for position, alert in enumerate(alerts):
+				trigger_price = trigger_prices[position] if trigger_prices is not None else None
+				self._closes.append((alert.id, alert.chat_id, alert.crypto, alert.currency, alert.sign,
+				                     alert.price, alert.created_at, status, trigger_price, now))
+			self._queued()
+
+	def triggered(self, triggered):
+		"""Record [(alert, price)] as triggered"""
+		self.close_alerts([alert for alert, price in triggered], self.TRIGGERED,
+		                  [price for alert, price in triggered])
+
+	def removed(self, alert):
+		self.close_alerts([alert], self.REMOVED)
+
+	def _flush(self):
+		if not self._inserts and not self._closes and not self._checkpoints:
+			return
+		with self._conn:
+			if self._checkpoints:
+				self._conn.executemany(self.SAVE_CHECKPOINT, list(self._checkpoints.items()))
+			# Inserts first, an alert may be created and triggered within the same batch
+			if self._inserts:
+				self._conn.executemany(self.INSERT_ALERT, self._inserts)
+			if self._closes:
+				self._conn.executemany(self.INSERT_HISTORY, self._closes)
+				self._conn.executemany(self.DELETE_ALERT, [(row[0],) for row in self._closes])
+		self._inserts = []
+		self._closes = []
+		self._checkpoints = {}
+		self._first_pending_at = None
+
+	def flush(self):
+		with self._lock:
+			self._flush()
+
+	def close(self):
+		with self._lock:
+			self._flush()
+			self._conn.close()
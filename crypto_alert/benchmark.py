@@ -0,0 +1,257 @@
+"""Load simulator for the crypto alert engine.
+
+Builds 10k, 100k, 1M, ... synthetic alerts around a random-walk price,
+drives them through the PriceHub with a fake Coinbase client and sends the
+notifications through the real NotificationPipeline and SendQueue to a
+fake bot. Reports per alert count:
+
+  - load time and memory per alert (index plus Alert objects)
+  - price ticks per second, and alerts covered per second: the active
+    alerts a tick checks, most of them skipped by the threshold index
+    rather than compared one by one
+  - trigger-to-send latency percentiles
+  - the cost of the old design, one python-telegram-bot job per alert
+
+Results are written as JSON so runs can be compared over time:
+
+	python benchmark.py --alerts 10000 100000 1000000 --ticks 200 --output bench_results.json
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.rate_limit import TelegramRateLimiter
+from common.send_queue import SendQueue
+from cross_rates import CrossRateCache
+from notifications import NotificationPipeline
+from price_hub import Alert, PriceHub
+
+
+class RandomWalk:
+	"""Geometric random walk of the prices of several pairs"""
+
+	def __init__(self, pairs, start_price=100.0, volatility=0.002, seed=0):
+		self.prices = {pair: start_price for pair in pairs}
+		self.volatility = volatility
+		self._rng = random.Random(seed)
+
+	def step(self):
+		for pair, price in self.prices.items():
+			self.prices[pair] = price * math.exp(self._rng.gauss(0, self.volatility))
+
+
+class FakeCoinbaseClient:
+	"""Answers get_spot_price and get_exchange_rates from the random walk and counts the calls"""
+
+	def __init__(self, walk):
+		self.walk = walk
+		self.calls = 0
+
+	def get_spot_price(self, currency_pair):
+		self.calls += 1
+		return {'amount': str(self.walk.prices[currency_pair])}
+
+	def get_exchange_rates(self, currency):
+		self.calls += 1
+		rates = {}
+		for pair, price in self.walk.prices.items():
+			crypto, quote = pair.split('-')
+			if quote == currency:
+				rates[crypto] = str(1 / price)
+		return {'currency': currency, 'rates': rates}
+
+
+class FakeBot:
+	"""Stands in for telegram.Bot, each send takes `latency` seconds"""
+
+	def __init__(self, latency=0.0):
+		self.latency = latency
+		self.messages = 0
+		self._lock = threading.Lock()
+
+	def send_message(self, chat_id, text, **kwargs):
+		if self.latency:
+			time.sleep(self.latency)
+		with self._lock:
+			self.messages += 1
+
+
+def make_alerts(count, pairs, chats, start_price, spread, seed):
+	rng = random.Random(seed)
+	alerts = []
+	for alert_id in range(1, count + 1):
+		crypto, currency = rng.choice(pairs).split('-')
+		alerts.append(Alert(alert_id, rng.randrange(chats), crypto, currency, rng.choice('<>'),
+		                    start_price * (1 + rng.uniform(-spread, spread)), 0.0))
+	return alerts
+
+
+def measure_memory(alerts):
+	"""Bytes allocated per alert by a hub holding `alerts`"""
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	copies = [Alert(alert.id, alert.chat_id, alert.crypto, alert.currency, alert.sign, alert.price, alert.created_at)
+	          for alert in alerts]
+	hub = PriceHub(lambda pair: 0.0)
+	hub.load_alerts(copies)
+	used = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	del hub, copies
+	return used / len(alerts)
+
+
+def measure_job_queue(count):
+	"""Time and memory of scheduling one repeating job per alert, as the bot used to"""
+	try:
+		from queue import Queue
+		from telegram.ext import Dispatcher, JobQueue
+	except ImportError:
+		return None
+
+	class _Bot:
+		defaults = None
+
+	job_queue = JobQueue()
+	job_queue.set_dispatcher(Dispatcher(_Bot(), Queue(), workers=0, job_queue=job_queue))
+	gc.collect()
+	tracemalloc.start()
+	started = time.perf_counter()
+	for alert_id in range(count):
+		job_queue.run_repeating(lambda context: None, interval=15, first=15, context=['BTC', '<', 100, alert_id])
+	elapsed = time.perf_counter() - started
+	used = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return {
+		'jobs': count,
+		'schedule_seconds': elapsed,
+		'jobs_per_second': count / elapsed,
+		'bytes_per_job': used / count,
+	}
+
+
+def run_scenario(count, args):
+	pairs = [f'{crypto}-EUR' for crypto in ('BTC', 'ETH', 'SOL', 'ADA', 'DOT')[:args.pairs]]
+	walk = RandomWalk(pairs, args.start_price, args.volatility, args.seed)
+	client = FakeCoinbaseClient(walk)
+	bot = FakeBot(args.send_latency)
+	chats = max(1, count // args.alerts_per_chat)
+	alerts = make_alerts(count, pairs, chats, args.start_price, args.spread, args.seed)
+
+	result = {'alerts': count, 'pairs': len(pairs), 'chats': chats}
+	result['bytes_per_alert'] = measure_memory(alerts)
+
+	if args.bulk_rates:
+		rate_cache = CrossRateCache(lambda base: client.get_exchange_rates(currency=base)['rates'], base='EUR', ttl=0)
+		hub = PriceHub(rate_cache.price, ttl=0, fetch_prices=rate_cache.prices)
+	else:
+		hub = PriceHub(lambda pair: client.get_spot_price(currency_pair=pair)['amount'], ttl=0)
+	started = time.perf_counter()
+	hub.load_alerts(alerts)
+	result['load_seconds'] = time.perf_counter() - started
+
+	if args.telegram_limits:
+		limiter = TelegramRateLimiter()
+	else:
+		limiter = TelegramRateLimiter(global_rate=1e9, chat_rate=1e9, group_per_minute=1e9)
+	send_queue = SendQueue(workers=args.workers, limiter=limiter)
+	pipeline = NotificationPipeline(send_queue, bot.send_message, lambda alert, price: f'{alert.id} {price:.2f}')
+
+	covered = 0
+	triggered = 0
+	poll_seconds = 0.0
+	for _ in range(args.ticks):
+		walk.step()
+		covered += len(hub)
+		started = time.perf_counter()
+		fired = hub.poll()
+		poll_seconds += time.perf_counter() - started
+		triggered += len(fired)
+		if fired:
+			pipeline.push(fired)
+
+	deadline = time.monotonic() + args.drain_timeout
+	while pipeline.finished < triggered and time.monotonic() < deadline:
+		time.sleep(0.05)
+	pipeline.stop()
+	send_queue.stop()
+
+	result.update({
+		'ticks': args.ticks,
+		'triggered': triggered,
+		'delivered': pipeline.sent,
+		'messages': bot.messages,
+		'api_calls': client.calls,
+		'api_calls_per_tick': client.calls / args.ticks,
+		'poll_seconds': poll_seconds,
+		'ticks_per_second': args.ticks / poll_seconds if poll_seconds else None,
+		'alerts_covered_per_second': covered / poll_seconds if poll_seconds else None,
+		'latency_seconds': pipeline.latency_percentiles(),
+	})
+	if args.job_queue_alerts:
+		job_queue = measure_job_queue(min(count, args.job_queue_alerts))
+		if job_queue is not None:
+			# Extrapolated linearly to every alert; each job also called Coinbase on its own every 15 seconds
+			job_queue['estimated_schedule_seconds'] = count / job_queue['jobs_per_second']
+			job_queue['api_calls_per_second'] = count / 15
+		result['job_queue'] = job_queue
+	return result
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Crypto alert engine benchmark')
+	parser.add_argument('--alerts', type=int, nargs='+', default=[10000, 100000])
+	parser.add_argument('--ticks', type=int, default=200)
+	parser.add_argument('--pairs', type=int, default=3, help='number of currency pairs, at most 5')
+	parser.add_argument('--alerts-per-chat', type=int, default=5)
+	parser.add_argument('--start-price', type=float, default=100.0)
+	parser.add_argument('--spread', type=float, default=0.1, help='alert thresholds within +/- this fraction')
+	parser.add_argument('--volatility', type=float, default=0.002, help='standard deviation of a log-price step')
+	parser.add_argument('--send-latency', type=float, default=0.0, help='seconds taken by each fake send')
+	parser.add_argument('--workers', type=int, default=8)
+	parser.add_argument('--bulk-rates', action='store_true',
+	                    help='price every pair from one exchange-rate request per tick instead of one per pair')
+	parser.add_argument('--telegram-limits', action='store_true', help="apply Telegram's rate limits to the fake bot")
+	parser.add_argument('--drain-timeout', type=float, default=60.0)
+	parser.add_argument('--job-queue-alerts', type=int, default=10000,
+	                    help='alerts scheduled as python-telegram-bot jobs for comparison, 0 to skip')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', default='bench_results.json')
+	args = parser.parse_args()
+
+	results = {
+		'timestamp': time.time(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'arguments': vars(args),
+		'scenarios': [],
+	}
+	for count in args.alerts:
+		scenario = run_scenario(count, args)
+		results['scenarios'].append(scenario)
+		latency = scenario['latency_seconds']
+		print(f"{count} alerts: load {scenario['load_seconds']:.3f}s, {scenario['bytes_per_alert']:.0f} B/alert, "
+		      f"{scenario['alerts_covered_per_second']:.0f} alerts covered/s, {scenario['triggered']} triggered, "
+		      f"latency p50 {latency['p50'] or 0:.4f}s p99 {latency['p99'] or 0:.4f}s")
+		if scenario.get('job_queue'):
+			job_queue = scenario['job_queue']
+			print(f"  as job queue jobs: {job_queue['estimated_schedule_seconds']:.1f}s to schedule, "
+			      f"{job_queue['bytes_per_job']:.0f} B/job, {job_queue['api_calls_per_second']:.0f} API calls/s "
+			      f"instead of {scenario['api_calls_per_tick']:.0f} per tick")
+
+	with open(args.output, 'w') as file:
+		json.dump(results, file, indent=2)
+	print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateSnapshot:
+	"""Exchange rates of every currency against one base currency, fetched at once.
+
+	`rates[currency]` is how many units of `currency` one unit of the base is
+	worth, as returned by Coinbase's exchange-rates endpoint. The price of
+	CRYPTO in QUOTE is then rates[QUOTE] / rates[CRYPTO]; the inverses are
+	computed once per snapshot so each cross rate costs one multiplication.
+	"""
+	__slots__ = ('base', 'rates', 'inverse', 'fetched_at')
+
+	def __init__(self, base, rates, fetched_at):
+		self.base = base
+		self.rates = {currency: float(rate) for currency, rate in rates.items()}
+		self.rates[base] = 1.0
+		self.inverse = {currency: 1.0 / rate for currency, rate in self.rates.items() if rate > 0}
+		self.fetched_at = fetched_at
+
+	def price(self, pair):
+		"""Price of a 'CRYPTO-QUOTE' pair, or None if either currency is unknown"""
+		crypto, quote = pair.split('-', 1)
+		inverse = self.inverse.get(crypto)
+		rate = self.rates.get(quote)
+		if inverse is None or rate is None:
+			return None
+		return rate * inverse
+
+	def prices(self, pairs):
+		"""{pair: price} for every pair whose currencies are known"""
+		rates, inverse = self.rates, self.inverse
+		result = {}
+		for pair in pairs:
+			crypto, quote = pair.split('-', 1)
+			if crypto in inverse and quote in rates:
+				result[pair] = rates[quote] * inverse[crypto]
+		return result
+
+
+class CrossRateCache:
+	"""Serves the price of any currency pair from a single bulk exchange-rate request.
+
+	`fetch_rates(base)` returns {currency: rate} for the base currency (e.g.
+	coinbase_client.get_exchange_rates(currency=base)['rates']). The snapshot
+	is refreshed at most every `ttl` seconds, so every alert evaluated in a
+	tick is priced from the same consistent set of rates, whatever its
+	currency.
+	"""
+
+	def __init__(self, fetch_rates, base='USD', ttl=10.0, clock=time.monotonic):
+		self.fetch_rates = fetch_rates
+		self.base = base
+		self.ttl = ttl
+		self.clock = clock
+		self.fetches = 0
+		self._snapshot = None
+		self._lock = threading.Lock()
+
+	def snapshot(self):
+		snapshot = self._snapshot
+		if snapshot is not None and self.clock() - snapshot.fetched_at < self.ttl:
+			return snapshot
+		with self._lock:
+			snapshot = self._snapshot
+			if snapshot is None or self.clock() - snapshot.fetched_at >= self.ttl:
+				snapshot = self._snapshot = RateSnapshot(self.base, self.fetch_rates(self.base), self.clock())
+				self.fetches += 1
+		return snapshot
+
+	def price(self, pair):
+		"""Price of one pair; raises KeyError if a currency is not quoted"""
+		price = self.snapshot().price(pair)
+		if price is None:
+			raise KeyError(f'No exchange rate for {pair}')
+		return price
+
+	def prices(self, pairs):
+		return self.snapshot().prices(pairs)
@@ -1,27 +1,57 @@
+import html
+import logging
+import os
+import sys
 from coinbase.wallet.client import Client
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import Update
 from telegram import ParseMode
 from telegram.ext import CommandHandler, Defaults, Updater, Dispatcher, CallbackQueryHandler, CallbackContext, ConversationHandler
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.send_queue import SendQueue
+import keyboards
+from alert_store import AlertStore
+from cross_rates import CrossRateCache
+from notifications import NotificationPipeline
+from price_hub import PriceHub
+from price_sources import PollingPriceSource, StreamingPriceSource, coinbase_price_range, coinbase_products
+
 COINBASE_KEY = 'your-coinbase-key'
 COINBASE_SECRET = 'your-coinbase-secret' 
 TELEGRAM_TOKEN = 'your-telegram-bot-token'
 coinbase_client = Client(COINBASE_KEY, COINBASE_SECRET)
 
+# Rate-limited outbound queue for alert notifications, several workers so that chats are served concurrently
+send_queue = SendQueue(workers=8)
+
+# 'polling' fetches each currency pair every PRICE_POLL_INTERVAL seconds, 'streaming' evaluates
+# alerts on every tick of the websocket feed (use ws://localhost:8765 with replay_server.py offline)
+PRICE_SOURCE = 'polling'
+PRICE_STREAM_URL = 'wss://ws-feed.exchange.coinbase.com'
+PRICE_POLL_INTERVAL = 15
+
+# Every pair is priced from one bulk exchange-rate request against RATE_BASE_CURRENCY, cross rates are derived locally
+RATE_BASE_CURRENCY = 'USD'
+DEFAULT_CURRENCY = 'EUR'
+CURRENCY_SYMBOLS = {'EUR': '€', 'USD': '$', 'GBP': '£', 'JPY': '¥'}
+CURRENCY_DECIMALS = {'JPY': 0} # Other currencies show cents
+SUB_UNIT_DECIMALS = 8 # Prices below 1, e.g. crypto-to-crypto pairs, keep up to this many decimals
+rate_cache = CrossRateCache(lambda base: coinbase_client.get_exchange_rates(currency=base)['rates'],
+                            base=RATE_BASE_CURRENCY, ttl=PRICE_POLL_INTERVAL - 5)
+price_hub = PriceHub(rate_cache.price, ttl=PRICE_POLL_INTERVAL - 5, fetch_prices=rate_cache.prices)
+
+# Active alerts survive restarts, triggered and removed ones are kept as history
+ALERT_DB_FILE = 'alerts.db'
+alert_store = AlertStore(ALERT_DB_FILE)
+# Time of the last streamed tick, the gap after a restart is filled from it
+PRICE_CHECKPOINT = 'last_price_tick'
+
 # Stages
 FIRST, SECOND = range(2)
 
 def startCommand(update, context):
 	"""Sends a message with three inline buttons attached."""
-	keyboard = [
-		[InlineKeyboardButton("Track", callback_data='1_track'), InlineKeyboardButton("Contact", callback_data='2_contact')], 
-		[InlineKeyboardButton("Help", callback_data='3_help')]
-	]
-
-	reply_markup = InlineKeyboardMarkup(keyboard)
-	
-	#query.edit_message_text(text="Scegli", reply_markup=reply_markup)
-	update.message.reply_text('Please choose:', reply_markup=reply_markup)
+	update.message.reply_text(keyboards.START_TEXT, reply_markup=keyboards.MAIN_MENU)
 	return FIRST
 
 	# context.bot.send_message(chat_id=update.effective_chat.id, text='Hello there!')
@@ -29,98 +59,108 @@ def startCommand(update, context):
 def startOver(update, context):
 	query = update.callback_query
 	query.answer()
-	keyboard = [
-		[InlineKeyboardButton("Track", callback_data='1_track'), InlineKeyboardButton("Contact", callback_data='2')], 
-		[InlineKeyboardButton("Help", callback_data='3_help')]
-	]
-	reply_markup = InlineKeyboardMarkup(keyboard)
-	
-	query.edit_message_text(text="Scegli", reply_markup=reply_markup)
-	#update.message.reply_text('Please choose:', reply_markup=reply_markup)
+	query.edit_message_text(text=keyboards.START_OVER_TEXT, reply_markup=keyboards.MAIN_MENU)
 	return FIRST
 
 def helpCommand(update, context):
 	query = update.callback_query
 	query.answer()
-	keyboard = [
-		[InlineKeyboardButton("Indietro", callback_data='back')]
-	]
-	reply_markup = InlineKeyboardMarkup(keyboard)
-	query.edit_message_text(text="Ecco il mio aiuto altrimenti torna indietro", reply_markup=reply_markup)
+	query.edit_message_text(text=keyboards.HELP_TEXT, reply_markup=keyboards.BACK_MENU)
 	return FIRST
 
 def contactCommand(update, context):
 	query = update.callback_query
 	query.answer()
-	keyboard = [
-		[InlineKeyboardButton("Indietro", callback_data='back')]
-	]
-	reply_markup = InlineKeyboardMarkup(keyboard)
-	query.edit_message_text(text="Contattami", reply_markup=reply_markup)
+	query.edit_message_text(text=keyboards.CONTACT_TEXT, reply_markup=keyboards.BACK_MENU)
 	return FIRST
 
-def priceAlertCallback(context):
-	crypto = context.job.context[0]
-	sign = context.job.context[1]
-	price = context.job.context[2]
-	chat_id = context.job.context[3]
-	
-	send = False
-	spot_price = coinbase_client.get_spot_price(currency_pair=crypto + '-EUR')['amount']
-	
-	if sign == '<':
-		if float(price) >= float(spot_price):
-			send = True
-	else:
-		if float(price) <= float(spot_price):
-			send = True
-	
-	if send:
-		response = f'👋 {crypto} has surpassed €{price} and has just reached <b>€{spot_price}</b>!'
-	
-		context.job.schedule_removal()
-	
-		context.bot.send_message(chat_id=chat_id, text=response)
+def formatAmount(amount, currency):
+	if amount >= 1:
+		return f'{amount:,.{CURRENCY_DECIMALS.get(currency, 2)}f}'
+	return f'{amount:.{SUB_UNIT_DECIMALS}f}'.rstrip('0').rstrip('.') or '0'
+
+def formatPrice(amount, currency):
+	symbol = CURRENCY_SYMBOLS.get(currency)
+	return f'{symbol}{formatAmount(amount, currency)}' if symbol else f'{formatAmount(amount, currency)} {currency}'
+
+def formatAlert(alert, spot_price):
+	return (f'👋 {html.escape(alert.crypto)} has surpassed {html.escape(formatPrice(alert.price, alert.currency))} '
+	        f'and has just reached <b>{html.escape(formatPrice(spot_price, alert.currency))}</b>!')
+
+def priceAlertCallback(triggered):
+	# Called by the price source; triggered alerts are removed from the hub, they fire only once
+	alert_store.triggered(triggered)
+	notifications.push(triggered)
+
+def logNotificationStats(context):
+	latency = notifications.latency_percentiles()
+	if latency['p50'] is not None:
+		logging.info(f"Alert notifications: {notifications.sent} sent, {notifications.failed} failed, "
+		             f"latency p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s p99 {latency['p99']:.3f}s")
 		
 
 def priceTrack(update, context):
 	query = update.callback_query
 	query.answer()
-	keyboard = [
-		[InlineKeyboardButton("Indietro", callback_data='back')]
-	]
-	reply_markup = InlineKeyboardMarkup(keyboard)
-	query.edit_message_text(text="Scrivi /alert BTC price", reply_markup=reply_markup)
+	query.edit_message_text(text=keyboards.TRACK_TEXT, reply_markup=keyboards.BACK_MENU)
 	return FIRST
 
-def priceAlert(update, context):
-	keyboard = [
-		[InlineKeyboardButton("Indietro", callback_data='back')]
-	]
-	reply_markup = InlineKeyboardMarkup(keyboard)
+def isPrice(text):
+	try:
+		return float(text) > 0
+	except ValueError:
+		return False
 
-	if len(context.args) > 2:
+def priceAlert(update, context):
+	if len(context.args) > 2 and context.args[1] in ('<', '>') and isPrice(context.args[2]):
 		crypto = context.args[0].upper()
 		sign = context.args[1]
 		price = context.args[2]
+		currency = context.args[3].upper() if len(context.args) > 3 else DEFAULT_CURRENCY
 	
-		context.job_queue.run_repeating(priceAlertCallback, interval=15, first=15, context=[crypto, sign, price, update.message.chat_id])
-		
-		response = f"⏳ I will send you a message when the price of {crypto} reaches €{price}, \n"
-		response += f"the current price of {crypto} is €{coinbase_client.get_spot_price(currency_pair=crypto + '-EUR')['amount']}"
+		try:
+			# Fetched before the alert is added, so unknown crypto or currency codes are rejected
+			spot_price = price_hub.get_price(f'{crypto}-{currency}')
+		except Exception:
+			response = f'⚠️ Unknown crypto or currency code: {html.escape(crypto)}-{html.escape(currency)}'
+		else:
+			alert = price_hub.new_alert(update.message.chat_id, crypto, currency, sign, price)
+			alert_store.add(alert)
+			price_source.watch(alert.pair)
+			
+			# Replies are parsed as HTML, the codes come from the user
+			response = f"⏳ I will send you a message when the price of {html.escape(crypto)} reaches {html.escape(formatPrice(alert.price, currency))}, \n"
+			response += f"the current price of {html.escape(crypto)} is {html.escape(formatPrice(spot_price, currency))} \n"
+			response += f"Use /remove {alert.id} to delete this alert"
 	else:
-		response = '⚠️ Please provide a crypto code and a price value: \n<i>/price_alert {crypto code} {> / &lt;} {price}</i>'
+		response = keyboards.ALERT_USAGE_TEXT
 	
 	#query.edit_message_text(text=response, reply_markup=reply_markup)
 	#context.bot.send_message(chat_id=update.effective_chat.id, text=response)
-	update.message.reply_text(response, reply_markup=reply_markup)
+	update.message.reply_text(response, reply_markup=keyboards.BACK_MENU)
 	return FIRST
+
+def removeAlert(update, context):
+	alert = price_hub.get(int(context.args[0])) if context.args and context.args[0].isdigit() else None
+	if alert is None or alert.chat_id != update.message.chat_id:
+		update.message.reply_text(keyboards.REMOVE_USAGE_TEXT)
+		return
+	if price_hub.remove_alert(alert.id):
+		alert_store.removed(alert)
+	update.message.reply_text(f'🗑 Alert on {html.escape(alert.crypto)} {html.escape(alert.sign)} '
+	                          f'{html.escape(formatPrice(alert.price, alert.currency))} removed')
+
+def flushAlertStore(context):
+	if getattr(price_source, 'last_tick_at', None) is not None:
+		alert_store.checkpoint(PRICE_CHECKPOINT, price_source.last_tick_at)
+	alert_store.flush()
 	
 	
 
 
 		
 if __name__ == '__main__':
+	logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 	updater = Updater(token=TELEGRAM_TOKEN, defaults=Defaults(parse_mode=ParseMode.HTML))
 
 	dispatcher = updater.dispatcher
@@ -135,9 +175,10 @@ if __name__ == '__main__':
 		entry_points=[CommandHandler('start', startCommand)],
 		states={
 			FIRST: [
-				CallbackQueryHandler(priceTrack, pattern='^' + '1_track' + '$'),
-				CallbackQueryHandler(helpCommand, pattern='^' + '3_help' + '$'),
-				CallbackQueryHandler(startOver, pattern='^' + 'back' + '$'),
+				CallbackQueryHandler(priceTrack, pattern='^' + keyboards.TRACK + '$'),
+				CallbackQueryHandler(contactCommand, pattern='^' + keyboards.CONTACT + '$'),
+				CallbackQueryHandler(helpCommand, pattern='^' + keyboards.HELP + '$'),
+				CallbackQueryHandler(startOver, pattern='^' + keyboards.BACK + '$'),
 			],
 		},
 		fallbacks=[CommandHandler('start', startCommand)],
@@ -148,10 +189,32 @@ if __name__ == '__main__':
 
 	#dispatcher.add_handler(CommandHandler('start' , startCommand))  #set command handler # Accessed via /start
 	dispatcher.add_handler(CommandHandler('alert' , priceAlert))  #set command handler # Accessed via /alert
+	dispatcher.add_handler(CommandHandler('remove' , removeAlert))  #set command handler # Accessed via /remove
+
+	# Restore the alerts saved before the last shutdown, then commit new writes regularly
+	price_hub.load_alerts(alert_store.load_active(), alert_store.max_id())
+	updater.job_queue.run_repeating(flushAlertStore, interval=2, first=2)
+
+	# Triggered alerts are grouped per chat and sent without holding up the price evaluation
+	notifications = NotificationPipeline(send_queue, updater.bot.send_message, formatAlert)
+	updater.job_queue.run_repeating(logNotificationStats, interval=600, first=600)
+
+	# One price source evaluates every alert
+	if PRICE_SOURCE == 'streaming':
+		price_source = StreamingPriceSource(price_hub, priceAlertCallback, url=PRICE_STREAM_URL, fetch_range=coinbase_price_range,
+		                                    list_products=coinbase_products, poll_interval=PRICE_POLL_INTERVAL,
+		                                    resume_from=alert_store.last_checkpoint(PRICE_CHECKPOINT))
+	else:
+		price_source = PollingPriceSource(price_hub, priceAlertCallback, interval=PRICE_POLL_INTERVAL)
+	price_source.start()
 
 	updater.start_polling() # Start the bot
 
 	# Run the bot until the user presses Ctrl-C or the process receives SIGINT,
 	updater.idle() # Wait for the script to be stopped, this will stop the bot as well
+	price_source.stop()
+	notifications.stop()
+	send_queue.stop()
+	alert_store.close()
 	
 	
@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.keyboards import inline_keyboard
+
+# Callback data of the menu buttons, matched by the conversation handler
+TRACK = '1_track'
+CONTACT = '2_contact'
+HELP = '3_help'
+BACK = 'back'
+
+MAIN_MENU = inline_keyboard([
+	[("Track", TRACK), ("Contact", CONTACT)],
+	[("Help", HELP)],
+])
+BACK_MENU = inline_keyboard([
+	[("Indietro", BACK)],
+])
+
+START_TEXT = 'Please choose:'
+START_OVER_TEXT = 'Scegli'
+HELP_TEXT = 'Ecco il mio aiuto altrimenti torna indietro'
+CONTACT_TEXT = 'Contattami'
+TRACK_TEXT = 'Scrivi /alert BTC &lt; price [EUR]'
+ALERT_USAGE_TEXT = '⚠️ Please provide a crypto code and a price value: \n<i>/price_alert {crypto code} {> / &lt;} {price} [currency]</i>'
+REMOVE_USAGE_TEXT = '⚠️ Please provide the number of one of your alerts: \n<i>/remove {alert number}</i>'
@@ -0,0 +1,120 @@
+import collections
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram's limit for a text message
+
+
+def percentile(sorted_values, fraction):
+	if not sorted_values:
+		return None
+	return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class NotificationPipeline:
+	"""Groups triggered alerts per chat and sends them through a send queue.
+
+	push() only appends to a per-chat buffer, so the price source is never
+	held up by Telegram. A dispatcher thread waits `coalesce_seconds` after
+	the first pending alert, then turns every chat's alerts into as few
+	messages as the length limit allows and submits them to the send queue,
+	which sends to many chats concurrently within Telegram's rate limits.
+	The time from trigger to delivery of each alert is recorded.
+	"""
+
+	def __init__(self, send_queue, send_message, format_alert, coalesce_seconds=0.05, latency_history=10000,
+	             clock=time.monotonic):
+		self.send_queue = send_queue
+		self.send_message = send_message
+		self.format_alert = format_alert
+		self.coalesce_seconds = coalesce_seconds
+		self.clock = clock
+		self.sent = 0
+		self.failed = 0
+		self._latencies = collections.deque(maxlen=latency_history)
+		self._pending = {}  # chat_id -> [(alert, price, triggered at)]
+		self._condition = threading.Condition()
+		self._running = True
+		self._thread = threading.Thread(target=self._run, name='alert-notifications', daemon=True)
+		self._thread.start()
+
+	def push(self, triggered):
+		"""Queue [(alert, price)] for notification"""
+		now = self.clock()
+		with self._condition:
+			for alert, price in triggered:
+				self._pending.setdefault(alert.chat_id, []).append((alert, price, now))
+			self._condition.notify()
+
+	def _run(self):
+		while True:
+			with self._condition:
+				while self._running and not self._pending:
+					self._condition.wait()
+				if not self._running:
+					return
+			# Let alerts triggered by the same price move reach the buffer first
+			time.sleep(self.coalesce_seconds)
+			with self._condition:
+				pending, self._pending = self._pending, {}
+			for chat_id, items in pending.items():
+				try:
+					self._dispatch(chat_id, items)
+				except Exception as e:
+					logger.error(f'Error queueing alert notifications for chat {chat_id}: {e}')
+
+	def _dispatch(self, chat_id, items):
+		lines, triggered_at, length = [], [], 0
+		for alert, price, at in items:
+			line = self.format_alert(alert, price)
+			if lines and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+				self._submit(chat_id, lines, triggered_at)
+				lines, triggered_at, length = [], [], 0
+			lines.append(line)
+			triggered_at.append(at)
+			length += len(line) + 1
+		if lines:
+			self._submit(chat_id, lines, triggered_at)
+
+	def _submit(self, chat_id, lines, triggered_at):
+		future = self.send_queue.submit(self.send_message, chat_id=chat_id, text='\n'.join(lines))
+		future.add_done_callback(functools.partial(self._sent, chat_id, triggered_at))
+
+	def _sent(self, chat_id, triggered_at, future):
+		if future.cancelled() or future.exception() is not None:
+			with self._condition:
+				self.failed += len(triggered_at)
+			logger.error(f'Error notifying {len(triggered_at)} alerts to chat {chat_id}: '
+			             f'{future.exception() if not future.cancelled() else "cancelled"}')
+			return
+		now = self.clock()
+		with self._condition:
+			self.sent += len(triggered_at)
+			self._latencies.extend(now - at for at in triggered_at)
+
+	@property
+	def finished(self):
+		"""Alerts delivered or given up on, `sent` and `failed` read together"""
+		with self._condition:
+			return self.sent + self.failed
+
+	def latency_percentiles(self):
+		"""{'p50', 'p95', 'p99', 'max'} trigger-to-delivery latency in seconds over the recent alerts"""
+		with self._condition:
+			latencies = sorted(self._latencies)
+		return {
+			'p50': percentile(latencies, 0.50),
+			'p95': percentile(latencies, 0.95),
+			'p99': percentile(latencies, 0.99),
+			'max': latencies[-1] if latencies else None,
+		}
+
+	def stop(self):
+		with self._condition:
+			self._running = False
+			self._condition.notify_all()
+		self._thread.join()
@@ -0,0 +1,203 @@
+import itertools
+import logging
+import threading
+import time
+
+from alert_index import ThresholdIndex
+
+logger = logging.getLogger(__name__)
+
+
+class Alert:
+	"""A user's request to be told when `crypto` goes below ('<') or above ('>') `price`"""
+	__slots__ = ('id', 'chat_id', 'crypto', 'currency', 'sign', 'price', 'created_at')
+
+	def __init__(self, id, chat_id, crypto, currency, sign, price, created_at=None):
+		self.id = id
+		self.chat_id = chat_id
+		self.crypto = crypto
+		self.currency = currency
+		self.sign = sign
+		self.price = float(price)
+		self.created_at = created_at or time.time()
+
+	@property
+	def pair(self):
+		return f'{self.crypto}-{self.currency}'
+
+	def is_triggered(self, spot_price):
+		if self.sign == '<':
+			return self.price >= spot_price
+		return self.price <= spot_price
+
+	def __repr__(self):
+		return f'Alert(id={self.id}, chat_id={self.chat_id}, {self.pair} {self.sign} {self.price})'
+
+
+class PriceHub:
+	"""Polls each distinct currency pair once per tick and evaluates every alert on it.
+
+	Quotes are cached for `ttl` seconds, so the price shown when an alert is
+	created and the prices of the next tick share the same request. The
+	number of API calls grows with the number of distinct pairs, not with
+	the number of alerts. `fetch_price(pair)` returns the spot price of a
+	pair such as 'BTC-EUR'. If `fetch_prices(pairs)` is given, poll() prices
+	every watched pair with one call to it instead, e.g. from a
+	CrossRateCache snapshot, so a tick costs one request whatever the
+	currencies. The alerts of each pair live in a ThresholdIndex, so a price
+	only touches the alerts it triggers.
+	"""
+
+	def __init__(self, fetch_price, ttl=10.0, clock=time.monotonic, fetch_prices=None):
+		self.fetch_price = fetch_price
+		self.fetch_prices = fetch_prices
+		self.ttl = ttl
+		self.clock = clock
+		self._indexes = {}  # pair -> ThresholdIndex
+		self._alerts = {}  # alert id -> Alert
+		self._quotes = {}  # pair -> (price, fetched at)
+		self._ids = itertools.count(1)
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._alerts)
+
+	@property
+	def pairs(self):
+		with self._lock:
+			return list(self._indexes)
+
+	def oldest_alerts(self):
+		"""{pair: creation time of its oldest alert}"""
+		oldest = {}
+		with self._lock:
+			for alert in self._alerts.values():
+				if alert.created_at < oldest.get(alert.pair, float('inf')):
+					oldest[alert.pair] = alert.created_at
+		return oldest
+
+	def get(self, alert_id):
+		return self._alerts.get(alert_id)
+
+	def load_alerts(self, alerts, max_id=0):
+		"""Bulk-load stored alerts, sorting each pair's index once; new ids start above `max_id`"""
+		by_pair = {}
+		for alert in alerts:
+			by_pair.setdefault(alert.pair, []).append(alert)
+			max_id = max(max_id, alert.id)
+		with self._lock:
+			for pair, pair_alerts in by_pair.items():
+				index = self._indexes.get(pair)
+				if index is None:
+					index = self._indexes[pair] = ThresholdIndex()
+				index.extend(pair_alerts)
+				for alert in pair_alerts:
+					self._alerts[alert.id] = alert
+			self._ids = itertools.count(max_id + 1)
+		return len(alerts)
+
+	def new_alert(self, chat_id, crypto, currency, sign, price):
+		"""Create an alert with a fresh id and start watching it"""
+		alert = Alert(next(self._ids), chat_id, crypto, currency, sign, price)
+		self.add_alert(alert)
+		return alert
+
+	def add_alert(self, alert):
+		with self._lock:
+			index = self._indexes.get(alert.pair)
+			if index is None:
+				index = self._indexes[alert.pair] = ThresholdIndex()
+			index.add(alert)
+			self._alerts[alert.id] = alert
+
+	def remove_alert(self, alert_id):
+		"""Stop watching an alert; returns False if it was not active"""
+		with self._lock:
+			alert = self._alerts.pop(alert_id, None)
+			if alert is None:
+				return False
+			index = self._indexes[alert.pair]
+			index.remove(alert)
+			if not index:
+				del self._indexes[alert.pair]
+			return True
+
+	def get_price(self, pair):
+		"""Cached spot price of a pair, fetched again once it is older than the TTL"""
+		now = self.clock()
+		quote = self._quotes.get(pair)
+		if quote is not None and now - quote[1] < self.ttl:
+			return quote[0]
+		price = float(self.fetch_price(pair))
+		self._quotes[pair] = (price, now)
+		return price
+
+	def on_price(self, pair, price):
+		"""Evaluate the alerts of a pair against a new price; returns and removes the triggered ones"""
+		with self._lock:
+			index = self._indexes.get(pair)
+			if index is None:
+				return []
+			triggered = index.pop_triggered(price)
+			for alert in triggered:
+				del self._alerts[alert.id]
+			if not index:
+				del self._indexes[pair]
+		return triggered
+
+	def update_price(self, pair, price):
+		"""Cache a price pushed by a streaming source and evaluate the pair's alerts against it"""
+		price = float(price)
+		self._quotes[pair] = (price, self.clock())
+		return self.on_price(pair, price)
+
+	def on_range(self, pair, low, high):
+		"""Evaluate the alerts of a pair against the lowest and highest price of a period.
+
+		Used to catch up after a gap in a price stream; returns [(alert, price)].
+		"""
+		with self._lock:
+			index = self._indexes.get(pair)
+			if index is None:
+				return []
+			below, above = index.pop_triggered_range(low, high)
+			for alert in below + above:
+				del self._alerts[alert.id]
+			if not index:
+				del self._indexes[pair]
+		return [(alert, low) for alert in below] + [(alert, high) for alert in above]
+
+	def poll(self, pairs=None):
+		"""Fetch every watched pair (or only `pairs`) once and return [(alert, spot price)] for the triggered alerts"""
+		pairs = self.pairs if pairs is None else pairs
+		if self.fetch_prices is not None:
+			return self._poll_bulk(pairs)
+		results = []
+		for pair in pairs:
+			try:
+				price = self.get_price(pair)
+			except Exception as e:
+				logger.error(f'Error fetching the price of {pair}: {e}')
+				continue
+			results.extend((alert, price) for alert in self.on_price(pair, price))
+		return results
+
+	def _poll_bulk(self, pairs):
+		if not pairs:
+			return []
+		try:
+			prices = self.fetch_prices(pairs)
+		except Exception as e:
+			logger.error(f'Error fetching the prices of {len(pairs)} pairs: {e}')
+			return []
+		now = self.clock()
+		results = []
+		for pair in pairs:
+			price = prices.get(pair)
+			if price is None:
+				logger.error(f'No price for {pair}')
+				continue
+			price = float(price)
+			self._quotes[pair] = (price, now)
+			results.extend((alert, price) for alert in self.on_price(pair, price))
+		return results
@@ -0,0 +1,282 @@
+"""Price sources that feed a PriceHub.
+
+PollingPriceSource fetches every watched pair over REST at a fixed
+interval. StreamingPriceSource consumes ticker messages from a websocket
+feed speaking the Coinbase Exchange protocol, evaluating alerts on every
+tick. It reconnects with exponential backoff and, after a reconnect or a
+restart, fills the gap by evaluating the alerts against the lowest and
+highest price of the time it was offline. Pairs the feed does not list (e.g. cross
+pairs priced by a CrossRateCache) are polled instead. replay_server.py provides a local feed
+for testing without network access.
+
+Every source calls `on_triggered([(alert, price), ...])` from its own
+thread whenever alerts fire.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+COINBASE_FEED_URL = 'wss://ws-feed.exchange.coinbase.com'
+COINBASE_PRODUCTS_URL = 'https://api.exchange.coinbase.com/products'
+COINBASE_CANDLES_URL = 'https://api.exchange.coinbase.com/products/{pair}/candles'
+# Candle sizes Coinbase serves, at most 300 candles per request
+COINBASE_GRANULARITIES = (60, 300, 900, 3600, 21600, 86400)
+
+
+class PriceSource(ABC):
+	"""Base class: feeds prices into `hub` and reports triggered alerts"""
+
+	def __init__(self, hub, on_triggered):
+		self.hub = hub
+		self.on_triggered = on_triggered
+
+	def watch(self, pair):
+		"""Make sure prices of `pair` are received, e.g. after a new alert was added"""
+
+	@abstractmethod
+	def start(self):
+		"""Start receiving prices in the background"""
+
+	@abstractmethod
+	def stop(self):
+		"""Stop receiving prices and wait for the background work to end"""
+
+	def _report(self, triggered):
+		if not triggered:
+			return
+		try:
+			self.on_triggered(triggered)
+		except Exception as e:
+			logger.error(f'Error handling {len(triggered)} triggered alerts: {e}')
+
+
+class PollingPriceSource(PriceSource):
+	"""Fetches every watched pair over REST once every `interval` seconds"""
+
+	def __init__(self, hub, on_triggered, interval=15):
+		super().__init__(hub, on_triggered)
+		self.interval = interval
+		self._stopped = threading.Event()
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name='price-poller', daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		while not self._stopped.wait(self.interval):
+			try:
+				self._report(self.hub.poll())
+			except Exception as e:
+				logger.error(f'Error polling prices: {e}')
+
+	def stop(self):
+		self._stopped.set()
+		if self._thread is not None:
+			self._thread.join()
+
+
+def coinbase_products():
+	"""Ids of the products ('BTC-EUR', ...) the Coinbase Exchange feed can stream"""
+	import requests
+	response = requests.get(COINBASE_PRODUCTS_URL, timeout=10)
+	response.raise_for_status()
+	return {product['id'] for product in response.json()}
+
+
+def coinbase_price_range(pair, start, end):
+	"""Lowest and highest price of `pair` between two timestamps, from the finest candles covering it in one request"""
+	import requests
+	granularity = next((size for size in COINBASE_GRANULARITIES if (end - start) / size < 300), None)
+	if granularity is None:
+		start, granularity = end - 299 * 86400, 86400  # Longer than Coinbase serves, the last 299 days
+	params = {
+		'granularity': granularity,
+		'start': datetime.datetime.fromtimestamp(start - granularity, datetime.timezone.utc).isoformat(),
+		'end': datetime.datetime.fromtimestamp(end, datetime.timezone.utc).isoformat(),
+	}
+	response = requests.get(COINBASE_CANDLES_URL.format(pair=pair), params=params, timeout=10)
+	response.raise_for_status()
+	candles = response.json()  # [time, low, high, open, close, volume]
+	if not candles:
+		return None
+	return min(candle[1] for candle in candles), max(candle[2] for candle in candles)
+
+
+class StreamingPriceSource(PriceSource):
+	"""Evaluates alerts on every ticker message of a websocket price feed.
+
+	The feed runs on its own asyncio loop in a background thread. While
+	connected, new pairs are subscribed as soon as they are watched. After a
+	disconnection the source reconnects with exponential backoff and calls
+	`fetch_range(pair, start, end)`, which returns (low, high) or None, for
+	every pair so that crossings missed while offline still fire. The first
+	connection does the same from `resume_from`, the time of the last tick
+	before a restart (see last_tick_at), so the alerts loaded at startup
+	catch up on the downtime. A pair's range never starts before its oldest
+	alert was created, and without `resume_from` it starts there. Without
+	`fetch_range`, or if it fails, the current spot price from the hub is
+	used instead.
+
+	The feed rejects a whole subscription if one of its products is not
+	listed, so with `list_products()`, which returns the ids of the listed
+	products and is called on every connection, only listed pairs are
+	subscribed. The others are polled through the hub every `poll_interval`
+	seconds, like PollingPriceSource does.
+	"""
+
+	def __init__(self, hub, on_triggered, url=COINBASE_FEED_URL, fetch_range=None, list_products=None,
+	             poll_interval=15, resume_from=None, reconnect_base=1.0, reconnect_max=60.0):
+		super().__init__(hub, on_triggered)
+		self.url = url
+		self.fetch_range = fetch_range
+		self.list_products = list_products
+		self.poll_interval = poll_interval
+		self.resume_from = resume_from
+		self.reconnect_base = reconnect_base
+		self.reconnect_max = reconnect_max
+		self.ticks = 0
+		self.last_tick_at = None
+		self.reconnects = 0
+		self._subscribed = set()
+		self._products = None  # Ids of the listed products, None if every pair is assumed listed
+		self._loop = None
+		self._websocket = None
+		self._stopped = threading.Event()
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run_loop, name='price-stream', daemon=True)
+		self._thread.start()
+
+	def stop(self):
+		self._stopped.set()
+		if self._loop is not None and self._websocket is not None:
+			asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop)
+		if self._thread is not None:
+			self._thread.join(5)
+
+	def is_listed(self, pair):
+		products = self._products
+		return products is None or pair in products
+
+	def watch(self, pair):
+		if pair in self._subscribed or self._loop is None or self._websocket is None or not self.is_listed(pair):
+			return  # Subscribed with every other pair on the next (re)connection, or polled
+		asyncio.run_coroutine_threadsafe(self._subscribe(self._websocket, [pair]), self._loop)
+
+	def _run_loop(self):
+		self._loop = asyncio.new_event_loop()
+		poller = self._loop.create_task(self._poll_unlisted())
+		try:
+			self._loop.run_until_complete(self._run())
+		finally:
+			poller.cancel()
+			self._loop.run_until_complete(asyncio.gather(poller, return_exceptions=True))
+			self._loop.close()
+
+	async def _load_products(self):
+		if self.list_products is None:
+			return
+		try:
+			self._products = set(await asyncio.get_running_loop().run_in_executor(None, self.list_products))
+		except Exception as e:
+			logger.warning(f'Error listing the price feed products, keeping the previous list: {e}')
+
+	async def _poll_unlisted(self):
+		"""Poll the pairs the feed does not list, the stream never prices them"""
+		loop = asyncio.get_running_loop()
+		while True:
+			await asyncio.sleep(self.poll_interval)
+			pairs = [pair for pair in self.hub.pairs if not self.is_listed(pair)]
+			if pairs:
+				try:
+					self._report(await loop.run_in_executor(None, self.hub.poll, pairs))
+				except Exception as e:
+					logger.error(f'Error polling {len(pairs)} unlisted pairs: {e}')
+
+	async def _subscribe(self, websocket, pairs):
+		pairs = [pair for pair in pairs if pair not in self._subscribed and self.is_listed(pair)]
+		if not pairs:
+			return
+		self._subscribed.update(pairs)
+		await websocket.send(json.dumps({'type': 'subscribe', 'product_ids': pairs, 'channels': ['ticker']}))
+
+	async def _run(self):
+		import websockets
+
+		attempt = 0
+		connected_before = False
+		# A restart is a gap too, from the last tick before it (or from the creation of the alerts)
+		gap_start, in_gap = self.resume_from, True
+		while not self._stopped.is_set():
+			try:
+				await self._load_products()
+				async with websockets.connect(self.url) as websocket:
+					self._websocket = websocket
+					self._subscribed = set()
+					await self._subscribe(websocket, self.hub.pairs)
+					logger.info(f'Connected to price feed {self.url}')
+					if in_gap:
+						self.reconnects += connected_before
+						asyncio.get_running_loop().run_in_executor(None, self._fill_gap, gap_start, time.time())
+						in_gap = False
+					connected_before = True
+					attempt = 0
+					async for raw in websocket:
+						self._handle(raw)
+					logger.warning('Price feed closed the connection')
+			except Exception as e:
+				if self._stopped.is_set():
+					break
+				logger.warning(f'Price feed connection lost: {e}')
+			finally:
+				self._websocket = None
+			if self._stopped.is_set():
+				break
+			if not in_gap:
+				gap_start, in_gap = time.time(), True
+			delay = min(self.reconnect_max, self.reconnect_base * 2 ** attempt)
+			attempt += 1
+			logger.info(f'Reconnecting to the price feed in {delay:g}s')
+			await asyncio.sleep(delay)
+
+	def _handle(self, raw):
+		message = json.loads(raw)
+		if message.get('type') != 'ticker':
+			if message.get('type') == 'error':
+				logger.error(f"Price feed error: {message.get('message')} {message.get('reason', '')}")
+			return
+		self.ticks += 1
+		self.last_tick_at = time.time()
+		self._report([(alert, float(message['price']))
+		              for alert in self.hub.update_price(message['product_id'], message['price'])])
+
+	def _fill_gap(self, start, end):
+		"""Evaluate every streamed pair against the price range since `start` (or its oldest alert)"""
+		oldest = self.hub.oldest_alerts()
+		for pair in self.hub.pairs:
+			if not self.is_listed(pair) or pair not in oldest:
+				continue  # Polled meanwhile, or its alerts are gone
+			pair_start = oldest[pair] if start is None else max(start, oldest[pair])
+			price_range = None
+			if self.fetch_range is not None:
+				try:
+					price_range = self.fetch_range(pair, pair_start, end)
+				except Exception as e:
+					logger.warning(f'Error fetching the price range of {pair}, using the spot price: {e}')
+			try:
+				if price_range is None:
+					price = self.hub.fetch_price(pair)
+					price_range = (float(price), float(price))
+				self._report(self.hub.on_range(pair, *price_range))
+			except Exception as e:
+				logger.error(f'Error filling the price gap of {pair}: {e}')
+		since = f'{datetime.datetime.fromtimestamp(start):%Y-%m-%d %H:%M:%S}' if start else 'the creation of the alerts'
+		logger.info(f'Filled the price feed gap since {since}')
@@ -0,0 +1,129 @@
+"""Local stand-in for the Coinbase Exchange websocket feed.
+
+Plays recorded ticks (one JSON object per line with product_id, price and
+time) to every client, only for the products the client subscribed to,
+keeping the original spacing divided by --speed. Point the bot's
+PRICE_STREAM_URL at ws://localhost:8765 to test the streaming mode
+offline. --drop-every closes client connections periodically to exercise
+reconnection and gap-fill.
+
+	python replay_server.py serve ticks.jsonl [--port 8765] [--speed 10] [--loop] [--drop-every 30]
+	python replay_server.py record ticks.jsonl BTC-EUR ETH-EUR [--seconds 600]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+import websockets
+
+from price_sources import COINBASE_FEED_URL
+
+logger = logging.getLogger(__name__)
+
+
+def load_ticks(path):
+	with open(path, 'r') as file:
+		return [json.loads(line) for line in file if line.strip()]
+
+
+async def replay(websocket, ticks, speed, loop, drop_every):
+	products = set()
+	sequence = 0
+	connected_at = time.monotonic()
+
+	async def receive():
+		async for raw in websocket:
+			message = json.loads(raw)
+			if message.get('type') == 'subscribe':
+				products.update(message.get('product_ids', []))
+				await websocket.send(json.dumps({'type': 'subscriptions', 'channels': [
+					{'name': 'ticker', 'product_ids': sorted(products)}]}))
+
+	receiver = asyncio.create_task(receive())
+	try:
+		while not products:
+			await asyncio.sleep(0.01)  # Wait for the first subscription
+		while True:
+			previous_time = None
+			for tick in ticks:
+				if previous_time is not None and speed > 0:
+					await asyncio.sleep(max(0.0, (tick['time'] - previous_time) / speed))
+				previous_time = tick['time']
+				if drop_every and time.monotonic() - connected_at >= drop_every:
+					logger.info('Dropping the connection')
+					return
+				if tick['product_id'] not in products:
+					continue
+				sequence += 1
+				await websocket.send(json.dumps({
+					'type': 'ticker',
+					'sequence': sequence,
+					'product_id': tick['product_id'],
+					'price': str(tick['price']),
+					'time': tick['time'],
+				}))
+			if not loop:
+				return
+			await asyncio.sleep(0)
+	finally:
+		receiver.cancel()
+
+
+async def serve(args):
+	ticks = load_ticks(args.ticks)
+	logger.info(f'Replaying {len(ticks)} ticks on ws://{args.host}:{args.port}')
+
+	async def handler(websocket, path=None):
+		try:
+			await replay(websocket, ticks, args.speed, args.loop, args.drop_every)
+		except websockets.ConnectionClosed:
+			pass
+
+	async with websockets.serve(handler, args.host, args.port):
+		await asyncio.Future()
+
+
+async def record(args):
+	"""Save the ticker messages of the real feed as replayable ticks"""
+	deadline = time.monotonic() + args.seconds
+	count = 0
+	async with websockets.connect(COINBASE_FEED_URL) as websocket:
+		await websocket.send(json.dumps({'type': 'subscribe', 'product_ids': args.products, 'channels': ['ticker']}))
+		with open(args.ticks, 'w') as file:
+			while time.monotonic() < deadline:
+				try:
+					raw = await asyncio.wait_for(websocket.recv(), deadline - time.monotonic())
+				except asyncio.TimeoutError:
+					break
+				message = json.loads(raw)
+				if message.get('type') != 'ticker':
+					continue
+				file.write(json.dumps({'product_id': message['product_id'], 'price': float(message['price']),
+				                       'time': time.time()}) + '\n')
+				count += 1
+	logger.info(f'Recorded {count} ticks to {args.ticks}')
+
+
+def main():
+	logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+	parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+	commands = parser.add_subparsers(dest='command', required=True)
+	serve_parser = commands.add_parser('serve', help='replay recorded ticks')
+	serve_parser.add_argument('ticks')
+	serve_parser.add_argument('--host', default='localhost')
+	serve_parser.add_argument('--port', type=int, default=8765)
+	serve_parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, 0 = as fast as possible')
+	serve_parser.add_argument('--loop', action='store_true', help='start over when the ticks run out')
+	serve_parser.add_argument('--drop-every', type=float, default=0, help='close connections after this many seconds')
+	record_parser = commands.add_parser('record', help='record ticks from the Coinbase feed')
+	record_parser.add_argument('ticks')
+	record_parser.add_argument('products', nargs='+')
+	record_parser.add_argument('--seconds', type=float, default=600)
+	args = parser.parse_args()
+	asyncio.run(serve(args) if args.command == 'serve' else record(args))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JobBusy(Exception):
+    """Raised by SingleFlightJob.start() when a run of another kind is in progress"""
+
+    def __init__(self, name, kind):
+        super().__init__(f'{name} is already running ({kind})')
+        self.kind = kind
+
+
+class SingleFlightJob:
+    """Runs at most one coroutine at a time, in a background thread with its own event loop.
+
+    start() returns at once, so a handler never waits for the job. While a
+    run is in progress further start() calls join it instead of starting a
+    second one: their watchers (any value, e.g. the (chat_id, message_id)
+    showing the progress) are added to the running job's. A run is started
+    with a `kind` (e.g. full or incremental) and is only joined by calls of
+    the same kind, a call of another kind raises JobBusy. cancel() cancels
+    the running coroutine from any thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._watchers = []
+        self._thread = None
+        self._loop = None
+        self._task = None
+        self._kind = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def watchers(self):
+        with self._lock:
+            return list(self._watchers)
+
+    def start(self, coroutine_function, watcher=None, kind=None):
+        """Run coroutine_function(job) in the background; returns False if a run was joined instead.
+
+        Raises JobBusy if a run of another kind is in progress.
+        """
+        with self._lock:
+            if self._thread is not None and self._kind != kind:
+                raise JobBusy(self.name, self._kind)
+            if watcher is not None:
+                if self._thread is None:
+                    self._watchers = []
+                self._watchers.append(watcher)
+            if self._thread is not None:
+                return False
+            loop = asyncio.new_event_loop()
+            self._loop = loop
+            self._kind = kind
+            self._task = loop.create_task(coroutine_function(self))
+            self._thread = threading.Thread(target=self._run, args=(loop, self._task), name=self.name, daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, loop, task):
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            logger.info(f'{self.name} cancelled')
+        except Exception:
+            logger.exception(f'{self.name} failed')
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+            with self._lock:
+                self._thread = None
+                self._loop = None
+                self._task = None
+                self._kind = None
+
+    def cancel(self):
+        """Cancel the running coroutine; returns False if nothing was running"""
+        with self._lock:
+            if self._task is None:
+                return False
+            self._loop.call_soon_threadsafe(self._task.cancel)
+            return True
+
+    def join(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
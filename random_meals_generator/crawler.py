@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Answers worth retrying, the page may well come back on the next attempt
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class CrawlResponse:
+    __slots__ = ('url', 'status', 'headers', 'body')
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class AsyncCrawler:
+    """asyncio HTTP client for crawling many pages of a few sites politely.
+
+    At most `concurrency` requests are in flight over one connection pool,
+    and each host gets its own TokenBucket of `per_host_rate` requests per
+    second, so pages are fetched in parallel without hammering a site.
+    Connection errors, timeouts and 429/5xx answers are retried up to
+    `retries` times with exponential backoff, honouring Retry-After. Use as
+    an async context manager; the counters give the pages per second.
+    """
+
+    def __init__(self, concurrency=8, per_host_rate=4.0, per_host_burst=None, retries=3, backoff=1.0, timeout=30,
+                 clock=time.monotonic):
+        self.concurrency = concurrency
+        self.per_host_rate = per_host_rate
+        self.per_host_burst = per_host_burst
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.clock = clock
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = None
+        self._buckets = {}
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.started = self.clock()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started if self.started is not None else 0.0
+
+    @property
+    def pages_per_second(self):
+        elapsed = self.elapsed
+        return self.requests / elapsed if elapsed > 0 else 0.0
+
+    async def _throttle(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.per_host_rate, self.per_host_burst, clock=self.clock)
+        wait = bucket.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = bucket.try_acquire()
+
+    def _retry_delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    async def fetch(self, url, headers=None):
+        """CrawlResponse of a GET; raises the last error once the retries are used up"""
+        host = urlsplit(url).netloc
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                await self._throttle(host)
+                self.requests += 1
+                try:
+                    async with self._session.get(url, headers=headers) as response:
+                        body = await response.read()
+                        self.bytes += len(body)
+                        if response.status in RETRY_STATUSES and attempt < self.retries:
+                            delay = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                            logger.warning(f'{url} answered {response.status}, retrying in {delay:.1f}s')
+                        else:
+                            return CrawlResponse(url, response.status, response.headers, body)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if attempt == self.retries:
+                        self.failed += 1
+                        raise
+                    delay = self._retry_delay(attempt)
+                    logger.warning(f'Error fetching {url}: {e!r}, retrying in {delay:.1f}s')
+                self.retried += 1
+                await asyncio.sleep(delay)
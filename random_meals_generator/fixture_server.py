@@ -0,0 +1,179 @@
+"""Local stand-in for the GialloZafferano category listings.
+
+Serves listing pages at the same paths as the site, /ricette-cat/{category}
+and /ricette-cat/page{n}/{category}, with ETag and Last-Modified headers
+and 304 answers to conditional requests, so a refresh can be tested and
+measured offline. Start the bot with GZ_SITE_URL=http://localhost:8000.
+
+Pages come either from saved HTML (DIR/{category}/page{n}.html, written by
+the save command; page counters and links are cut to the pages saved, so a
+full refresh works too) or are generated from a recipes.json file, newest
+recipes first like the site:
+
+    python fixture_server.py serve --pages saved_pages [--port 8000]
+    python fixture_server.py serve --recipes recipes.json [--per-page 15] [--error-rate 0.05]
+    python fixture_server.py save saved_pages Bevande Primi [--max-pages 5]
+"""
+import argparse
+import email.utils
+import hashlib
+import html
+import json
+import logging
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from recipe_scraper import SITE_URL, category_page_url
+
+logger = logging.getLogger(__name__)
+
+PATH_PATTERN = re.compile(r"^/ricette-cat/(?:page(\d+)/)?([^/?]+)/?$")
+TOTAL_PAGES_PATTERN = re.compile(r'(<span[^>]*class="[^"]*total-pages[^"]*"[^>]*>)\s*\d+\s*(</span>)')
+PAGE_LINK_PATTERN = re.compile(r'<a[^>]*class="[^"]*\bpage\b[^"]*"[^>]*>\s*(\d+)\s*</a>')
+
+
+def render_page(category, recipes, page_number, total_pages):
+    """A listing page with the markup the scraper reads"""
+    articles = "\n".join(
+        f'<article class="gz-card"><h2 class="gz-title"><a href="{html.escape(recipe["recipe_url"])}" '
+        f'title="{html.escape(recipe["name"])}">{html.escape(recipe["name"])}</a></h2></article>'
+        for recipe in recipes)
+    page_links = " ".join(f'<a class="page" href="/ricette-cat/page{number}/{category}">{number}</a>'
+                          for number in range(1, total_pages + 1) if number != page_number)
+    return (f'<html><head><title>{category}</title></head><body>\n<div class="gz-content-recipes">\n{articles}\n</div>\n'
+            f'<div class="gz-pages">{page_links} <span class="disabled total-pages">{total_pages}</span></div>\n'
+            f'</body></html>\n')
+
+
+def pages_from_recipes(path, per_page):
+    """{(category, page number): html} for every category of a recipes.json file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        all_recipes = json.load(f)
+    pages = {}
+    for category, recipes in all_recipes.items():
+        total_pages = max(1, -(-len(recipes) // per_page))
+        for page_number in range(1, total_pages + 1):
+            chunk = recipes[(page_number - 1) * per_page:page_number * per_page]
+            pages[(category, page_number)] = render_page(category, chunk, page_number, total_pages)
+    return pages
+
+
+def limit_page_count(text, total_pages):
+    """A saved page whose page counter and page links stop at the `total_pages` pages that were saved"""
+    text = TOTAL_PAGES_PATTERN.sub(lambda match: f"{match.group(1)}{total_pages}{match.group(2)}", text)
+    return PAGE_LINK_PATTERN.sub(lambda match: match.group(0) if int(match.group(1)) <= total_pages else "", text)
+
+
+def pages_from_directory(directory):
+    """{(category, page number): html} of saved pages, as if the site listed only those"""
+    pages = {}
+    for category in os.listdir(directory):
+        for name in os.listdir(os.path.join(directory, category)):
+            match = re.match(r"page(\d+)\.html$", name)
+            if match:
+                with open(os.path.join(directory, category, name), 'r', encoding='utf-8') as f:
+                    pages[(category, int(match.group(1)))] = f.read()
+    # Pages are saved from the start of a listing, the site's counter still shows its full length
+    saved = {}
+    for category, page_number in pages:
+        saved[category] = max(saved.get(category, 0), page_number)
+    return {(category, page_number): limit_page_count(text, saved[category])
+            for (category, page_number), text in pages.items()}
+
+
+def make_handler(pages, last_modified, error_rate=0.0):
+    bodies = {key: text.encode('utf-8') for key, text in pages.items()}
+    etags = {key: '"' + hashlib.sha256(body).hexdigest()[:32] + '"' for key, body in bodies.items()}
+    modified = email.utils.formatdate(last_modified, usegmt=True)
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = PATH_PATTERN.match(self.path)
+            key = (match.group(2), int(match.group(1) or 1)) if match else None
+            if key not in bodies:
+                self.send_error(404)
+                return
+            if random.random() < error_rate:
+                self.send_error(503)
+                return
+            if self.headers.get("If-None-Match") == etags[key] or (
+                    self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == modified):
+                self.send_response(304)
+                self.send_header("ETag", etags[key])
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(bodies[key])))
+            self.send_header("ETag", etags[key])
+            self.send_header("Last-Modified", modified)
+            self.end_headers()
+            self.wfile.write(bodies[key])
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return FixtureHandler
+
+
+def serve(args):
+    if args.recipes:
+        pages = pages_from_recipes(args.recipes, args.per_page)
+        last_modified = os.path.getmtime(args.recipes)
+    else:
+        pages = pages_from_directory(args.pages)
+        last_modified = time.time()
+    logger.info(f'Serving {len(pages)} listing pages on http://{args.host}:{args.port}')
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(pages, last_modified, args.error_rate))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def save(args):
+    """Download listing pages of the real site as fixtures"""
+    session = requests.Session()
+    for category in args.categories:
+        os.makedirs(os.path.join(args.directory, category), exist_ok=True)
+        for page_number in range(1, args.max_pages + 1):
+            response = session.get(category_page_url(SITE_URL, category, page_number), timeout=30)
+            if response.status_code == 404:
+                break
+            response.raise_for_status()
+            with open(os.path.join(args.directory, category, f'page{page_number}.html'), 'w', encoding='utf-8') as f:
+                f.write(response.text)
+            logger.info(f'Saved {category} page {page_number}')
+            time.sleep(args.delay)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='serve listing pages')
+    source = serve_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--pages', help='directory of saved pages')
+    source.add_argument('--recipes', help='recipes.json to generate the pages from')
+    serve_parser.add_argument('--per-page', type=int, default=15)
+    serve_parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered 503')
+    serve_parser.add_argument('--host', default='localhost')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    save_parser = commands.add_parser('save', help='save listing pages of the real site')
+    save_parser.add_argument('directory')
+    save_parser.add_argument('categories', nargs='+')
+    save_parser.add_argument('--max-pages', type=int, default=3)
+    save_parser.add_argument('--delay', type=float, default=1.0)
+    args = parser.parse_args()
+    serve(args) if args.command == 'serve' else save(args)
+
+
+if __name__ == '__main__':
+    main()
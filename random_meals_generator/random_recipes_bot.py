@@ -1,30 +1,43 @@
+import asyncio
 import os
-import random
+import sys
 import json
-import requests
-import time
 import datetime
+import html
 import logging
 from tqdm import tqdm
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode, ChatAction
+from telegram import Update, ParseMode, ChatAction
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.keyboards import grid, inline_keyboard
+from common.send_queue import BULK, INTERACTIVE, SendQueue, log_send_failure
+from recipe_catalog import RecipeCatalog
+from recipe_cursors import RecipeCursors
+from recipe_search import SearchIndexBuilder, index_path
+from crawler import AsyncCrawler
+from background_job import JobBusy, SingleFlightJob
+import recipe_scraper
+from recipe_scraper import FetchStats, PageState
+
 # Configure the logging module
 logging.basicConfig(filename="log_file.log", level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-BASE_URL = "https://www.giallozafferano.it/ricette-cat/page{}/{}"
+SITE_URL = os.getenv("GZ_SITE_URL", recipe_scraper.SITE_URL) # Point at fixture_server.py to test a refresh offline
 
 RECIPES_PATH = "recipes.json"
+CURSORS_PATH = "recipe_cursors.db"
+PAGE_STATE_PATH = "recipe_pages.json" # ETag, Last-Modified and hash of every listing page, for incremental refreshes
 
-ALLOW_DUPLICATES = False # Set this variable to True to allow duplicated recipes
-SLEEP_TIME_MIN = 0.25
-SLEEP_TIME_MAX = 1.5
+ALLOW_DUPLICATES = False # Set this variable to True to allow duplicated recipes, otherwise each user sees every recipe of a category once before any repeats
+CRAWL_CONCURRENCY = 8 # Listing pages downloaded at the same time
+CRAWL_RATE = 4 # Requests per second to giallozafferano.it; every page is on that host, so this politeness limit, not the concurrency, sets the length of a full refresh (about 3 minutes for 700 pages)
+REFRESH_PROGRESS_INTERVAL = 3 # Seconds between two edits of the refresh progress message
+SEARCH_RESULTS = 10 # Number of recipes listed by /search
 
 
 CATEGORIES = [
@@ -51,151 +64,227 @@ CATEGORY_MAPPING = {
     "Vegetariani": "Piatti Vegetariani"
 }
 
-pages_scraped = {}
-
-def scrape_category(category):
-    recipes = []
-    session = requests.Session()
-    page_number = 1
-    total_pages = 1
-
-    logging.info(f'{datetime.datetime.now()} | Scraping category {category}')
-    
-    while page_number <= total_pages:
-        time.sleep(random.uniform(SLEEP_TIME_MIN, SLEEP_TIME_MAX))
-
-        if page_number == 1:
-            url = f"https://www.giallozafferano.it/ricette-cat/{category}"
-        else:
-            url = BASE_URL.format(page_number, category)
+# Two categories per row, built once for every /start
+CATEGORY_KEYBOARD = inline_keyboard(grid((CATEGORY_MAPPING[category], category) for category in CATEGORIES))
 
-        response = session.get(url)
-        if not response.ok:
-            if not response.ok:
-                logging.error(f'{datetime.datetime.now()} | Failed to fetch category {category}: {response.status_code}')
-                return
+START_MESSAGE = ("<b>Welcome to the Random Recipes Bot!</b> 🍽\n\n"
+                 "Discover and receive random recipes from various categories on <a href='https://www.giallozafferano.it/'>GialloZafferano</a> 🇮🇹.\n\n"
+                 #"<i>Choose a category from below or type /refresh to update the recipes list</i> 🔄.\n\n"
+                 "<b>Enjoy exploring and cooking delicious dishes!</b> 😋👨‍🍳")
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        if total_pages == 1:
-            if category == "Bevande" or category == "Salse-e-Sughi":
-                last_page = soup.find_all('a', {'class': 'page'})[-1].text
-                total_pages = int(last_page)
-            else:
-                span = soup.find('span', {'class': 'disabled total-pages'})
-                total_pages = int(span.text.strip())
+# Every recipe, parsed once at startup and swapped for the new ones when /refresh finishes
+recipe_catalog = RecipeCatalog(RECIPES_PATH)
 
-        for recipe in soup.find_all("article"):
-            link_tag = recipe.find("h2").find("a")
-            link = link_tag["href"]
-            title = link_tag.text.strip()
-            recipes.append({"name": title, "recipe_url": link})
+# Shuffled order and position of every user in every category, kept across restarts
+recipe_cursors = RecipeCursors(CURSORS_PATH)
 
-        page_number += 1
+# Rate-limited outbound queue, recipe replies go ahead of refresh progress updates
+send_queue = SendQueue()
 
-    return category, recipes
+# At most one refresh at a time, crawling in its own thread while the handlers keep serving the current catalog
+refresh_job = SingleFlightJob("recipe-refresh")
+REFRESH_KINDS = {"incremental": "An incremental refresh", "full": "A full refresh"}
 
-def scrape_recipes(context: CallbackContext, chat_id, message_id):
-    all_recipes = {}
+async def crawl_categories(previous_recipes, page_state, stats, incremental, on_category):
+    """Scrape every category concurrently, calling on_category(category, recipes) as each one finishes.
 
-    with ThreadPoolExecutor() as executor:
-        futures = {executor.submit(scrape_category, category): category for category in CATEGORIES}
-        for future in as_completed(futures):
-            category = futures[future]
+    Returns the categories that failed; the state of their pages is dropped
+    so the next incremental refresh fetches them again.
+    """
+    failed = []
+    async with AsyncCrawler(CRAWL_CONCURRENCY, CRAWL_RATE) as crawler:
+        async def crawl(category):
+            logging.info(f'{datetime.datetime.now()} | Scraping category {category}')
+            known_urls = {recipe["recipe_url"] for recipe in previous_recipes.get(category, [])} if incremental else None
             try:
-                category, recipes = future.result()
-                all_recipes[category] = recipes
-
-                # Update the message with loading bar
-                progress = "[" + "#" * len(all_recipes) + "-" * (len(CATEGORIES) - len(all_recipes)) + "]"
-                loading_str = f"Progress: {progress}"
-
-                message = f"Refreshing the recipes in the <b>{category}</b> category...\n\n{loading_str}"
-                context.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=message, parse_mode=ParseMode.HTML)
-
-                # Append the number of recipes to the pages_scraped dictionary
-                pages_scraped[category] = len(recipes)
-
+                category, recipes = await recipe_scraper.scrape_category(crawler, category, SITE_URL, page_state, stats, known_urls)
             except Exception as e:
-                print(f'{category} generated an exception: {e}')
+                logging.error(f'{datetime.datetime.now()} | Failed to fetch category {category}: {e!r}')
+                page_state.forget_category(SITE_URL, category)
+                failed.append(category)
+                return
+            on_category(category, recipes)
+
+        await asyncio.gather(*(crawl(category) for category in CATEGORIES))
+        logging.info(f'{datetime.datetime.now()} | Crawled {crawler.requests} pages in {crawler.elapsed:.1f}s '
+                     f'({crawler.pages_per_second:.1f} pages/s, {crawler.retried} retried, {crawler.failed} failed)')
+    return failed
+
+def notify_refresh_watchers(bot, job, text):
+    """Edit the progress message of every chat that asked for the running refresh"""
+    # Always in the BULK lane: edits of a message must stay in order, the summary must not be overwritten by older progress
+    futures = [send_queue.submit(bot.edit_message_text, chat_id=chat_id, message_id=message_id, text=text, parse_mode=ParseMode.HTML, priority=BULK)
+               for chat_id, message_id in job.watchers]
+    for future in futures:
+        future.add_done_callback(log_send_failure("updating the refresh progress"))
+    return futures
+
+async def report_refresh_progress(bot, job, render):
+    """Publish render() to the watchers every REFRESH_PROGRESS_INTERVAL seconds, when it has changed.
+
+    A round is skipped while the previous edits are still queued, so progress
+    never piles up behind Telegram's per-chat limit.
+    """
+    last_text = None
+    pending = []
+    while True:
+        await asyncio.sleep(REFRESH_PROGRESS_INTERVAL)
+        if not all(future.done() for future in pending):
+            continue
+        text = render()
+        if text != last_text:
+            pending = notify_refresh_watchers(bot, job, text)
+            last_text = text
+
+async def scrape_recipes(bot, job, incremental=False):
+    """Scrape every category in the background and swap the new recipes into the catalog.
+
+    An incremental refresh only fetches the pages that changed since the
+    last one, up to the first recipe already known, and merges the new
+    recipes in front of the known ones. A category that fails keeps its
+    previous recipes. Nothing is saved or swapped if the job is cancelled;
+    otherwise the catalog and its search index are replaced in one step, so
+    the button and /search handlers keep serving the old recipes meanwhile.
+    """
+    previous_recipes = recipe_catalog.as_dict()
+    page_state = PageState(PAGE_STATE_PATH)
+    stats = FetchStats()
+    all_recipes = {}
+    new_recipes = {}
+    # The search index grows one category at a time, while the others are still being scraped
+    index_builder = SearchIndexBuilder()
+
+    def on_category(category, recipes):
+        new_recipes[category] = len(recipes) if incremental else len(recipes) - len(previous_recipes.get(category, []))
+        if incremental:
+            recipes = recipes + previous_recipes.get(category, [])
+        all_recipes[category] = recipes
+        index_builder.add_category(category, (recipe["name"] for recipe in recipes))
+
+    def render_progress():
+        progress = "[" + "#" * len(all_recipes) + "-" * (len(CATEGORIES) - len(all_recipes)) + "]"
+        return (f"Refreshing the recipes{' (new recipes only)' if incremental else ''}...\n\n"
+                f"Progress: {progress}\n{stats.pages} pages, {stats.pages_per_second:.1f} pages/s\n\n"
+                f"<i>/cancel_refresh to stop</i>")
+
+    reporter = asyncio.create_task(report_refresh_progress(bot, job, render_progress))
+    try:
+        failed = await crawl_categories(previous_recipes, page_state, stats, incremental, on_category)
+    except asyncio.CancelledError:
+        notify_refresh_watchers(bot, job, "⏹ Refresh cancelled, the recipes have not been changed.")
+        raise
+    finally:
+        reporter.cancel()
+
+    for category, recipes in previous_recipes.items():
+        if category not in all_recipes:
+            all_recipes[category] = recipes
+            index_builder.add_category(category, (recipe["name"] for recipe in recipes))
+    logging.info(f'{datetime.datetime.now()} | {"Incremental" if incremental else "Full"} refresh fetched {stats}')
+
+    if not incremental or any(new_recipes.values()):
+        temporary_path = RECIPES_PATH + ".tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(all_recipes, f, indent=4, ensure_ascii=False)
+        os.replace(temporary_path, RECIPES_PATH)
+        search_index = index_builder.build()
+        search_index.save(index_path(RECIPES_PATH))
+        recipe_catalog.replace(all_recipes, search_index)
+    # Saved only once the recipes are, an unchanged page must mean its recipes are known
+    page_state.save()
 
-    with open(RECIPES_PATH, 'w', encoding='utf-8') as f:
-        json.dump(all_recipes, f, indent=4, ensure_ascii=False)
+    # Append the number of recipes scraped for each category to the message
+    message_text = f"🔄 Recipes have been refreshed ({'new recipes only' if incremental else 'full'}, {stats}).\n\nNumber of recipes for each category:\n"
+    for category, recipes in all_recipes.items():
+        message_text += f"{category}: {len(recipes)} ({new_recipes.get(category, 0):+d})\n"
+    if failed:
+        message_text += f"\n⚠️ Could not refresh: {', '.join(failed)}\n"
+    notify_refresh_watchers(bot, job, message_text)
 
 def pin_start_message(context: CallbackContext, chat_id, message_id):
     context.bot.pin_chat_message(chat_id=chat_id, message_id=message_id, disable_notification=True)
 
 def start(update: Update, context: CallbackContext):
-    with open(RECIPES_PATH, 'r') as f:
-        all_recipes = json.load(f)
-
-    keyboard = []
-    for i in range(0, len(CATEGORIES), 2):  # increment by 2 each loop
-        row = []
-        for j in range(i, i+2):  # get two categories
-            if j < len(CATEGORIES):  # ensure we don't go out of range
-                row.append(InlineKeyboardButton(CATEGORY_MAPPING[CATEGORIES[j]], callback_data=CATEGORIES[j]))
-        keyboard.append(row)
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    starting_message = ("<b>Welcome to the Random Recipes Bot!</b> 🍽\n\n"
-                        "Discover and receive random recipes from various categories on <a href='https://www.giallozafferano.it/'>GialloZafferano</a> 🇮🇹.\n\n"
-                        #"<i>Choose a category from below or type /refresh to update the recipes list</i> 🔄.\n\n"
-                        "<b>Enjoy exploring and cooking delicious dishes!</b> 😋👨‍🍳")
-
-    
-    message = context.bot.send_message(chat_id=update.effective_chat.id, text=starting_message, reply_markup=reply_markup, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    message = context.bot.send_message(chat_id=update.effective_chat.id, text=START_MESSAGE, reply_markup=CATEGORY_KEYBOARD, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
     pin_start_message(context, update.effective_chat.id, message.message_id)
 
 
 def refresh_recipes(update: Update, context: CallbackContext):
     context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+    # /refresh only looks for new recipes, /refresh full scrapes every page again
+    incremental = bool(recipe_catalog.categories) and not (context.args and context.args[0].lower() == "full")
     message = context.bot.send_message(chat_id=update.effective_chat.id, text="Starting to refresh the recipes...")
-    scrape_recipes(context, update.message.chat_id, message.message_id)
-    context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
-
-    # Append the number of recipes scraped for each category to the message
-    message_text = "🔄 Recipes have been refreshed.\n\nNumber of recipes scraped for each category:\n"
-    for category, count in pages_scraped.items():
-        message_text += f"{category}: {count}\n"
-    context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text=message_text)
+    # The crawl runs in the background, a /refresh of the same kind sent meanwhile follows the running one
+    kind = "incremental" if incremental else "full"
+    try:
+        started = refresh_job.start(lambda job: scrape_recipes(context.bot, job, incremental), (update.effective_chat.id, message.message_id), kind)
+    except JobBusy as busy:
+        context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id,
+                                      text=f"{REFRESH_KINDS[busy.kind]} is already running, send /refresh{'' if incremental else ' full'} again when it is done or stop it with /cancel_refresh.")
+        return
+    if not started:
+        context.bot.edit_message_text(chat_id=update.effective_chat.id, message_id=message.message_id, text=f"{REFRESH_KINDS[kind]} is already running, its progress will be shown here...")
+
+def cancel_refresh(update: Update, context: CallbackContext):
+    if refresh_job.cancel():
+        text = "Stopping the refresh..."
+    else:
+        text = "No refresh is running."
+    send_queue.submit(context.bot.send_message, chat_id=update.effective_chat.id, text=text, priority=INTERACTIVE).add_done_callback(log_send_failure("answering /cancel_refresh"))
 
 
-def get_random_recipe(recipes, sent_recipes):
-    """
-    Returns a random recipe that has not been sent yet.
-    """
-    while True:
-        recipe = random.choice(recipes)
-        if recipe["name"] not in sent_recipes or ALLOW_DUPLICATES:
-            return recipe
-
 def button_callback(update: Update, context: CallbackContext):
     query = update.callback_query
     query.answer()
     category = query.data
-    with open(RECIPES_PATH, 'r', encoding='utf-8') as f:
-        all_recipes = json.load(f)
-    recipes = all_recipes[category]
-    sent_recipes = set()
-
-    if len(sent_recipes) < len(recipes):
-        recipe = get_random_recipe(recipes, sent_recipes)
-        sent_recipes.add(recipe["name"])
+    recipes = recipe_catalog.get(category)
+
+    if recipes is not None:
+        if ALLOW_DUPLICATES:
+            recipe = recipe_catalog.random_recipe(category)
+        else:
+            recipe = recipes[recipe_cursors.next_index(query.from_user.id, category, len(recipes))]
         message_text = f"📌 <b>{recipe['name']}:</b>\n\n {recipe['recipe_url']}"
     else:
-        message_text = f"No more recipes in this category. Restart the bot. 🤖"
+        message_text = "No recipes in this category yet, use /refresh to download them. 🤖"
     
-    query.message.reply_text(message_text, parse_mode=ParseMode.HTML, disable_web_page_preview=False)
+    send_queue.submit(context.bot.send_message, chat_id=query.message.chat_id, text=message_text, parse_mode=ParseMode.HTML, disable_web_page_preview=False, priority=INTERACTIVE).add_done_callback(log_send_failure("sending a recipe"))
+
+def search_recipes(update: Update, context: CallbackContext):
+    query = " ".join(context.args)
+    results = recipe_catalog.search(query, limit=SEARCH_RESULTS) if query else []
+
+    if not query:
+        message_text = "🔍 Type what you are looking for after the command, e.g. <i>/search pasta zucchine</i>"
+    elif not results:
+        message_text = f"No recipes found for <b>{html.escape(query)}</b>. 🤷"
+    else:
+        lines = [f"🔍 <b>{html.escape(query)}</b>\n"]
+        for category, recipe in results:
+            lines.append(f"📌 <a href='{recipe['recipe_url']}'>{html.escape(recipe['name'])}</a> <i>({CATEGORY_MAPPING.get(category, category)})</i>")
+        message_text = "\n".join(lines)
+
+    send_queue.submit(context.bot.send_message, chat_id=update.effective_chat.id, text=message_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True, priority=INTERACTIVE).add_done_callback(log_send_failure("sending search results"))
+
+def flush_recipe_cursors(context: CallbackContext):
+    recipe_cursors.flush()
 
 def main():
+    recipe_catalog.load()
     updater = Updater(TELEGRAM_BOT_TOKEN, use_context=True)
     dp = updater.dispatcher
     dp.add_handler(CommandHandler("start", start))
     dp.add_handler(CommandHandler("refresh", refresh_recipes))
+    dp.add_handler(CommandHandler("cancel_refresh", cancel_refresh))
+    dp.add_handler(CommandHandler("search", search_recipes))
     dp.add_handler(CallbackQueryHandler(button_callback))
+    updater.job_queue.run_repeating(flush_recipe_cursors, interval=5, first=5)
     updater.start_polling()
     updater.idle()
+    refresh_job.cancel()
+    refresh_job.join(timeout=10)
+    send_queue.stop()
+    recipe_cursors.close()
 
 if __name__ == "__main__":
     main()
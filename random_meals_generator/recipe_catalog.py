@@ -0,0 +1,108 @@
+import json
+import logging
+import random
+
+from recipe_search import SearchIndex, fingerprint, index_path
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryRecipes:
+    """The recipes of one category as two parallel tuples, names and URLs"""
+    __slots__ = ('names', 'urls')
+
+    def __init__(self, recipes):
+        self.names = tuple(recipe["name"] for recipe in recipes)
+        self.urls = tuple(recipe["recipe_url"] for recipe in recipes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, position):
+        return {"name": self.names[position], "recipe_url": self.urls[position]}
+
+
+class RecipeCatalog:
+    """Every recipe of recipes.json, parsed once and kept in memory.
+
+    Each category is held as compact tuples, so a random pick is a single
+    randrange. The whole catalog is an immutable snapshot (a dict of
+    CategoryRecipes and the SearchIndex over them) that replace() swaps with
+    one assignment, so a refresh never shows a half-updated catalog to the
+    handlers reading it. The search index is saved next to the recipes file
+    and only rebuilt when it does not match the recipes.
+    """
+
+    def __init__(self, path, rng=None):
+        self.path = path
+        self.index_path = index_path(path)
+        self.rng = rng or random.Random()
+        self._snapshot = ({}, SearchIndex.from_recipes({}))
+
+    @property
+    def _categories(self):
+        return self._snapshot[0]
+
+    def load(self):
+        """Read the recipes file; returns False and keeps the catalog empty if it does not exist"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                all_recipes = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f'{self.path} not found, use /refresh to scrape the recipes')
+            return False
+        index = SearchIndex.load(self.index_path, fingerprint(
+            (category, (recipe["name"] for recipe in recipes)) for category, recipes in all_recipes.items()))
+        if index is None:
+            index = SearchIndex.from_recipes(all_recipes)
+            index.save(self.index_path)
+        self.replace(all_recipes, index)
+        return True
+
+    def replace(self, all_recipes, index=None):
+        """Swap in a new snapshot built from {category: [{"name", "recipe_url"}]} and its search index"""
+        categories = {category: CategoryRecipes(recipes) for category, recipes in all_recipes.items()}
+        if index is None:
+            index = SearchIndex.from_recipes(all_recipes)
+        self._snapshot = (categories, index)
+        logger.info(f'Recipe catalog loaded: {sum(len(recipes) for recipes in categories.values())} recipes '
+                    f'in {len(categories)} categories')
+
+    @property
+    def categories(self):
+        return list(self._categories)
+
+    def as_dict(self):
+        """{category: [{"name", "recipe_url"}]}, the same shape as recipes.json"""
+        return {category: [recipes[position] for position in range(len(recipes))]
+                for category, recipes in self._categories.items()}
+
+    def counts(self):
+        """{category: number of recipes}"""
+        return {category: len(recipes) for category, recipes in self._categories.items()}
+
+    def get(self, category):
+        """CategoryRecipes of a category, or None if it has no recipes"""
+        recipes = self._categories.get(category)
+        return recipes if recipes else None
+
+    def random_recipe(self, category):
+        """A random {"name", "recipe_url"} of a category, or None if it has no recipes"""
+        recipes = self.get(category)
+        if recipes is None:
+            return None
+        return recipes[self.rng.randrange(len(recipes))]
+
+    def search(self, query, limit=10):
+        """[(category, {"name", "recipe_url"})] of the recipes best matching `query`"""
+        categories, index = self._snapshot
+        results, urls = [], set()
+        # A recipe can be listed in several categories, ask for extra matches to fill the limit after removing them
+        for score, (category, position) in index.search(query, limit * 2):
+            recipe = categories[category][position]
+            if recipe["recipe_url"] not in urls:
+                urls.add(recipe["recipe_url"])
+                results.append((category, recipe))
+                if len(results) == limit:
+                    break
+        return results
@@ -0,0 +1,155 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MASK64 = (1 << 64) - 1
+
+
+def _mix(value):
+    """splitmix64 finalizer, a cheap 64-bit hash"""
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+class FeistelPermutation:
+    """A pseudo-random permutation of range(size) defined by a seed alone.
+
+    A balanced Feistel network keyed by the seed permutes the smallest
+    power-of-four domain holding `size` values; positions that land outside
+    range(size) are encrypted again (cycle walking), which takes fewer than
+    four rounds on average. permutation[i] is computed in O(1) without ever
+    materializing the shuffled list.
+    """
+    __slots__ = ('size', 'half_bits', 'half_mask', 'keys')
+
+    def __init__(self, size, seed, rounds=4):
+        bits = max(2, (size - 1).bit_length())
+        bits += bits & 1
+        self.size = size
+        self.half_bits = bits // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.keys = tuple(_mix((seed + round_index * 0x9E3779B97F4A7C15) & MASK64) for round_index in range(rounds))
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ (_mix(right ^ key) & self.half_mask)
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def __len__(self):
+        return self.size
+
+
+class RecipeCursors:
+    """Per-user, per-category position in a shuffled order of the recipes, saved in SQLite.
+
+    Recipes are identified by their ordinal counted from the oldest one,
+    which an incremental refresh does not change: it only puts new recipes
+    in front of the known ones. A cursor walks a FeistelPermutation of one
+    segment of ordinals at a time and is five integers: the seed, the
+    offset of the next recipe in the segment, the segment bounds and the
+    number of recipes known. Recipes added by a refresh form a new segment,
+    walked in its own shuffled order once the current one is done, so a
+    user sees every recipe of a category once before any repeats; then, or
+    when the category shrinks, a new seed starts a new order over all of
+    them. Cursors are read once at startup and updates are written in
+    batches like the other stores of the bots; call flush() periodically.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS recipe_walks (
+            user_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            seed INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            segment_start INTEGER NOT NULL,
+            segment_end INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (user_id, category)
+        );
+    """
+
+    SAVE_CURSOR = ("INSERT OR REPLACE INTO recipe_walks "
+                   "(user_id, category, seed, position, segment_start, segment_end, size) VALUES (?, ?, ?, ?, ?, ?, ?)")
+    SELECT_CURSORS = "SELECT user_id, category, seed, position, segment_start, segment_end, size FROM recipe_walks"
+
+    def __init__(self, path, batch_size=200, commit_interval=5.0, rng=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.rng = rng or random.SystemRandom()
+        self._cursors = {}  # (user_id, category) -> [seed, position, segment_start, segment_end, size]
+        self._dirty = set()
+        self._first_pending_at = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+        for user_id, category, *cursor in self._conn.execute(self.SELECT_CURSORS):
+            self._cursors[(user_id, category)] = cursor
+        logger.info(f'Loaded {len(self._cursors)} recipe cursors from {path}')
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def _segment(self, start, end, size):
+        return [self.rng.getrandbits(63), 0, start, end, size]
+
+    def next_index(self, user_id, category, size):
+        """Index of the next recipe `user_id` has not seen among the `size` recipes of a category"""
+        if size <= 0:
+            raise ValueError(f'No recipes in {category}')
+        key = (user_id, category)
+        with self._lock:
+            cursor = self._cursors.get(key)
+            if cursor is None or size < cursor[4]:
+                cursor = self._cursors[key] = self._segment(0, size, size)
+            cursor[4] = size
+            seed, position, start, end, _ = cursor
+            if position >= end - start:
+                # Segment done: walk the recipes added meanwhile, or start over
+                cursor = self._cursors[key] = self._segment(end, size, size) if end < size else self._segment(0, size, size)
+                seed, position, start, end, _ = cursor
+            cursor[1] = position + 1
+            self._dirty.add(key)
+            self._queued()
+        return size - 1 - (start + FeistelPermutation(end - start, seed)[position])
+
+    def _queued(self):
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+        if len(self._dirty) >= self.batch_size or time.monotonic() - self._first_pending_at >= self.commit_interval:
+            self._flush()
+
+    def _flush(self):
+        if not self._dirty:
+            return
+        with self._conn:
+            self._conn.executemany(self.SAVE_CURSOR, [(user_id, category, *self._cursors[(user_id, category)])
+                                                      for user_id, category in self._dirty])
+        self._dirty = set()
+        self._first_pending_at = None
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._conn.close()
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common.html_extract import RecordExtractor, Selector, css_class, parse_html
+
+logger = logging.getLogger(__name__)
+
+SITE_URL = "https://www.giallozafferano.it"
+
+# Categories whose listing has no "total pages" counter, the last page link gives the count instead
+PAGE_LINK_CATEGORIES = ("Bevande", "Salse-e-Sughi")
+
+
+def category_page_url(site_url, category, page_number):
+    if page_number == 1:
+        return f"{site_url}/ricette-cat/{category}"
+    return f"{site_url}/ricette-cat/page{page_number}/{category}"
+
+
+# Selectors of a listing page, compiled once
+RECIPE_CARDS = RecordExtractor("//article", required=("name", "recipe_url"),
+                               name=Selector("(.//h2)[1]//a"), recipe_url=Selector("(.//h2)[1]//a", "href"))
+TOTAL_PAGES = Selector(f"//span[{css_class('disabled', 'total-pages')}]")
+PAGE_LINKS = Selector(f"//a[{css_class('page')}]")
+
+
+def parse_category_page(text, category):
+    """([{"name", "recipe_url"}], number of pages of the category or None) of a listing page"""
+    root = parse_html(text)
+    total_pages = (PAGE_LINKS.last if category in PAGE_LINK_CATEGORIES else TOTAL_PAGES.first)(root)
+    return RECIPE_CARDS.extract(root), int(total_pages) if total_pages else None
+
+
+class FetchStats:
+    """Pages and bytes downloaded by a refresh, shared by the category tasks"""
+
+    def __init__(self):
+        self.pages = 0
+        self.not_modified = 0
+        self.unchanged = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, size, not_modified=False, unchanged=False):
+        with self._lock:
+            self.pages += 1
+            self.bytes += size
+            self.not_modified += not_modified
+            self.unchanged += unchanged
+
+    @property
+    def pages_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"{self.pages} pages, {self.not_modified} not modified, {self.unchanged} unchanged, "
+                f"{self.bytes / 1024:.0f} KB, {self.pages_per_second:.1f} pages/s")
+
+
+class PageState:
+    """ETag, Last-Modified and content hash of every listing page, saved as JSON between refreshes.
+
+    They turn the next fetch of a page into a conditional request: the site
+    answers 304 Not Modified without a body, or the body hashes the same as
+    last time; either way the page holds no new recipes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._pages = {}  # url -> {"etag", "last_modified", "hash"}
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._pages = json.load(f)
+            except FileNotFoundError:
+                pass
+            except ValueError as e:
+                logger.warning(f'Ignoring the unreadable page state {path}: {e}')
+
+    def conditional_headers(self, url):
+        page = self._pages.get(url)
+        if page is None:
+            return {}
+        headers = {}
+        if page.get("etag"):
+            headers["If-None-Match"] = page["etag"]
+        if page.get("last_modified"):
+            headers["If-Modified-Since"] = page["last_modified"]
+        return headers
+
+    def update(self, url, etag, last_modified, digest):
+        """Remember a page just downloaded; returns True if its content is the same as last time"""
+        previous = self._pages.get(url)
+        self._pages[url] = {"etag": etag, "last_modified": last_modified, "hash": digest}
+        return previous is not None and previous.get("hash") == digest
+
+    def forget_category(self, site_url, category):
+        """Drop the state of a category's pages, e.g. after its refresh failed before its recipes were saved"""
+        first_page = category_page_url(site_url, category, 1)
+        pages_prefix = f"{site_url}/ricette-cat/page"
+        for url in list(self._pages):
+            if url == first_page or (url.startswith(pages_prefix) and url.endswith("/" + category)):
+                del self._pages[url]
+
+    def save(self):
+        if self.path is None:
+            return
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(self._pages, f)
+        os.replace(temporary_path, self.path)
+
+
+class FetchError(Exception):
+    """A listing page answered with an HTTP error"""
+
+
+def read_page(response, page_state, stats, conditional=True):
+    """Text of a fetched page, or None if it has not changed since the last refresh (only when `conditional`)"""
+    if response.status == 304:
+        stats.add(0, not_modified=True)
+        return None
+    if response.status >= 400:
+        raise FetchError(f'{response.url} answered {response.status}')
+    unchanged = page_state.update(response.url, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                  hashlib.sha256(response.body).hexdigest())
+    stats.add(len(response.body), unchanged=unchanged)
+    if conditional and unchanged:
+        return None
+    return response.body.decode('utf-8', errors='replace')
+
+
+async def scrape_category(crawler, category, site_url=SITE_URL, page_state=None, stats=None, known_urls=None):
+    """Fetch the listing pages of a category with an AsyncCrawler and return (category, recipes).
+
+    Without `known_urls` the first page gives the number of pages and all
+    the others are requested at once, the crawler bounds the concurrency.
+    With `known_urls` the refresh is incremental: the listing shows the
+    newest recipes first, so pages are walked in order up to the first one
+    that has not changed or that reaches a recipe already known, and only
+    the new recipes are returned. Pages are parsed in a worker thread so the
+    event loop keeps downloading meanwhile.
+    """
+    page_state = page_state if page_state is not None else PageState()
+    stats = stats if stats is not None else FetchStats()
+    incremental = known_urls is not None
+    loop = asyncio.get_running_loop()
+
+    async def fetch(page_number):
+        url = category_page_url(site_url, category, page_number)
+        response = await crawler.fetch(url, page_state.conditional_headers(url) if incremental else None)
+        text = read_page(response, page_state, stats, conditional=incremental)
+        if text is None:
+            return None
+        return await loop.run_in_executor(None, parse_category_page, text, category)
+
+    page = await fetch(1)
+    if page is None:
+        return category, []
+    recipes, total_pages = page
+    total_pages = total_pages or 1
+
+    if not incremental:
+        for page in await asyncio.gather(*(fetch(page_number) for page_number in range(2, total_pages + 1))):
+            recipes.extend(page[0])
+        return category, recipes
+
+    new_recipes = []
+    page_number = 1
+    while True:
+        fresh = [recipe for recipe in recipes if recipe["recipe_url"] not in known_urls]
+        new_recipes.extend(fresh)
+        page_number += 1
+        if len(fresh) < len(recipes) or page_number > total_pages:
+            return category, new_recipes
+        page = await fetch(page_number)
+        if page is None:
+            return category, new_recipes
+        recipes = page[0]
@@ -0,0 +1,191 @@
+import bisect
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+import zlib
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Articles, prepositions and conjunctions that would match most recipe names
+STOPWORDS = frozenset("""
+    a ad al alla alle allo agli ai all coi col con da dal dalla dalle dallo dai dagli dall de del della delle dello
+    dei degli dell di e ed gli i il in l la le lo nel nella nelle nello nei negli nell o per su sul sulla sulle sullo
+    sui sugli sull tra fra un una uno
+""".split())
+
+
+def fold(text):
+    """Lower-case `text` and strip its accents: 'Crème brûlée' -> 'creme brulee'"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    """Accent-folded tokens of `text` without Italian stopwords; "dell'uovo" -> ['uovo']"""
+    return [token for token in TOKEN_PATTERN.findall(fold(text)) if token not in STOPWORDS]
+
+
+def fingerprint(all_recipes):
+    """CRC of the categories and recipe names, tells whether a saved index matches the recipes"""
+    crc = 0
+    for category, names in all_recipes:
+        crc = zlib.crc32(category.encode('utf-8'), crc)
+        for name in names:
+            crc = zlib.crc32(name.encode('utf-8'), crc)
+    return crc
+
+
+class SearchIndexBuilder:
+    """Collects postings one category at a time, as the scraper finishes them"""
+
+    def __init__(self):
+        self.docs = []  # doc id -> (category, position in the category)
+        self.lengths = []  # doc id -> number of tokens
+        self.postings = {}  # term -> {doc id: term frequency}
+        self._categories = []  # (category, names) in the order they were added
+
+    def add_category(self, category, names):
+        names = list(names)
+        self._categories.append((category, names))
+        for position, name in enumerate(names):
+            doc_id = len(self.docs)
+            tokens = tokenize(name)
+            self.docs.append((category, position))
+            self.lengths.append(len(tokens))
+            for token in tokens:
+                frequencies = self.postings.setdefault(token, {})
+                frequencies[doc_id] = frequencies.get(doc_id, 0) + 1
+
+    def build(self):
+        terms = sorted(self.postings)
+        postings = {term: (list(self.postings[term]), list(self.postings[term].values())) for term in terms}
+        return SearchIndex(self.docs, self.lengths, terms, postings, fingerprint(self._categories))
+
+
+class SearchIndex:
+    """Inverted index over recipe names with BM25 ranking.
+
+    Each term maps to the ids of the recipes containing it and the term
+    frequencies. The vocabulary is kept sorted, so every query token also
+    matches the terms it is a prefix of ('carbo' finds 'carbonara') through
+    a bisect instead of a scan; prefix matches score PREFIX_WEIGHT of an
+    exact one. The BM25 weight of every posting is computed when the index
+    is built or loaded, so a query only sums the precomputed weights of its
+    own terms' postings.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    PREFIX_WEIGHT = 0.6
+    MIN_PREFIX_LENGTH = 3
+    MAX_PREFIX_TERMS = 64
+
+    def __init__(self, docs, lengths, terms, postings, fingerprint):
+        self.docs = docs
+        self.lengths = lengths
+        self.terms = terms
+        self.postings = postings
+        self.fingerprint = fingerprint
+        self.average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        self._weights = {term: self._bm25(ids, frequencies) for term, (ids, frequencies) in postings.items()}
+
+    def _bm25(self, ids, frequencies):
+        idf = math.log(1 + (len(self.docs) - len(ids) + 0.5) / (len(ids) + 0.5))
+        weights = []
+        for doc_id, frequency in zip(ids, frequencies):
+            norm = self.K1 * (1 - self.B + self.B * self.lengths[doc_id] / self.average_length)
+            weights.append(idf * frequency * (self.K1 + 1) / (frequency + norm))
+        return weights
+
+    def __len__(self):
+        return len(self.docs)
+
+    @classmethod
+    def from_recipes(cls, all_recipes):
+        """Build from {category: [{"name", "recipe_url"}]}"""
+        builder = SearchIndexBuilder()
+        for category, recipes in all_recipes.items():
+            builder.add_category(category, (recipe["name"] for recipe in recipes))
+        return builder.build()
+
+    def _expand(self, token):
+        """[(term, weight)] matched by a query token: itself, then the terms it prefixes"""
+        matches = [(token, 1.0)] if token in self.postings else []
+        if len(token) < self.MIN_PREFIX_LENGTH:
+            return matches
+        start = bisect.bisect_right(self.terms, token)
+        for term in self.terms[start:start + self.MAX_PREFIX_TERMS]:
+            if not term.startswith(token):
+                break
+            matches.append((term, self.PREFIX_WEIGHT))
+        return matches
+
+    def search(self, query, limit=10):
+        """[(score, (category, position))] of the best matches, best first"""
+        scores = {}
+        for token in set(tokenize(query)):
+            expanded = self._expand(token)
+            if len(expanded) == 1:
+                term, factor = expanded[0]
+                for doc_id, weight in zip(self.postings[term][0], self._weights[term]):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight * factor
+                continue
+            matched = {}
+            for term, factor in expanded:
+                for doc_id, weight in zip(self.postings[term][0], self._weights[term]):
+                    # A token counts once per recipe, through its best matching term
+                    weight *= factor
+                    if weight > matched.get(doc_id, 0.0):
+                        matched[doc_id] = weight
+            for doc_id, weight in matched.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [(score, self.docs[doc_id]) for doc_id, score in best]
+
+    def save(self, path):
+        """Write the index as JSON, through a temporary file so a crash never leaves half an index"""
+        data = {
+            'version': INDEX_VERSION,
+            'fingerprint': self.fingerprint,
+            'docs': self.docs,
+            'lengths': self.lengths,
+            'postings': {term: self.postings[term] for term in self.terms},
+        }
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path, expected_fingerprint=None):
+        """Read an index saved by save(); None if missing, outdated or built from other recipes"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f'Ignoring the unreadable search index {path}: {e}')
+            return None
+        if data.get('version') != INDEX_VERSION:
+            return None
+        if expected_fingerprint is not None and data['fingerprint'] != expected_fingerprint:
+            logger.info(f'Search index {path} does not match the recipes, rebuilding it')
+            return None
+        postings = {term: (ids, frequencies) for term, (ids, frequencies) in data['postings'].items()}
+        return cls([tuple(doc) for doc in data['docs']], data['lengths'], list(postings), postings,
+                   data['fingerprint'])
+
+
+def index_path(recipes_path):
+    """The search index is saved next to the recipes: recipes.json -> recipes.index.json"""
+    root, extension = os.path.splitext(recipes_path)
+    return root + '.index' + (extension or '.json')